@@ -0,0 +1,155 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; carries the HTTP status and Retry-After seconds"""
+
+    def __init__(self, status, retry_after, reason):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded, per-client fair queue.
+
+    Up to max_concurrent requests run at once. Others wait in a per-client
+    FIFO; freed slots are handed out round-robin across clients so one noisy
+    client can't starve the rest. Requests are rejected immediately when the
+    client already has max_queue_per_client waiting (429) or the whole queue
+    holds max_queue (503), and rejected after queue_timeout seconds of waiting
+    (503), so admitted requests never sit behind an unbounded backlog.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, max_queue_per_client, queue_timeout):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._queues = {}
+        self._turns = deque()
+        # Moving average of service time, used for Retry-After
+        self._service_time = 1.0
+
+    @contextmanager
+    def admit(self, client_id):
+        """Hold a slot for the duration of the with block, or raise AdmissionRejected"""
+        self.acquire(client_id)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def acquire(self, client_id):
+        with self._lock:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                metrics.ADMISSION.labels(self.name, 'admitted').inc()
+                return
+
+            queue = self._queues.get(client_id)
+            if queue is not None and len(queue) >= self.max_queue_per_client:
+                metrics.ADMISSION.labels(self.name, 'rejected_client').inc()
+                raise AdmissionRejected(429, self._retry_after(), 'Too many requests from this client, please retry shortly')
+            if self._waiting >= self.max_queue:
+                metrics.ADMISSION.labels(self.name, 'rejected_full').inc()
+                raise AdmissionRejected(503, self._retry_after(), 'Server is busy, please retry shortly')
+
+            waiter = _Waiter()
+            if queue is None:
+                queue = self._queues[client_id] = deque()
+                self._turns.append(client_id)
+            queue.append(waiter)
+            self._waiting += 1
+
+        queued_at = time.perf_counter()
+        waiter.event.wait(self.queue_timeout)
+        metrics.ADMISSION_WAIT.labels(self.name).observe(time.perf_counter() - queued_at)
+
+        with self._lock:
+            if waiter.granted:
+                metrics.ADMISSION.labels(self.name, 'queued').inc()
+                return
+            # Timed out: leave the queue without taking a slot
+            queue = self._queues.get(client_id)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                self._waiting -= 1
+                if not queue:
+                    del self._queues[client_id]
+                    self._turns.remove(client_id)
+            metrics.ADMISSION.labels(self.name, 'timeout').inc()
+            raise AdmissionRejected(503, self._retry_after(), 'Server is busy, please retry shortly')
+
+    def release(self, service_time=None):
+        with self._lock:
+            if service_time is not None:
+                self._service_time = 0.9 * self._service_time + 0.1 * service_time
+            self._active -= 1
+
+            # Hand the slot to the next client in round-robin order
+            while self._turns and self._active < self.max_concurrent:
+                client_id = self._turns.popleft()
+                queue = self._queues[client_id]
+                waiter = queue.popleft()
+                self._waiting -= 1
+                if queue:
+                    self._turns.append(client_id)
+                else:
+                    del self._queues[client_id]
+                waiter.granted = True
+                self._active += 1
+                waiter.event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self._active,
+                'waiting': self._waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'avg_service_ms': int(self._service_time * 1000)
+            }
+
+    def _retry_after(self):
+        # Time for the current backlog to drain, at least one second
+        backlog = self._waiting + self._active
+        return max(1, int(backlog * self._service_time / self.max_concurrent + 0.999))
+
+
+chat_admission = AdmissionController(
+    'chat',
+    max_concurrent=int(os.getenv("CHAT_MAX_CONCURRENT", "8")),
+    max_queue=int(os.getenv("CHAT_MAX_QUEUE", "32")),
+    max_queue_per_client=int(os.getenv("CHAT_MAX_QUEUE_PER_CLIENT", "4")),
+    queue_timeout=float(os.getenv("CHAT_QUEUE_TIMEOUT", "2"))
+)
+
+create_admission = AdmissionController(
+    'create_chatbot',
+    max_concurrent=int(os.getenv("CREATE_MAX_CONCURRENT", "2")),
+    max_queue=int(os.getenv("CREATE_MAX_QUEUE", "8")),
+    max_queue_per_client=int(os.getenv("CREATE_MAX_QUEUE_PER_CLIENT", "1")),
+    queue_timeout=float(os.getenv("CREATE_QUEUE_TIMEOUT", "10"))
+)
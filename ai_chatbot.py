@@ -3,6 +3,15 @@ import os
 from dotenv import load_dotenv
 import time
 import re
+import hashlib
+from datetime import datetime, timedelta
+
+import metrics
+import database
+import usage
+import bot_snapshots
+from knowledge import CompanyKnowledge, as_knowledge
+from write_behind import answer_writer
 
 load_dotenv()
 
@@ -14,28 +23,73 @@ if GEMINI_API_KEY:
 else:
     model = None
 
-# Response cache
+# Response cache (L1, per process): {context_hash (or tenant): {normalized question: answer}}
 response_cache = {}
 
-def generate_response(user_question, company_context, company_name):
-    """Generate intelligent AI response with smart fallback"""
-    start_time = time.time()
-    
-    # Try Gemini API first
-    if model:
-        try:
-            cache_key = f"{company_name}:{user_question.lower().strip()}"
-            if cache_key in response_cache:
-                response_time = int((time.time() - start_time) * 1000)
-                return {
-                    'success': True,
-                    'response': response_cache[cache_key],
-                    'response_time_ms': response_time,
-                    'cached': True
-                }
-            
-            # Build prompt
-            prompt = f"""You are a helpful AI assistant for {company_name}. Answer the user's question based ONLY on the provided information. Be conversational, natural, and specific. Give different answers for different questions.
+# Gemini answers are also kept in the database (L2) so they survive restarts
+ANSWER_STORE_ENABLED = os.getenv("ANSWER_STORE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+
+def normalize_question(user_question):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return ' '.join(user_question.lower().split()).rstrip('?!. ')
+
+def question_hash(user_question):
+    return hashlib.sha256(normalize_question(user_question).encode('utf-8')).hexdigest()
+
+def make_cache_key(user_question, company_name, company_id=None, context_hash=None):
+    """
+    (scope, question) cache key. Scoped to the context hash when known, so
+    tenants with the same site and content share answers; else to the tenant.
+    """
+    scope = context_hash or (company_id if company_id is not None else company_name)
+    return scope, normalize_question(user_question)
+
+def forget_context(context_hash):
+    """Drop the L1 answers for a context (no resident bot uses it any more)"""
+    response_cache.pop(context_hash, None)
+
+# Answers are cached with this placeholder where the company name goes, so
+# tenants sharing a context each see their own name. The prompt asks Gemini
+# to write it, and fallback answers are generated with it.
+COMPANY_PLACEHOLDER = '{{company_name}}'
+
+def is_distinctive_name(company_name):
+    """True if a name is unlikely to occur in an answer as ordinary words"""
+    return len(company_name.split()) >= 2
+
+def shareable_answer(response_text, company_name):
+    """
+    The answer with the company's name as COMPANY_PLACEHOLDER, or None if it
+    can't be shared: it spells out a name that could also be an ordinary word
+    ("Apex", "Bright"), so replacing it might change the text.
+    """
+    if not company_name:
+        return response_text
+    name = re.compile(r'(?<!\w)' + re.escape(company_name) + r'(?!\w)')
+    if not name.search(response_text):
+        return response_text
+    if not is_distinctive_name(company_name):
+        return None
+    return name.sub(COMPANY_PLACEHOLDER, response_text)
+
+def personalize_answer(response_text, company_name):
+    return response_text.replace(COMPANY_PLACEHOLDER, company_name)
+
+def cache_answer(cache_key, answer):
+    """Keep a shareable answer in L1 (None: not shareable, not cached)"""
+    if answer is None:
+        return
+    scope, question = cache_key
+    response_cache.setdefault(scope, {})[question] = answer
+
+GENERATION_CONFIG = {'temperature': 0.8, 'max_output_tokens': 500}
+
+def build_prompt(user_question, company_context, company_name):
+    """Build the Gemini prompt for a question (company_context: str or CompanyKnowledge)"""
+    if isinstance(company_context, CompanyKnowledge):
+        company_context = company_context.text
+    return f"""You are a helpful AI assistant for {company_name}. Answer the user's question based ONLY on the provided information. Be conversational, natural, and specific. Give different answers for different questions. Wherever you would write the name "{company_name}", write {COMPANY_PLACEHOLDER} instead.
 
 Company Information:
 {company_context}
@@ -43,58 +97,233 @@ Company Information:
 User Question: {user_question}
 
 Provide a helpful, natural response (2-4 sentences):"""
+
+def get_safety_settings():
+    """Safety settings passed to every Gemini call"""
+    from google.generativeai.types import HarmCategory, HarmBlockThreshold
+    
+    return {
+        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+    }
+
+def is_quota_error(error_msg):
+    """True if a Gemini error means we are rate-limited (use the fallback)"""
+    return '429' in error_msg or 'quota' in error_msg.lower()
+
+def snapshot_answer(scope, question):
+    """Answer exported with the bot snapshot file (SNAPSHOT_FILE), copied into L1; None if it has none"""
+    snapshots = bot_snapshots.current()
+    if snapshots is None:
+        return None
+    answer = snapshots.answer(scope, question_hash(question))
+    if answer is not None:
+        response_cache.setdefault(scope, {})[question] = answer
+    return answer
+
+def cached_result(cache_key, company_name, start_time):
+    """Result for a cache hit (in process or in the snapshot file), or None"""
+    scope, question = cache_key
+    with metrics.time_stage('cache') as stage:
+        cached = response_cache.get(scope, {}).get(question)
+        if cached is None:
+            cached = snapshot_answer(scope, question)
+        stage.outcome = 'hit' if cached is not None else 'miss'
+    
+    if cached is not None:
+        response_time = int((time.time() - start_time) * 1000)
+        return {
+            'success': True,
+            'response': personalize_answer(cached, company_name),
+            'response_time_ms': response_time,
+            'cached': True
+        }
+    return None
+
+def stored_result(user_question, company_name, company_id, context_hash, cache_key, start_time):
+    """Result for an answer found in the database (L2), or None"""
+    if not ANSWER_STORE_ENABLED or not context_hash or company_id is None or company_id <= 0:
+        return None
+    
+    with metrics.time_stage('cache.l2') as stage:
+        stored = database.get_cached_answer(context_hash, question_hash(user_question))
+        stage.outcome = 'hit' if stored is not None else 'miss'
+    
+    if stored is None:
+        return None
+    scope, question = cache_key
+    response_cache.setdefault(scope, {})[question] = stored
+    return {
+        'success': True,
+        'response': personalize_answer(stored, company_name),
+        'response_time_ms': int((time.time() - start_time) * 1000),
+        'cached': True
+    }
+
+def remember_answer(user_question, company_id, context_hash, answer):
+    """Queue a shareable Gemini answer for the database (L2); never blocks the request"""
+    if answer is None or not ANSWER_STORE_ENABLED or not context_hash or company_id is None or company_id <= 0:
+        return
+    expires_at = datetime.now() + timedelta(seconds=ANSWER_CACHE_TTL)
+    answer_writer.submit((context_hash, question_hash(user_question), answer, expires_at), block=False)
+
+def answer_text(response):
+    """A Gemini response's text, or None if it produced none"""
+    if response and hasattr(response, 'text') and response.text:
+        return response.text.strip()
+    return None
+
+def ai_result(text, company_name, start_time):
+    """Result for a Gemini answer"""
+    response_time = int((time.time() - start_time) * 1000)
+    return {
+        'success': True,
+        'response': personalize_answer(text, company_name),
+        'response_time_ms': response_time,
+        'cached': False
+    }
+
+def record_usage(company_id, response, llm_start, error=False):
+    """Account a Gemini call's tokens and latency to the tenant"""
+    usage_metadata = getattr(response, 'usage_metadata', None)
+    usage.meter.record(
+        company_id,
+        prompt_tokens=getattr(usage_metadata, 'prompt_token_count', 0) or 0,
+        output_tokens=getattr(usage_metadata, 'candidates_token_count', 0) or 0,
+        latency_ms=int((time.time() - llm_start) * 1000),
+        error=error
+    )
+
+def error_result(error_msg, start_time):
+    """Result for a non-quota Gemini error"""
+    response_time = int((time.time() - start_time) * 1000)
+    return {
+        'success': False,
+        'error': f'AI Error: {error_msg}',
+        'response_time_ms': response_time
+    }
+
+def fallback_result(user_question, company_context, company_name, cache_key, start_time, over_budget=False):
+    """Answer with the intelligent fallback"""
+    response_time = int((time.time() - start_time) * 1000)
+    with metrics.time_stage('fallback') as stage:
+        fallback_response = generate_intelligent_fallback(user_question, company_context, COMPANY_PLACEHOLDER)
+        if over_budget:
+            stage.outcome = 'budget'
+    
+    # Not cached when over budget, so the tenant gets Gemini answers again once its budget resets
+    if not over_budget:
+        cache_answer(cache_key, fallback_response)
+    
+    result = {
+        'success': True,
+        'response': personalize_answer(fallback_response, company_name),
+        'response_time_ms': response_time,
+        'fallback': True
+    }
+    if over_budget:
+        result['over_budget'] = True
+    return result
+
+def get_cached_response(user_question, company_name, company_id=None, context_hash=None, stored=True):
+    """
+    Answer from the in-process cache, then (unless stored=False) the database
+    answer store, without calling Gemini; None if neither has it
+    """
+    start_time = time.time()
+    cache_key = make_cache_key(user_question, company_name, company_id, context_hash)
+    result = cached_result(cache_key, company_name, start_time)
+    if result or not stored:
+        return result
+    return stored_result(user_question, company_name, company_id, context_hash, cache_key, start_time)
+
+def get_stored_response(user_question, company_name, company_id, context_hash):
+    """Answer from the database answer store only (a blocking read), or None"""
+    cache_key = make_cache_key(user_question, company_name, company_id, context_hash)
+    return stored_result(user_question, company_name, company_id, context_hash, cache_key, time.time())
+
+def generation_steps(user_question, company_context, company_name, company_id=None, context_hash=None):
+    """
+    Everything generate_response does except calling Gemini, shared by the
+    sync and async versions. A generator: it yields the prompt once if it
+    needs the model, is sent the response (or thrown the call's exception),
+    and returns the result.
+    """
+    start_time = time.time()
+    cache_key = make_cache_key(user_question, company_name, company_id, context_hash)
+    
+    # Try Gemini API first
+    if model:
+        try:
+            result = cached_result(cache_key, company_name, start_time)
+            if result:
+                return result
             
-            from google.generativeai.types import HarmCategory, HarmBlockThreshold
-            
-            safety_settings = {
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            }
-            
-            response = model.generate_content(
-                prompt,
-                generation_config={'temperature': 0.8, 'max_output_tokens': 500},
-                safety_settings=safety_settings
-            )
+            if usage.meter.over_budget(company_id):
+                return fallback_result(user_question, company_context, company_name, cache_key, start_time,
+                                       over_budget=True)
             
-            if response and hasattr(response, 'text') and response.text:
-                response_text = response.text.strip()
-                response_cache[cache_key] = response_text
-                response_time = int((time.time() - start_time) * 1000)
+            with metrics.time_stage('llm') as stage:
+                llm_start = time.time()
+                try:
+                    response = yield build_prompt(user_question, company_context, company_name)
+                except Exception as e:
+                    stage.outcome = 'quota' if is_quota_error(str(e)) else 'error'
+                    record_usage(company_id, None, llm_start, error=True)
+                    raise
+                
+                record_usage(company_id, response, llm_start)
                 
-                return {
-                    'success': True,
-                    'response': response_text,
-                    'response_time_ms': response_time,
-                    'cached': False
-                }
+                text = answer_text(response)
+                if text is None:
+                    stage.outcome = 'empty'
+            
+            if text is not None:
+                answer = shareable_answer(text, company_name)
+                cache_answer(cache_key, answer)
+                remember_answer(user_question, company_id, context_hash, answer)
+                return ai_result(text, company_name, start_time)
                 
         except Exception as e:
             error_msg = str(e)
-            if '429' not in error_msg and 'quota' not in error_msg.lower():
+            if not is_quota_error(error_msg):
                 # Not a quota error, return error
-                response_time = int((time.time() - start_time) * 1000)
-                return {
-                    'success': False,
-                    'error': f'AI Error: {error_msg}',
-                    'response_time_ms': response_time
-                }
+                return error_result(error_msg, start_time)
     
     # Use intelligent fallback
-    response_time = int((time.time() - start_time) * 1000)
-    fallback_response = generate_intelligent_fallback(user_question, company_context, company_name)
-    
-    cache_key = f"{company_name}:{user_question.lower().strip()}"
-    response_cache[cache_key] = fallback_response
-    
-    return {
-        'success': True,
-        'response': fallback_response,
-        'response_time_ms': response_time,
-        'fallback': True
-    }
+    return fallback_result(user_question, company_context, company_name, cache_key, start_time)
+
+def generate_response(user_question, company_context, company_name, company_id=None, context_hash=None):
+    """Generate intelligent AI response with smart fallback"""
+    steps = generation_steps(user_question, company_context, company_name, company_id, context_hash)
+    try:
+        prompt = next(steps)
+        try:
+            response = model.generate_content(
+                prompt, generation_config=GENERATION_CONFIG, safety_settings=get_safety_settings()
+            )
+        except Exception as e:
+            steps.throw(e)
+        steps.send(response)
+    except StopIteration as done:
+        return done.value
+
+async def generate_response_async(user_question, company_context, company_name, company_id=None, context_hash=None):
+    """Async version of generate_response for the asyncio serving mode"""
+    steps = generation_steps(user_question, company_context, company_name, company_id, context_hash)
+    try:
+        prompt = next(steps)
+        try:
+            response = await model.generate_content_async(
+                prompt, generation_config=GENERATION_CONFIG, safety_settings=get_safety_settings()
+            )
+        except Exception as e:
+            steps.throw(e)
+        steps.send(response)
+    except StopIteration as done:
+        return done.value
 
 def generate_intelligent_fallback(user_question, company_context, company_name):
     """Smart fallback that gives contextual, varied responses"""
@@ -121,48 +350,8 @@ def generate_intelligent_fallback(user_question, company_context, company_name):
         return generate_general_answer(data, company_name, question_lower)
 
 def parse_context(context):
-    """Parse context into structured data"""
-    data = {
-        'title': '',
-        'description': '',
-        'headings': [],
-        'services': [],
-        'paragraphs': [],
-        'emails': [],
-        'phones': []
-    }
-    
-    lines = context.split('\n')
-    current_section = None
-    
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        
-        if line.startswith('COMPANY:'):
-            data['title'] = line.replace('COMPANY:', '').strip()
-        elif line.startswith('DESCRIPTION:'):
-            data['description'] = line.replace('DESCRIPTION:', '').strip()
-        elif 'KEY TOPICS:' in line:
-            current_section = 'headings'
-        elif 'SERVICES & FEATURES:' in line:
-            current_section = 'services'
-        elif 'DETAILED CONTENT:' in line:
-            current_section = 'paragraphs'
-        elif 'CONTACT' in line:
-            current_section = 'contact'
-        elif current_section == 'headings' and line.startswith('•'):
-            data['headings'].append(line[1:].strip())
-        elif current_section == 'services' and line.startswith('•'):
-            data['services'].append(line[1:].strip())
-        elif current_section == 'paragraphs' and len(line) > 30:
-            data['paragraphs'].append(line)
-        elif current_section == 'contact':
-            emails = re.findall(r'[\w\.-]+@[\w\.-]+\.\w+', line)
-            data['emails'].extend(emails)
-    
-    return data
+    """Parse context into structured data (a compact, immutable CompanyKnowledge)"""
+    return as_knowledge(context)
 
 def detect_intent(question):
     """Detect what the user is asking about"""
@@ -181,23 +370,23 @@ def detect_intent(question):
 
 def generate_services_answer(data, company_name, question):
     """Generate answer about services"""
-    if data['services']:
+    if data.services:
         # Pick relevant services based on question
         if 'ai' in question:
-            relevant = [s for s in data['services'] if 'ai' in s.lower() or 'artificial' in s.lower()]
+            relevant = [s for s in data.services if 'ai' in s.lower() or 'artificial' in s.lower()]
         elif 'web' in question or 'website' in question:
-            relevant = [s for s in data['services'] if 'web' in s.lower() or 'website' in s.lower()]
+            relevant = [s for s in data.services if 'web' in s.lower() or 'website' in s.lower()]
         elif 'mobile' in question or 'app' in question:
-            relevant = [s for s in data['services'] if 'mobile' in s.lower() or 'app' in s.lower()]
+            relevant = [s for s in data.services if 'mobile' in s.lower() or 'app' in s.lower()]
         else:
-            relevant = data['services'][:6]
+            relevant = data.services[:6]
         
         if relevant:
             return f"{company_name} offers several key services:\n\n" + '\n'.join([f"• {s}" for s in relevant[:5]])
         else:
-            return f"{company_name} provides:\n\n" + '\n'.join([f"• {s}" for s in data['services'][:6]])
-    elif data['description']:
-        return f"{company_name} is {data['description']}"
+            return f"{company_name} provides:\n\n" + '\n'.join([f"• {s}" for s in data.services[:6]])
+    elif data.description:
+        return f"{company_name} is {data.description}"
     else:
         return f"{company_name} offers various technology and business solutions. Visit their website for detailed service information."
 
@@ -205,29 +394,29 @@ def generate_about_answer(data, company_name, question):
     """Generate answer about the company"""
     response_parts = []
     
-    if data['description']:
-        response_parts.append(data['description'])
+    if data.description:
+        response_parts.append(data.description)
     
-    if data['paragraphs']:
+    if data.paragraphs:
         # Find most relevant paragraph
-        for para in data['paragraphs'][:3]:
+        for para in data.paragraphs[:3]:
             if any(word in para.lower() for word in ['company', 'business', 'founded', 'mission', 'vision']):
                 response_parts.append(f"\n{para}")
                 break
     
-    if not response_parts and data['services']:
-        response_parts.append(f"{company_name} specializes in: {', '.join(data['services'][:4])}")
+    if not response_parts and data.services:
+        response_parts.append(f"{company_name} specializes in: {', '.join(data.services[:4])}")
     
     return '\n'.join(response_parts) if response_parts else f"{company_name} is a technology company. For more details, please visit their website."
 
 def generate_contact_answer(data, company_name):
     """Generate answer about contact information"""
-    if data['emails'] or data['phones']:
+    if data.emails or data.phones:
         response = f"You can contact {company_name}:\n\n"
-        if data['emails']:
-            response += f"📧 Email: {data['emails'][0]}\n"
-        if data['phones']:
-            response += f"📞 Phone: {data['phones'][0]}"
+        if data.emails:
+            response += f"📧 Email: {data.emails[0]}\n"
+        if data.phones:
+            response += f"📞 Phone: {data.phones[0]}"
         return response
     else:
         return f"Contact information for {company_name} can be found on their website. Please visit their contact page for email and phone details."
@@ -237,17 +426,17 @@ def generate_location_answer(data, company_name):
     # Search for location in description and paragraphs
     location_keywords = ['singapore', 'india', 'usa', 'uk', 'location', 'based', 'office']
     
-    if data['description']:
+    if data.description:
         for keyword in location_keywords:
-            if keyword in data['description'].lower():
-                return f"Based on the information available: {data['description']}"
+            if keyword in data.description.lower():
+                return f"Based on the information available: {data.description}"
     
-    for para in data['paragraphs'][:5]:
+    for para in data.paragraphs[:5]:
         for keyword in location_keywords:
             if keyword in para.lower():
                 return para
     
-    if 'singapore' in data['title'].lower() or 'singapore' in data['description'].lower():
+    if 'singapore' in data.title.lower() or 'singapore' in data.description.lower():
         return f"{company_name} is based in Singapore, serving global enterprises with IT solutions."
     
     return f"Location information for {company_name} can be found on their website's contact or about page."
@@ -259,7 +448,7 @@ def generate_specific_answer(data, company_name, question):
     
     # Search in services and paragraphs
     relevant = []
-    for service in data['services']:
+    for service in data.services:
         if any(keyword in service.lower() for keyword in keywords if len(keyword) > 3):
             relevant.append(service)
     
@@ -267,7 +456,7 @@ def generate_specific_answer(data, company_name, question):
         return f"Regarding your question about {company_name}:\n\n" + '\n'.join([f"• {s}" for s in relevant[:4]])
     
     # Search in paragraphs
-    for para in data['paragraphs']:
+    for para in data.paragraphs:
         if any(keyword in para.lower() for keyword in keywords if len(keyword) > 3):
             return para
     
@@ -278,13 +467,13 @@ def generate_general_answer(data, company_name, question):
     keywords = [word for word in question.split() if len(word) > 3]
     
     # Search paragraphs
-    for para in data['paragraphs']:
+    for para in data.paragraphs:
         if any(keyword in para.lower() for keyword in keywords):
             return para
     
     # Search services
     relevant_services = []
-    for service in data['services']:
+    for service in data.services:
         if any(keyword in service.lower() for keyword in keywords):
             relevant_services.append(service)
     
@@ -292,8 +481,8 @@ def generate_general_answer(data, company_name, question):
         return f"{company_name}:\n\n" + '\n'.join([f"• {s}" for s in relevant_services[:5]])
     
     # Default to description
-    if data['description']:
-        return data['description']
+    if data.description:
+        return data.description
     
     return f"For detailed information about {company_name}, please visit their website."
 
@@ -311,6 +500,6 @@ def test_ai_connection():
             return {'success': False, 'error': 'No response generated'}
             
     except Exception as e:
-        if '429' in str(e) or 'quota' in str(e).lower():
+        if is_quota_error(str(e)):
             return {'success': False, 'error': 'API quota exceeded. Using intelligent fallback.', 'fallback_available': True}
         return {'success': False, 'error': f'AI error: {str(e)}'}
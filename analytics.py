@@ -0,0 +1,183 @@
+"""
+Chat analytics rollups.
+
+Every batch of chat history written by the write-behind queue also updates
+per-company hourly and daily rollups (counts, cache/fallback hits, latency
+sketch bins) in the same transaction, so reports never scan chat_history.
+Run `python analytics.py retention` (e.g. from cron) to archive old raw
+history, prune old hourly rollups and purge expired stored answers in batches.
+"""
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta
+
+import database
+from latency_sketch import LatencySketch
+
+# Raw chat_history rows older than this are moved to chat_history_archive (or deleted)
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "90"))
+# Hourly rollups older than this are dropped; daily rollups are kept
+HOURLY_ROLLUP_RETENTION_DAYS = int(os.getenv("HOURLY_ROLLUP_RETENTION_DAYS", "14"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+
+GRANULARITIES = {
+    'hour': lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+    'day': lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+# Window reported when the caller doesn't pass ?since=
+DEFAULT_WINDOW = {'hour': timedelta(hours=24), 'day': timedelta(days=30)}
+
+
+def rollup_batch(rows):
+    """
+    Aggregate chat history rows
+    (company_id, user_question, bot_response, response_time_ms, cached, fallback, created_at)
+    into rollup counter rows and latency bin rows, ready for an additive upsert
+    """
+    counters = {}
+    sketches = {}
+    for company_id, _, _, response_time_ms, cached, fallback, created_at in rows:
+        for granularity, truncate in GRANULARITIES.items():
+            key = (company_id, granularity, truncate(created_at))
+            counter = counters.get(key)
+            if counter is None:
+                counter = counters[key] = [0, 0, 0, 0, created_at]
+                sketches[key] = LatencySketch()
+            counter[0] += 1
+            counter[1] += 1 if cached else 0
+            counter[2] += 1 if fallback else 0
+            counter[3] += response_time_ms or 0
+            counter[4] = max(counter[4], created_at)
+            sketches[key].add(response_time_ms or 0)
+
+    # Sorted so concurrent writers lock rollup rows in the same order
+    counter_rows = [key + tuple(counters[key]) for key in sorted(counters)]
+    bin_rows = [key + (index, n) for key in sorted(sketches) for index, n in sorted(sketches[key].bins.items())]
+    return counter_rows, bin_rows
+
+
+def summarize(rollups):
+    """Report fields for one or more rollup dicts (with 'sketch') merged together"""
+    sketch = LatencySketch()
+    chats = cached = fallback = total_ms = 0
+    last_chat_at = None
+    for rollup in rollups:
+        sketch.merge(rollup['sketch'])
+        chats += rollup['chats']
+        cached += rollup['cached_chats']
+        fallback += rollup['fallback_chats']
+        total_ms += rollup['total_response_ms']
+        if rollup['last_chat_at'] and (last_chat_at is None or rollup['last_chat_at'] > last_chat_at):
+            last_chat_at = rollup['last_chat_at']
+
+    return {
+        'chats': chats,
+        'cache_ratio': round(cached / chats, 4) if chats else 0.0,
+        'fallback_ratio': round(fallback / chats, 4) if chats else 0.0,
+        'avg_response_time_ms': round(total_ms / chats, 1) if chats else None,
+        'p50_ms': sketch.quantile(0.50),
+        'p95_ms': sketch.quantile(0.95),
+        'p99_ms': sketch.quantile(0.99),
+        'last_chat_at': last_chat_at.isoformat() if last_chat_at else None
+    }
+
+
+def parse_time(value):
+    """ISO date or datetime from a query string, or None"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def company_report(company_id, granularity='hour', since=None, until=None):
+    """Per-bucket and overall chat analytics for a company, read from the rollup tables"""
+    if granularity not in GRANULARITIES:
+        return {'success': False, 'error': f"granularity must be one of {', '.join(GRANULARITIES)}"}
+
+    until = until or datetime.now()
+    since = since or until - DEFAULT_WINDOW[granularity]
+    rollups = database.get_chat_rollups(company_id, granularity, since, until)
+    if rollups is None:
+        return {'success': False, 'error': 'Analytics are not available without a database'}
+
+    buckets = []
+    for rollup in rollups:
+        bucket = summarize([rollup])
+        bucket['bucket_start'] = rollup['bucket_start'].isoformat()
+        buckets.append(bucket)
+
+    return {
+        'success': True,
+        'company_id': company_id,
+        'granularity': granularity,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'totals': summarize(rollups),
+        'buckets': buckets
+    }
+
+
+def run_retention(history_days=HISTORY_RETENTION_DAYS, hourly_days=HOURLY_ROLLUP_RETENTION_DAYS,
+                  batch_size=RETENTION_BATCH_SIZE, archive=True):
+    """
+    Archive (or delete) old raw chat history, prune old hourly rollups and
+    purge expired stored answers, one batch per transaction
+    """
+    now = datetime.now()
+    moved = 0
+    while True:
+        count = database.archive_chat_history_batch(now - timedelta(days=history_days), batch_size, archive)
+        if not count:
+            break
+        moved += count
+
+    pruned = 0
+    while True:
+        count = database.prune_chat_rollups_batch('hour', now - timedelta(days=hourly_days), batch_size)
+        if not count:
+            break
+        pruned += count
+
+    expired = 0
+    while True:
+        count = database.purge_expired_answers_batch(batch_size)
+        if not count:
+            break
+        expired += count
+
+    return {'history_rows': moved, 'archived': archive, 'hourly_rollups_pruned': pruned,
+            'expired_answers_purged': expired}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat analytics maintenance")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    retention = subcommands.add_parser('retention', help="archive old chat history, prune hourly rollups "
+                                                         "and purge expired stored answers")
+    retention.add_argument('--history-days', type=int, default=HISTORY_RETENTION_DAYS)
+    retention.add_argument('--hourly-days', type=int, default=HOURLY_ROLLUP_RETENTION_DAYS)
+    retention.add_argument('--batch-size', type=int, default=RETENTION_BATCH_SIZE)
+    retention.add_argument('--no-archive', action='store_true', help="delete old history instead of archiving it")
+    args = parser.parse_args(argv)
+
+    conn = database.get_connection()
+    if conn is None:
+        print("Database is not reachable")
+        return 1
+    conn.close()
+
+    result = run_retention(args.history_days, args.hourly_days, args.batch_size, archive=not args.no_archive)
+    action = 'archived' if result['archived'] else 'deleted'
+    print(f"{result['history_rows']} chat history rows {action}, "
+          f"{result['hourly_rollups_pruned']} hourly rollups pruned, "
+          f"{result['expired_answers_purged']} expired stored answers purged")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
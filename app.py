@@ -1,6 +1,7 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
 import os
+import json
 from dotenv import load_dotenv
 import time
 
@@ -8,20 +9,68 @@ import time
 import database
 import scraper
 import ai_chatbot
+import logs
+import metrics
+import profiling
+from chatbot_registry import registry, allocate_local_id
+from write_behind import history_writer, chat_history_row
+import analytics
+import usage
+import refresh
+from admission import chat_admission, create_admission, AdmissionRejected
 
 load_dotenv()
 
 app = Flask(__name__, static_folder='.', static_url_path='')
 CORS(app)  # Enable CORS for frontend
 
-# Global variable to store current chatbot context
-current_chatbot = {
-    'company_id': None,
-    'company_name': None,
-    'website_url': None,
-    'context': None,
-    'ready': False
-}
+@app.before_request
+def start_request_metrics():
+    g.metrics = metrics.start_request(request.endpoint)
+    g.log = logs.start_request(request.endpoint, request.headers.get(logs.REQUEST_ID_HEADER))
+    g.profile = profiling.start(profiling.wants_profile(request.headers))
+
+@app.after_request
+def finish_request_metrics(response):
+    if g.get('profile'):
+        response.headers['Server-Timing'] = profiling.finish(g.pop('profile'), request.endpoint)
+        response.headers['Timing-Allow-Origin'] = '*'
+    if 'log' in g:
+        response.headers[logs.REQUEST_ID_HEADER] = g.log[1].request_id
+        logs.finish_request(g.pop('log'), response.status_code)
+    if 'metrics' in g:
+        metrics.finish_request(g.pop('metrics'), response.status_code)
+    return response
+
+def get_client_id():
+    """Identify the caller for fair queuing (first X-Forwarded-For hop behind a proxy)"""
+    forwarded = request.headers.get('X-Forwarded-For')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return request.remote_addr
+
+def rejected_response(rejection):
+    """Fast 429/503 for a shed request"""
+    response = jsonify({
+        'success': False,
+        'error': rejection.reason,
+        'retry_after': rejection.retry_after
+    })
+    response.status_code = rejection.status
+    response.headers['Retry-After'] = str(rejection.retry_after)
+    return response
+
+def get_request_company_id(data=None):
+    """Read the tenant's company_id from the JSON body, X-Company-Id header or query string"""
+    company_id = None
+    if data:
+        company_id = data.get('company_id')
+    if company_id is None:
+        company_id = request.headers.get('X-Company-Id') or request.args.get('company_id')
+    try:
+        return int(company_id) if company_id is not None else None
+    except (TypeError, ValueError):
+        return None
 
 @app.route('/')
 def home():
@@ -32,8 +81,14 @@ def home():
         'endpoints': {
             'create_chatbot': '/create-chatbot [POST]',
             'chat': '/chat [POST]',
-            'status': '/chatbot-status [GET]',
-            'test_ai': '/test-ai [GET]'
+            'status': '/chatbot-status?company_id=... [GET]',
+            'history': '/chat-history?company_id=...&cursor=... [GET]',
+            'history_export': '/chat-history/export?company_id=... [GET, NDJSON]',
+            'analytics': '/analytics?company_id=...&granularity=hour|day [GET]',
+            'usage': '/usage[?company_id=...] [GET]',
+            'refresh_schedule': '/refresh-schedule[?company_id=...] [GET]',
+            'test_ai': '/test-ai [GET]',
+            'metrics': '/metrics [GET]'
         }
     })
 
@@ -59,55 +114,46 @@ def create_chatbot():
             }), 400
         
         # Ensure URL has protocol
-        if not website_url.startswith(('http://', 'https://')):
-            website_url = 'https://' + website_url
+        website_url = scraper.normalize_url(website_url)
         
-        print(f"Creating chatbot for {company_name} - {website_url}")
+        logs.info('create_chatbot', company_name=company_name, website_url=website_url)
         
-        # Scrape website
-        print("Scraping website...")
-        scraped_result = scraper.scrape_website(website_url)
+        with create_admission.admit(get_client_id()):
+            # Another tenant may have scraped the same site moments ago
+            shared = database.get_shared_scrape(website_url)
+            if shared:
+                logs.debug('scrape_reused', website_url=website_url)
+                scraped_result = {'success': True, 'data': shared['scraped_data']}
+                context = shared['context']
+            else:
+                # Scrape website
+                scraped_result = scraper.scrape_website(website_url)
+                
+                if not scraped_result['success']:
+                    return jsonify({
+                        'success': False,
+                        'error': scraped_result.get('error', 'Failed to scrape website')
+                    }), 500
+                
+                # Format context for AI
+                context = scraper.format_scraped_data_for_ai(scraped_result)
+            
+            # Save to database (optional - works without database)
+            company_id = None
+            try:
+                company_id = database.save_scraped_company(company_name, website_url, scraped_result['data'], context)
+            except Exception as db_error:
+                logs.warning('database_unavailable', error=str(db_error))
+                company_id = None
         
-        if not scraped_result['success']:
-            return jsonify({
-                'success': False,
-                'error': scraped_result.get('error', 'Failed to scrape website')
-            }), 500
+        if not company_id:
+            company_id = allocate_local_id()  # In-memory operation
         
+        # Register this tenant's chatbot (answers are keyed by its content hash,
+        # so answers cached for old content no longer apply)
+        registry.put(company_id, company_name, website_url, context)
         
-        # Save to database (optional - works without database)
-        company_id = None
-        try:
-            print("Saving to database...")
-            company_id = database.save_company(company_name, website_url)
-            
-            if company_id:
-                # Clear old scraped data for this company
-                database.clear_company_data(company_id)
-                
-                # Save scraped data
-                scraped_data = scraped_result['data']
-                database.save_scraped_data(company_id, 'title', scraped_data.get('title', ''))
-                database.save_scraped_data(company_id, 'meta_description', scraped_data.get('meta_description', ''))
-                database.save_scraped_data(company_id, 'full_text', scraped_data.get('full_text', ''))
-                database.save_scraped_data(company_id, 'contact_info', str(scraped_data.get('contact_info', {})))
-                database.save_scraped_data(company_id, 'services', ', '.join(scraped_data.get('services', [])))
-                print(f"Data saved to database! Company ID: {company_id}")
-        except Exception as db_error:
-            print(f"Database not available (this is OK): {str(db_error)}")
-            company_id = 1  # Use dummy ID for in-memory operation
-        
-        # Format context for AI
-        context = scraper.format_scraped_data_for_ai(scraped_result)
-        
-        # Update global chatbot state
-        current_chatbot['company_id'] = company_id
-        current_chatbot['company_name'] = company_name
-        current_chatbot['website_url'] = website_url
-        current_chatbot['context'] = context
-        current_chatbot['ready'] = True
-        
-        print(f"Chatbot created successfully!")
+        logs.info('chatbot_created', company_id=company_id, shared_scrape=bool(shared))
         
         return jsonify({
             'success': True,
@@ -120,8 +166,10 @@ def create_chatbot():
             }
         })
         
+    except AdmissionRejected as rejection:
+        return rejected_response(rejection)
     except Exception as e:
-        print(f"Error in create_chatbot: {str(e)}")
+        logs.error('create_chatbot_failed', error=str(e))
         return jsonify({
             'success': False,
             'error': f'Server error: {str(e)}'
@@ -131,7 +179,7 @@ def create_chatbot():
 def chat():
     """
     Answer user questions about the company
-    Expected JSON: { "question": "..." }
+    Expected JSON: { "company_id": ..., "question": "..." }
     """
     try:
         data = request.get_json()
@@ -147,22 +195,37 @@ def chat():
                 'error': 'Question is required'
             }), 400
         
+        company_id = get_request_company_id(data)
+        if company_id is None:
+            return jsonify({
+                'success': False,
+                'error': 'company_id is required'
+            }), 400
+        
         # Check if chatbot is ready
-        if not current_chatbot['ready']:
+        chatbot = registry.get(company_id)
+        if not chatbot:
             return jsonify({
                 'success': False,
                 'error': 'Please create a chatbot first by providing a company URL'
-            }), 400
+            }), 404
         
-        print(f"Processing question: {question}")
         start_time = time.time()
         
-        # Generate AI response
-        ai_result = ai_chatbot.generate_response(
-            question,
-            current_chatbot['context'],
-            current_chatbot['company_name']
+        # Cache hits (in memory or stored answers) are cheap, so they skip the admission queue
+        ai_result = ai_chatbot.get_cached_response(
+            question, chatbot['company_name'], company_id, chatbot['context_hash']
         )
+        if not ai_result:
+            with chat_admission.admit(get_client_id()):
+                # Generate AI response
+                ai_result = ai_chatbot.generate_response(
+                    question,
+                    chatbot['knowledge'],
+                    chatbot['company_name'],
+                    company_id=company_id,
+                    context_hash=chatbot['context_hash']
+                )
         
         if not ai_result['success']:
             return jsonify({
@@ -173,28 +236,27 @@ def chat():
         response_text = ai_result['response']
         response_time_ms = ai_result['response_time_ms']
         
-        # Save to chat history (optional)
-        try:
-            database.save_chat_history(
-                current_chatbot['company_id'],
-                question,
-                response_text,
-                response_time_ms
-            )
-        except Exception as db_error:
-            print(f"Could not save chat history (database not available): {str(db_error)}")
+        # Save to chat history (optional). Written in batches off the request path;
+        # in-memory bots (negative ids) have no companies row to reference.
+        if company_id > 0:
+            history_writer.submit(chat_history_row(company_id, question, ai_result))
         
-        print(f"Response generated in {response_time_ms}ms")
+        logs.info('chat', company_id=company_id, question_chars=len(question),
+                  response_time_ms=response_time_ms, cached=ai_result.get('cached', False),
+                  fallback=ai_result.get('fallback', False))
         
         return jsonify({
             'success': True,
             'response': response_text,
             'response_time_ms': response_time_ms,
-            'cached': ai_result.get('cached', False)
+            'cached': ai_result.get('cached', False),
+            'fallback': ai_result.get('fallback', False)
         })
         
+    except AdmissionRejected as rejection:
+        return rejected_response(rejection)
     except Exception as e:
-        print(f"Error in chat: {str(e)}")
+        logs.error('chat_failed', error=str(e))
         return jsonify({
             'success': False,
             'error': f'Server error: {str(e)}'
@@ -202,14 +264,128 @@ def chat():
 
 @app.route('/chatbot-status', methods=['GET'])
 def chatbot_status():
-    """Get current chatbot status"""
+    """Get chatbot status for ?company_id=..."""
+    company_id = get_request_company_id()
+    chatbot = registry.get(company_id) if company_id is not None else None
+    if not chatbot:
+        return jsonify({
+            'ready': False,
+            'company_id': company_id,
+            'registry': registry.stats(),
+            'admission': {'chat': chat_admission.stats(), 'create_chatbot': create_admission.stats()}
+        })
+    return jsonify({
+        'ready': True,
+        'company_name': chatbot['company_name'],
+        'website_url': chatbot['website_url'],
+        'company_id': company_id,
+        'registry': registry.stats(),
+        'admission': {'chat': chat_admission.stats(), 'create_chatbot': create_admission.stats()}
+    })
+
+@app.route('/chat-history', methods=['GET'])
+def chat_history():
+    """
+    A page of a company's chat history, newest first
+    Query: company_id, limit (default 50), cursor (next_cursor from the previous page)
+    """
+    company_id = get_request_company_id()
+    if company_id is None:
+        return jsonify({'success': False, 'error': 'company_id is required'}), 400
+    
+    limit = min(max(request.args.get('limit', 50, type=int), 1), database.HISTORY_PAGE_MAX)
+    after = None
+    if request.args.get('cursor'):
+        after = database.decode_history_cursor(request.args['cursor'])
+        if after is None:
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    
+    records, next_position = database.get_chat_history_page(company_id, limit, after)
+    if records is None:
+        return jsonify({'success': False, 'error': 'Chat history is not available'}), 503
+    
     return jsonify({
-        'ready': current_chatbot['ready'],
-        'company_name': current_chatbot.get('company_name'),
-        'website_url': current_chatbot.get('website_url'),
-        'company_id': current_chatbot.get('company_id')
+        'success': True,
+        'company_id': company_id,
+        'history': records,
+        'next_cursor': database.encode_history_cursor(*next_position) if next_position else None
     })
 
+@app.route('/chat-history/export', methods=['GET'])
+def export_chat_history():
+    """
+    Stream a company's whole chat history as NDJSON, oldest first
+    Query: company_id, since/until (ISO dates)
+    """
+    company_id = get_request_company_id()
+    if company_id is None:
+        return jsonify({'success': False, 'error': 'company_id is required'}), 400
+    
+    records = database.iter_chat_history(
+        company_id,
+        since=analytics.parse_time(request.args.get('since')),
+        until=analytics.parse_time(request.args.get('until'))
+    )
+    # Fetch the first page before committing to a 200
+    try:
+        first = next(records, None)
+    except RuntimeError:
+        return jsonify({'success': False, 'error': 'Chat history is not available'}), 503
+    
+    def generate():
+        if first is None:
+            return
+        yield json.dumps(first, ensure_ascii=False) + '\n'
+        try:
+            for record in records:
+                yield json.dumps(record, ensure_ascii=False) + '\n'
+        except RuntimeError as e:
+            logs.error('history_export_stopped', company_id=company_id, error=str(e))
+    
+    return Response(generate(), mimetype='application/x-ndjson', headers={
+        'Content-Disposition': f'attachment; filename="chat-history-{company_id}.ndjson"'
+    })
+
+@app.route('/analytics', methods=['GET'])
+def chat_analytics():
+    """
+    Chat counts, latency percentiles and cache/fallback ratios for a company
+    Query: company_id, granularity (hour|day), since/until (ISO dates)
+    """
+    company_id = get_request_company_id()
+    if company_id is None:
+        return jsonify({'success': False, 'error': 'company_id is required'}), 400
+    
+    report = analytics.company_report(
+        company_id,
+        request.args.get('granularity', 'hour'),
+        since=analytics.parse_time(request.args.get('since')),
+        until=analytics.parse_time(request.args.get('until'))
+    )
+    return jsonify(report), 200 if report['success'] else 400
+
+@app.route('/usage', methods=['GET'])
+def llm_usage():
+    """
+    Gemini requests and tokens per tenant (heaviest tenants for ?date=, or one
+    tenant's recent days and budget with ?company_id=)
+    """
+    day = analytics.parse_time(request.args.get('date'))
+    report = usage.usage_report(get_request_company_id(), day.date() if day else None)
+    return jsonify(report), 200 if report['success'] else 503
+
+@app.route('/refresh-schedule', methods=['GET'])
+def refresh_schedule():
+    """Re-scrape queue depth and upcoming refreshes (or one tenant's with ?company_id=)"""
+    report = refresh.schedule_report(get_request_company_id(), request.args.get('limit', 20, type=int))
+    return jsonify(report), 200 if report['success'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics (counters and per-stage latency histograms)"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 @app.route('/test-ai', methods=['GET'])
 def test_ai():
     """Test AI connection"""
@@ -225,12 +401,14 @@ def test_db():
             conn.close()
             return jsonify({
                 'success': True,
-                'message': 'Database connection successful'
+                'message': 'Database connection successful',
+                'pool': database.connection_pool.stats()
             })
         else:
             return jsonify({
                 'success': False,
-                'error': 'Failed to connect to database'
+                'error': 'Failed to connect to database',
+                'pool': database.connection_pool.stats()
             }), 500
     except Exception as e:
         return jsonify({
@@ -244,6 +422,8 @@ if __name__ == '__main__':
         print("Initializing database...")
         database.create_tables()
         print("Database tables created successfully!")
+        print(f"Preloaded {registry.preload()} chatbots")
+        refresh.start()
     except Exception as e:
         print(f"Database not available (running without database): {str(e)}")
     
@@ -0,0 +1,446 @@
+"""
+Asyncio serving mode for the chatbot API.
+
+Scraping uses aiohttp, Gemini calls use generate_content_async and MySQL
+calls run on a small thread pool, so one process can hold hundreds of
+in-flight chats instead of one per gunicorn sync worker.
+
+Run with:
+    python async_app.py
+    gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker
+"""
+import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+
+import database
+import scraper
+import ai_chatbot
+import logs
+import metrics
+import profiling
+import parse_pool
+import write_behind
+from write_behind import history_writer, chat_history_row
+import analytics
+import usage
+import refresh
+from chatbot_registry import registry, allocate_local_id
+
+load_dotenv()
+
+# Threads for blocking MySQL calls (keep at or below the connection pool size)
+DB_THREADS = int(os.getenv("ASYNC_DB_THREADS", "5"))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Company-Id, X-Profile',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS'
+}
+
+
+async def run_db(func, *args):
+    """Run a blocking database call on the DB thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, metrics.in_context(func, *args))
+
+
+def get_request_company_id(request, data=None):
+    """Read the tenant's company_id from the JSON body, X-Company-Id header or query string"""
+    company_id = None
+    if data:
+        company_id = data.get('company_id')
+    if company_id is None:
+        company_id = request.headers.get('X-Company-Id') or request.query.get('company_id')
+    try:
+        return int(company_id) if company_id is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except Exception:
+        return None
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    if request.method == 'OPTIONS':
+        return web.Response(headers=CORS_HEADERS)
+    response = await handler(request)
+    response.headers.update(CORS_HEADERS)
+    return response
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    route = request.match_info.route
+    endpoint = route.handler.__name__ if route.resource else None
+    started = metrics.start_request(endpoint)
+    log_started = logs.start_request(endpoint, request.headers.get(logs.REQUEST_ID_HEADER))
+
+    # cProfile would see every task on the event loop, so only stage timings here
+    profile = profiling.start('timings' if profiling.wants_profile(request.headers) else None)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        if not response.prepared:
+            response.headers[logs.REQUEST_ID_HEADER] = log_started[1].request_id
+        if profile:
+            response.headers['Server-Timing'] = profiling.finish(profile, endpoint)
+            response.headers['Timing-Allow-Origin'] = '*'
+            profile = None
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        if profile:
+            profiling.finish(profile, endpoint)
+        logs.finish_request(log_started, status)
+        metrics.finish_request(started, status)
+
+
+async def home(request):
+    """Health check endpoint"""
+    return web.json_response({
+        'status': 'online',
+        'message': 'AI Chatbot Assistant API is running (asyncio mode)',
+        'endpoints': {
+            'create_chatbot': '/create-chatbot [POST]',
+            'chat': '/chat [POST]',
+            'status': '/chatbot-status?company_id=... [GET]',
+            'history': '/chat-history?company_id=...&cursor=... [GET]',
+            'history_export': '/chat-history/export?company_id=... [GET, NDJSON]',
+            'analytics': '/analytics?company_id=...&granularity=hour|day [GET]',
+            'usage': '/usage[?company_id=...] [GET]',
+            'refresh_schedule': '/refresh-schedule[?company_id=...] [GET]',
+            'metrics': '/metrics [GET]'
+        }
+    })
+
+
+async def create_chatbot(request):
+    """
+    Create a new chatbot by scraping website
+    Expected JSON: { "company_name": "...", "website_url": "..." }
+    """
+    try:
+        data = await read_json(request)
+
+        if not data:
+            return web.json_response({'success': False, 'error': 'No data provided'}, status=400)
+
+        company_name = data.get('company_name', '').strip()
+        website_url = data.get('website_url', '').strip()
+
+        if not company_name or not website_url:
+            return web.json_response({
+                'success': False,
+                'error': 'Both company_name and website_url are required'
+            }, status=400)
+
+        website_url = scraper.normalize_url(website_url)
+
+        logs.info('create_chatbot', company_name=company_name, website_url=website_url)
+
+        # Another tenant may have scraped the same site moments ago
+        shared = await run_db(database.get_shared_scrape, website_url)
+        if shared:
+            scraped_result = {'success': True, 'data': shared['scraped_data']}
+            context = shared['context']
+        else:
+            scraped_result = await scraper.scrape_website_async(website_url, request.app['http'])
+
+            if not scraped_result['success']:
+                return web.json_response({
+                    'success': False,
+                    'error': scraped_result.get('error', 'Failed to scrape website')
+                }, status=500)
+
+            context = scraper.format_scraped_data_for_ai(scraped_result)
+
+        # Save to database (optional - works without database)
+        company_id = None
+        try:
+            company_id = await run_db(database.save_scraped_company, company_name, website_url, scraped_result['data'], context)
+        except Exception as db_error:
+            logs.warning('database_unavailable', error=str(db_error))
+
+        if not company_id:
+            company_id = allocate_local_id()  # In-memory operation
+
+        registry.put(company_id, company_name, website_url, context)
+        logs.info('chatbot_created', company_id=company_id, shared_scrape=bool(shared))
+
+        return web.json_response({
+            'success': True,
+            'message': f'Chatbot created for {company_name}',
+            'company_id': company_id,
+            'data_extracted': {
+                'title': scraped_result['data'].get('title', ''),
+                'services_count': len(scraped_result['data'].get('services', [])),
+                'has_contact_info': bool(scraped_result['data'].get('contact_info', {}).get('emails'))
+            }
+        })
+
+    except Exception as e:
+        logs.error('create_chatbot_failed', error=str(e))
+        return web.json_response({
+            'success': False,
+            'error': f'Server error: {str(e)}'
+        }, status=500)
+
+
+async def chat(request):
+    """
+    Answer user questions about the company
+    Expected JSON: { "company_id": ..., "question": "..." }
+    """
+    try:
+        data = await read_json(request)
+
+        if not data:
+            return web.json_response({'success': False, 'error': 'No data provided'}, status=400)
+
+        question = data.get('question', '').strip()
+
+        if not question:
+            return web.json_response({
+                'success': False,
+                'error': 'Question is required'
+            }, status=400)
+
+        company_id = get_request_company_id(request, data)
+        if company_id is None:
+            return web.json_response({
+                'success': False,
+                'error': 'company_id is required'
+            }, status=400)
+
+        # Cold tenants are loaded from MySQL, so go through the DB pool
+        chatbot = await run_db(registry.get, company_id)
+        if not chatbot:
+            return web.json_response({
+                'success': False,
+                'error': 'Please create a chatbot first by providing a company URL'
+            }, status=404)
+
+        # In-memory hits are answered here; stored answers are a database read, so go through the DB pool
+        ai_result = ai_chatbot.get_cached_response(
+            question, chatbot['company_name'], company_id, chatbot['context_hash'], stored=False
+        )
+        if not ai_result:
+            ai_result = await run_db(
+                ai_chatbot.get_stored_response, question, chatbot['company_name'], company_id, chatbot['context_hash']
+            )
+        if not ai_result:
+            ai_result = await ai_chatbot.generate_response_async(
+                question,
+                chatbot['knowledge'],
+                chatbot['company_name'],
+                company_id=company_id,
+                context_hash=chatbot['context_hash']
+            )
+
+        if not ai_result['success']:
+            return web.json_response({
+                'success': False,
+                'error': ai_result.get('error', 'Failed to generate response')
+            }, status=500)
+
+        response_text = ai_result['response']
+        response_time_ms = ai_result['response_time_ms']
+
+        # Never block the event loop on a full history buffer
+        if company_id > 0:
+            history_writer.submit(chat_history_row(company_id, question, ai_result), block=False)
+
+        logs.info('chat', company_id=company_id, question_chars=len(question),
+                  response_time_ms=response_time_ms, cached=ai_result.get('cached', False),
+                  fallback=ai_result.get('fallback', False))
+
+        return web.json_response({
+            'success': True,
+            'response': response_text,
+            'response_time_ms': response_time_ms,
+            'cached': ai_result.get('cached', False),
+            'fallback': ai_result.get('fallback', False)
+        })
+
+    except Exception as e:
+        logs.error('chat_failed', error=str(e))
+        return web.json_response({
+            'success': False,
+            'error': f'Server error: {str(e)}'
+        }, status=500)
+
+
+async def chatbot_status(request):
+    """Get chatbot status for ?company_id=..."""
+    company_id = get_request_company_id(request)
+    chatbot = await run_db(registry.get, company_id) if company_id is not None else None
+    if not chatbot:
+        return web.json_response({
+            'ready': False,
+            'company_id': company_id,
+            'registry': registry.stats()
+        })
+    return web.json_response({
+        'ready': True,
+        'company_name': chatbot['company_name'],
+        'website_url': chatbot['website_url'],
+        'company_id': company_id,
+        'registry': registry.stats()
+    })
+
+
+async def chat_history(request):
+    """A page of a company's chat history, newest first (?company_id=&limit=&cursor=)"""
+    company_id = get_request_company_id(request)
+    if company_id is None:
+        return web.json_response({'success': False, 'error': 'company_id is required'}, status=400)
+
+    try:
+        limit = min(max(int(request.query.get('limit', 50)), 1), database.HISTORY_PAGE_MAX)
+    except ValueError:
+        limit = 50
+    after = None
+    if request.query.get('cursor'):
+        after = database.decode_history_cursor(request.query['cursor'])
+        if after is None:
+            return web.json_response({'success': False, 'error': 'Invalid cursor'}, status=400)
+
+    records, next_position = await run_db(database.get_chat_history_page, company_id, limit, after)
+    if records is None:
+        return web.json_response({'success': False, 'error': 'Chat history is not available'}, status=503)
+
+    return web.json_response({
+        'success': True,
+        'company_id': company_id,
+        'history': records,
+        'next_cursor': database.encode_history_cursor(*next_position) if next_position else None
+    })
+
+
+async def export_chat_history(request):
+    """Stream a company's whole chat history as NDJSON, oldest first (?company_id=&since=&until=)"""
+    company_id = get_request_company_id(request)
+    if company_id is None:
+        return web.json_response({'success': False, 'error': 'company_id is required'}, status=400)
+
+    since = analytics.parse_time(request.query.get('since'))
+    until = analytics.parse_time(request.query.get('until'))
+    page = lambda after: run_db(
+        database.get_chat_history_page, company_id, database.HISTORY_EXPORT_BATCH, after, False, since, until
+    )
+
+    records, after = await page(None)
+    if records is None:
+        return web.json_response({'success': False, 'error': 'Chat history is not available'}, status=503)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'application/x-ndjson',
+        'Content-Disposition': f'attachment; filename="chat-history-{company_id}.ndjson"'
+    })
+    await response.prepare(request)
+    while records:
+        await response.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8'))
+        if after is None:
+            break
+        records, after = await page(after)
+        if records is None:
+            logs.error('history_export_stopped', company_id=company_id, error='database unavailable')
+            break
+    await response.write_eof()
+    return response
+
+
+async def chat_analytics(request):
+    """Chat counts, latency percentiles and cache/fallback ratios for ?company_id=..."""
+    company_id = get_request_company_id(request)
+    if company_id is None:
+        return web.json_response({'success': False, 'error': 'company_id is required'}, status=400)
+
+    report = await run_db(
+        analytics.company_report,
+        company_id,
+        request.query.get('granularity', 'hour'),
+        analytics.parse_time(request.query.get('since')),
+        analytics.parse_time(request.query.get('until'))
+    )
+    return web.json_response(report, status=200 if report['success'] else 400)
+
+
+async def llm_usage(request):
+    """Gemini requests and tokens per tenant for ?date=, or one tenant's with ?company_id="""
+    day = analytics.parse_time(request.query.get('date'))
+    report = await run_db(usage.usage_report, get_request_company_id(request), day.date() if day else None)
+    return web.json_response(report, status=200 if report['success'] else 503)
+
+
+async def refresh_schedule(request):
+    """Re-scrape queue depth and upcoming refreshes (or one tenant's with ?company_id=)"""
+    try:
+        limit = int(request.query.get('limit', 20))
+    except ValueError:
+        limit = 20
+    report = await run_db(refresh.schedule_report, get_request_company_id(request), limit)
+    return web.json_response(report, status=200 if report['success'] else 503)
+
+
+async def metrics_endpoint(request):
+    """Prometheus metrics (counters and per-stage latency histograms)"""
+    body, content_type = metrics.render()
+    return web.Response(body=body, headers={'Content-Type': content_type})
+
+
+async def on_startup(app):
+    # One shared HTTP client keeps connections to scraped sites pooled
+    app['http'] = aiohttp.ClientSession()
+    await run_db(registry.preload)
+    refresh.start()
+
+
+async def on_cleanup(app):
+    await app['http'].close()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, write_behind.close_all)
+    db_executor.shutdown(wait=True)
+    await loop.run_in_executor(None, parse_pool.close)
+    # Last, so the lines logged while shutting down are written
+    await loop.run_in_executor(None, logs.close)
+
+
+def create_app():
+    app = web.Application(middlewares=[cors_middleware, metrics_middleware])
+    app.router.add_get('/', home)
+    app.router.add_post('/create-chatbot', create_chatbot)
+    app.router.add_post('/chat', chat)
+    app.router.add_get('/chatbot-status', chatbot_status)
+    app.router.add_get('/chat-history', chat_history)
+    app.router.add_get('/chat-history/export', export_chat_history)
+    app.router.add_get('/analytics', chat_analytics)
+    app.router.add_get('/usage', llm_usage)
+    app.router.add_get('/refresh-schedule', refresh_schedule)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+app = create_app()
+
+if __name__ == '__main__':
+    print("Starting asyncio server...")
+    web.run_app(app, host='0.0.0.0', port=int(os.getenv("PORT", "5000")))
@@ -0,0 +1,73 @@
+"""
+The chatbot API wired to the stand-ins in benchmarks/fakes.py.
+
+Configured through environment variables so it can also be served by gunicorn
+(gunicorn "benchmarks.fake_server:load_app('flask')"):
+    BENCH_LLM_LATENCY_MS, BENCH_LLM_JITTER_MS, BENCH_LLM_429_RATIO, BENCH_LLM_STREAM_CHUNKS,
+    BENCH_DB (fake = in-memory stand-in, sqlite = real SQL on a temporary SQLite file)
+
+    python -m benchmarks.fake_server --server flask --port 5100
+    python -m benchmarks.fake_server --server async --port 5100
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_DB = os.getenv("BENCH_DB", "fake")
+
+
+def wire():
+    """
+    Point the app's database and Gemini model at the stand-ins. Called from
+    load_app rather than at import, so parser processes (which re-import this
+    script as __mp_main__) only load what parsing needs.
+    """
+    if BENCH_DB == 'sqlite':
+        # Must be set before database is imported
+        os.environ['DB_BACKEND'] = 'sqlite'
+        os.environ.setdefault('SQLITE_PATH', os.path.join(tempfile.mkdtemp(prefix='chatbot-bench-'), 'bench.db'))
+
+    import database
+    import ai_chatbot
+    from benchmarks.fakes import FakeGeminiModel, FakeDatabase
+
+    ai_chatbot.model = FakeGeminiModel(
+        latency_ms=float(os.getenv("BENCH_LLM_LATENCY_MS", "400")),
+        jitter_ms=float(os.getenv("BENCH_LLM_JITTER_MS", "100")),
+        rate_limit_ratio=float(os.getenv("BENCH_LLM_429_RATIO", "0")),
+        stream_chunks=int(os.getenv("BENCH_LLM_STREAM_CHUNKS", "5"))
+    )
+    if BENCH_DB == 'sqlite':
+        database.create_tables()
+    else:
+        FakeDatabase().install(database)
+
+
+def load_app(server):
+    wire()
+    if server == 'async':
+        import async_app
+        return async_app.app
+    import app
+    return app.app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['flask', 'async'], default='flask')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5100)
+    args = parser.parse_args()
+
+    application = load_app(args.server)
+    if args.server == 'async':
+        from aiohttp import web
+        web.run_app(application, host=args.host, port=args.port, print=None, access_log=None)
+    else:
+        import logging
+        from werkzeug.serving import run_simple
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        run_simple(args.host, args.port, application, threaded=True)
@@ -0,0 +1,393 @@
+"""
+Local stand-ins for Gemini, company websites and MySQL so the app can be
+load-tested without an API key, network access or a database server.
+"""
+import re
+import time
+import random
+import asyncio
+import threading
+import itertools
+import http.server
+from datetime import datetime
+
+import scrape_codec
+
+QUOTA_ERROR = "429 Resource has been exhausted (e.g. check quota)."
+
+
+class FakeUsage:
+    __slots__ = ('prompt_token_count', 'candidates_token_count', 'total_token_count')
+
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeResponse:
+    """Quacks like a google.generativeai GenerateContentResponse"""
+
+    def __init__(self, text, prompt, chunks=None):
+        self.text = text
+        self.usage_metadata = FakeUsage(len(prompt) // 4, len(text) // 4)
+        self._chunks = chunks
+
+    def __iter__(self):
+        return iter(self._chunks or [self])
+
+    def resolve(self):
+        pass
+
+
+class FakeGeminiModel:
+    """
+    Stand-in for genai.GenerativeModel.
+    latency_ms/jitter_ms shape the response time, rate_limit_ratio is the
+    fraction of calls that fail with a 429, stream_chunks controls how many
+    chunks a stream=True call yields (latency is spread across them).
+    """
+
+    def __init__(self, latency_ms=400, jitter_ms=100, rate_limit_ratio=0.0, stream_chunks=5, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_ratio = rate_limit_ratio
+        self.stream_chunks = max(1, stream_chunks)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rate_limited = 0
+
+    def _plan(self, prompt):
+        with self._lock:
+            self.calls += 1
+            limited = self._random.random() < self.rate_limit_ratio
+            if limited:
+                self.rate_limited += 1
+            delay = max(0.0, self._random.gauss(self.latency_ms, self.jitter_ms)) / 1000.0
+        match = re.search(r'User Question: (.*)', prompt)
+        question = match.group(1).strip() if match else 'your question'
+        text = f"Here is what I found about {question.rstrip('?')}. " * 3
+        return limited, delay, text.strip()
+
+    def _chunked(self, text, prompt):
+        size = max(1, len(text) // self.stream_chunks)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        return [FakeResponse(piece, prompt) for piece in pieces]
+
+    def generate_content(self, prompt, generation_config=None, safety_settings=None, stream=False):
+        limited, delay, text = self._plan(prompt)
+        if limited:
+            time.sleep(delay / 10)
+            raise Exception(QUOTA_ERROR)
+        if not stream:
+            time.sleep(delay)
+            return FakeResponse(text, prompt)
+
+        chunks = self._chunked(text, prompt)
+
+        def stream_chunks():
+            for chunk in chunks:
+                time.sleep(delay / len(chunks))
+                yield chunk
+        return stream_chunks()
+
+    async def generate_content_async(self, prompt, generation_config=None, safety_settings=None, stream=False):
+        limited, delay, text = self._plan(prompt)
+        if limited:
+            await asyncio.sleep(delay / 10)
+            raise Exception(QUOTA_ERROR)
+        if not stream:
+            await asyncio.sleep(delay)
+            return FakeResponse(text, prompt)
+
+        chunks = self._chunked(text, prompt)
+
+        async def stream_chunks():
+            for chunk in chunks:
+                await asyncio.sleep(delay / len(chunks))
+                yield chunk
+        return stream_chunks()
+
+
+def fixture_page(site_id, paragraphs=40):
+    """Deterministic company page; bigger site ids get more content"""
+    rnd = random.Random(site_id)
+    services = ['Web Development', 'Mobile Apps', 'AI Consulting', 'ERP Integration',
+                'Cloud Migration', 'Digital Marketing', 'Data Analytics', 'Zoho Implementation']
+    parts = [
+        f"<html><head><title>Fixture Company {site_id}</title>",
+        f"<meta name='description' content='Fixture Company {site_id} is a technology firm based in Singapore.'>",
+        "</head><body><main id='content'>",
+    ]
+    for i in range(paragraphs + site_id % 20):
+        parts.append(f"<h2>Topic {i} for company {site_id}</h2>")
+        parts.append(f"<p>Paragraph {i}: our business delivers {rnd.choice(services).lower()} "
+                     f"to clients with a mission to build reliable software since {2000 + i}.</p>")
+    parts.append("<ul>" + "".join(f"<li>{s} services</li>" for s in rnd.sample(services, 6)) + "</ul>")
+    parts.append(f"<section id='contact'><p>Contact us at hello{site_id}@fixture.example or +65 6123 {site_id:04d}</p></section>")
+    parts.append("</main></body></html>")
+    return ''.join(parts).encode()
+
+
+class FixtureSiteServer:
+    """Serves /site/<n> fixture pages on localhost"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, paragraphs=40):
+        latency = latency_ms / 1000.0
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                match = re.match(r'^/site/(\d+)', self.path)
+                if not match:
+                    self.send_error(404)
+                    return
+                if latency:
+                    time.sleep(latency)
+                body = fixture_page(int(match.group(1)), paragraphs)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self.httpd.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def url(self, site_id):
+        return f"{self.base_url}/site/{site_id}"
+
+
+class FakeDatabase:
+    """In-process replacement for the database module's functions"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.companies = {}
+        self.scraped_data = {}
+        self.snapshots = {}
+        self.contexts = {}
+        self.answers = {}
+        self.api_usage = {}
+        self.token_budgets = {}
+        self.chat_history = []
+
+    def install(self, database_module):
+        """Point the database module's public functions at this stand-in"""
+        self._database = database_module
+        for name in ('get_connection', 'create_tables', 'save_scraped_company',
+                     'get_company_data', 'save_chat_history', 'save_chat_history_batch',
+                     'get_latest_company',
+                     'get_company_snapshot', 'get_recent_company_snapshots', 'get_shared_scrape', 'get_chat_rollups',
+                     'get_chat_history_page', 'get_cached_answer', 'save_cached_answers',
+                     'save_api_usage', 'get_token_budgets', 'get_api_usage'):
+            setattr(database_module, name, getattr(self, name))
+        return self
+
+    def get_connection(self, timeout=None):
+        return None
+
+    def create_tables(self):
+        return True
+
+    def _save_company(self, company_name, website_url):
+        with self._lock:
+            for company in self.companies.values():
+                if company['company_name'] == company_name and company['website_url'] == website_url:
+                    company['updated_at'] = datetime.now()
+                    return company['id']
+            company_id = next(self._ids)
+            now = datetime.now()
+            self.companies[company_id] = {
+                'id': company_id,
+                'company_name': company_name,
+                'website_url': website_url,
+                'created_at': now,
+                'updated_at': now
+            }
+            return company_id
+
+    def save_scraped_company(self, company_name, website_url, scraped_data, context=None):
+        company_id = self._save_company(company_name, website_url)
+        rows = [{'content_type': content_type, 'content_text': text, 'metadata': metadata}
+                for content_type, text, metadata in self._database.scraped_rows(scraped_data)]
+        with self._lock:
+            self.scraped_data[company_id] = rows
+            if context is not None:
+                snapshot = scrape_codec.encode_snapshot(website_url, scraped_data, context)
+                context_hash = snapshot[3]
+                self.contexts[context_hash] = (snapshot, scrape_codec.canonical_url(website_url), time.time())
+                previous = self.snapshots.get(company_id)
+                self.snapshots[company_id] = (context_hash, time.time())
+                if previous and previous[0] != context_hash and \
+                        all(hash_ != previous[0] for hash_, _ in self.snapshots.values()):
+                    self.contexts.pop(previous[0], None)
+                    for key in [key for key in self.answers if key[0] == previous[0]]:
+                        del self.answers[key]
+        return company_id
+
+    def get_company_snapshot(self, company_id):
+        with self._lock:
+            stored = self.snapshots.get(company_id)
+            company = self.companies.get(company_id)
+            shared = self.contexts.get(stored[0]) if stored else None
+        if not shared or not company:
+            return None
+        (version, scraped_blob, context_blob, context_hash), _, _ = shared
+        scraped_data, context = scrape_codec.decode_snapshot(version, scraped_blob, context_blob)
+        return {
+            'company_id': company_id,
+            'company_name': company['company_name'],
+            'website_url': company['website_url'],
+            'scraped_data': scraped_data,
+            'context': context,
+            'context_hash': context_hash
+        }
+
+    def get_recent_company_snapshots(self, limit):
+        with self._lock:
+            recent = sorted(self.snapshots, key=lambda cid: self.snapshots[cid][1], reverse=True)[:limit]
+        return [self.get_company_snapshot(company_id) for company_id in recent]
+
+    def get_shared_scrape(self, website_url, max_age=None):
+        if max_age is None:
+            max_age = self._database.SHARED_SCRAPE_MAX_AGE
+        canonical = scrape_codec.canonical_url(website_url)
+        with self._lock:
+            fresh = [shared for shared in self.contexts.values()
+                     if shared[1] == canonical and shared[2] >= time.time() - max_age]
+        if max_age <= 0 or not fresh:
+            return None
+        (version, scraped_blob, context_blob, context_hash), _, _ = max(fresh, key=lambda shared: shared[2])
+        scraped_data, context = scrape_codec.decode_snapshot(version, scraped_blob, context_blob)
+        return {'scraped_data': scraped_data, 'context': context, 'context_hash': context_hash}
+
+    def get_company_data(self, company_id):
+        with self._lock:
+            company = self.companies.get(company_id)
+            if not company:
+                return None
+            return {
+                'company': dict(company),
+                'scraped_data': list(self.scraped_data.get(company_id, []))
+            }
+
+    def save_chat_history(self, company_id, user_question, bot_response, response_time_ms, cached=False, fallback=False):
+        return self.save_chat_history_batch(
+            [(company_id, user_question, bot_response, response_time_ms, cached, fallback, datetime.now())]
+        )
+
+    def save_chat_history_batch(self, rows):
+        with self._lock:
+            self.chat_history.extend(rows)
+        return True
+
+    def get_chat_rollups(self, company_id, granularity, since, until):
+        """Rollups computed from the stored history (the real tables are maintained on write)"""
+        import analytics
+        from latency_sketch import LatencySketch
+        with self._lock:
+            rows = [row for row in self.chat_history if row[0] == company_id]
+        counter_rows, bin_rows = analytics.rollup_batch(rows)
+        bins = {}
+        for _, row_granularity, bucket_start, index, n in bin_rows:
+            bins.setdefault((row_granularity, bucket_start), {})[index] = n
+        return [
+            {
+                'bucket_start': bucket_start,
+                'chats': chats,
+                'cached_chats': cached,
+                'fallback_chats': fallback,
+                'total_response_ms': total_ms,
+                'last_chat_at': last_chat_at,
+                'sketch': LatencySketch(bins[(row_granularity, bucket_start)])
+            }
+            for _, row_granularity, bucket_start, chats, cached, fallback, total_ms, last_chat_at in counter_rows
+            if row_granularity == granularity and since <= bucket_start < until
+        ]
+
+    def get_chat_history_page(self, company_id, limit=50, after=None, newest_first=True, since=None, until=None):
+        with self._lock:
+            rows = [
+                {'id': row_id, 'user_question': row[1], 'bot_response': row[2], 'response_time_ms': row[3],
+                 'cached': row[4], 'fallback': row[5], 'created_at': row[6]}
+                for row_id, row in enumerate(self.chat_history, 1) if row[0] == company_id
+            ]
+        rows.sort(key=lambda row: (row['created_at'], row['id']), reverse=newest_first)
+        if after is not None:
+            rows = [row for row in rows
+                    if ((row['created_at'], row['id']) < after) == newest_first and (row['created_at'], row['id']) != after]
+        if since is not None:
+            rows = [row for row in rows if row['created_at'] >= since]
+        if until is not None:
+            rows = [row for row in rows if row['created_at'] < until]
+        page = rows[:limit]
+        next_position = (page[-1]['created_at'], page[-1]['id']) if len(rows) > limit else None
+        return [self._database.chat_history_record(row) for row in page], next_position
+
+    def get_cached_answer(self, context_hash, question_hash):
+        with self._lock:
+            stored = self.answers.get((context_hash, question_hash))
+        if stored is None or stored[1] <= datetime.now():
+            return None
+        return stored[0]
+
+    def save_cached_answers(self, rows):
+        with self._lock:
+            for context_hash, question_hash, response, expires_at in rows:
+                self.answers[(context_hash, question_hash)] = (response, expires_at)
+        return True
+
+    def save_api_usage(self, rows):
+        with self._lock:
+            for company_id, api_name, usage_date, *counts, last_request_at in rows:
+                totals = self.api_usage.setdefault((company_id, api_name, usage_date), [0] * 5 + [None])
+                for i, n in enumerate(counts):
+                    totals[i] += n
+                totals[5] = max(filter(None, (totals[5], last_request_at)))
+        return True
+
+    def get_token_budgets(self, company_ids, api_name, usage_date):
+        with self._lock:
+            return {
+                company_id: (self.token_budgets.get(company_id),
+                             sum(self.api_usage.get((company_id, api_name, usage_date), [0, 0, 0, 0])[2:4]))
+                for company_id in company_ids if company_id in self.companies
+            }
+
+    def get_api_usage(self, usage_date, company_id=None, limit=20):
+        with self._lock:
+            rows = [
+                {'company_id': cid, 'company_name': self.companies[cid]['company_name'], 'usage_date': day,
+                 'request_count': requests, 'error_count': errors, 'prompt_tokens': prompt,
+                 'output_tokens': output, 'tokens_used': prompt + output, 'total_latency_ms': latency_ms,
+                 'last_request_at': last_request_at, 'daily_token_budget': self.token_budgets.get(cid)}
+                for (cid, _, day), (requests, errors, prompt, output, latency_ms, last_request_at)
+                in self.api_usage.items()
+                if cid in self.companies and (day == usage_date if company_id is None
+                                               else cid == company_id and day <= usage_date)
+            ]
+        if company_id is None:
+            rows.sort(key=lambda row: row['tokens_used'], reverse=True)
+        else:
+            rows.sort(key=lambda row: row['usage_date'], reverse=True)
+        return rows[:limit]
+
+    def get_latest_company(self):
+        with self._lock:
+            if not self.companies:
+                return None
+            return dict(max(self.companies.values(), key=lambda c: c['updated_at']))
+
@@ -0,0 +1,368 @@
+"""
+Offline benchmark for the intelligent fallback (no Gemini, database or network).
+
+Runs generate_intelligent_fallback over the labeled questions in
+benchmarks/fixtures/fallback_cases.json (saved scrapes of several sites)
+and reports:
+
+  - per-call latency p50/p95/p99 overall and per intent, for bots held as
+    CompanyKnowledge (warm, as the registry serves them) and for a raw
+    context string (cold, parsed on every call)
+  - throughput with 1..N threads calling the fallback concurrently
+  - intent accuracy: detect_intent against the labeled intent
+  - answer hit rate: answers containing one of the expected phrases
+
+Results are saved to benchmarks/results/ with the commit they ran against;
+`history` lists saved runs in order so regressions show up across commits.
+
+    python -m benchmarks.fallback_bench run
+    python -m benchmarks.fallback_bench run --repeat 500 --threads 1,4,16 --verbose
+    python -m benchmarks.fallback_bench compare benchmarks/results/A.json benchmarks/results/B.json
+    python -m benchmarks.fallback_bench history
+    python -m benchmarks.fallback_bench capture --company-id 12 --company-name "Acme"
+"""
+import os
+import sys
+import json
+import glob
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.harness import RESULTS_DIR, percentile, git_commit
+from scraper import format_scraped_data_for_ai
+from knowledge import as_knowledge
+from ai_chatbot import generate_intelligent_fallback, detect_intent
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'fallback_cases.json')
+INTENTS = ['services', 'about', 'contact', 'location', 'specific', 'general']
+RESULT_SUFFIX = 'fallback'
+
+
+def load_cases(path=FIXTURES):
+    """Sites from a fixture file, each with its formatted context, knowledge and labeled questions"""
+    with open(path) as f:
+        fixtures = json.load(f)
+
+    sites = []
+    for site in fixtures['sites']:
+        context = format_scraped_data_for_ai(site['scraped_data'])
+        sites.append({
+            'company_name': site['company_name'],
+            'website_url': site['website_url'],
+            'context': context,
+            'knowledge': as_knowledge(context),
+            'questions': site['questions']
+        })
+    return sites
+
+
+def is_hit(answer, expect):
+    answer = answer.lower()
+    return any(phrase.lower() in answer for phrase in expect)
+
+
+def evaluate(sites):
+    """Intent accuracy and answer hit rate, overall and per labeled intent"""
+    per_intent = {intent: {'questions': 0, 'intent_correct': 0, 'hits': 0} for intent in INTENTS}
+    confusion = {}
+    misses = []
+    for site in sites:
+        for case in site['questions']:
+            question, intent = case['question'], case['intent']
+            predicted = detect_intent(question.lower().strip())
+            answer = generate_intelligent_fallback(question, site['knowledge'], site['company_name'])
+            hit = is_hit(answer, case['expect'])
+
+            counts = per_intent.setdefault(intent, {'questions': 0, 'intent_correct': 0, 'hits': 0})
+            counts['questions'] += 1
+            counts['intent_correct'] += predicted == intent
+            counts['hits'] += hit
+            confusion.setdefault(intent, {}).setdefault(predicted, 0)
+            confusion[intent][predicted] += 1
+            if predicted != intent or not hit:
+                misses.append({
+                    'company_name': site['company_name'],
+                    'question': question,
+                    'intent': intent,
+                    'predicted': predicted,
+                    'hit': hit,
+                    'answer': answer[:200]
+                })
+
+    total = sum(c['questions'] for c in per_intent.values())
+    correct = sum(c['intent_correct'] for c in per_intent.values())
+    hits = sum(c['hits'] for c in per_intent.values())
+    return {
+        'questions': total,
+        'intent_accuracy': correct / total if total else 0.0,
+        'answer_hit_rate': hits / total if total else 0.0,
+        'per_intent': {
+            intent: {
+                'questions': c['questions'],
+                'intent_accuracy': c['intent_correct'] / c['questions'] if c['questions'] else 0.0,
+                'answer_hit_rate': c['hits'] / c['questions'] if c['questions'] else 0.0
+            }
+            for intent, c in per_intent.items() if c['questions']
+        },
+        'confusion': confusion,
+        'misses': misses
+    }
+
+
+def calls(sites, form):
+    """(question, context, company_name, intent) for every labeled question"""
+    return [
+        (case['question'], site[form], site['company_name'], case['intent'])
+        for site in sites for case in site['questions']
+    ]
+
+
+def latency_summary(samples):
+    return {
+        'calls': len(samples),
+        'mean_us': sum(samples) / len(samples) if samples else 0.0,
+        'p50_us': percentile(samples, 50),
+        'p95_us': percentile(samples, 95),
+        'p99_us': percentile(samples, 99),
+        'max_us': max(samples) if samples else 0.0
+    }
+
+
+def measure_latency(sites, form, repeat):
+    """Per-call latency in microseconds, overall, per intent and for the slowest questions"""
+    samples = []
+    by_intent = {}
+    by_question = []
+    workload = calls(sites, form)
+    for question, context, company_name, intent in workload:
+        generate_intelligent_fallback(question, context, company_name)
+        question_samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            generate_intelligent_fallback(question, context, company_name)
+            question_samples.append((time.perf_counter() - start) * 1e6)
+        samples.extend(question_samples)
+        by_intent.setdefault(intent, []).extend(question_samples)
+        by_question.append((percentile(question_samples, 50), company_name, question))
+
+    by_question.sort(reverse=True)
+    return {
+        'overall': latency_summary(samples),
+        'per_intent': {intent: latency_summary(values) for intent, values in by_intent.items()},
+        'slowest': [
+            {'company_name': name, 'question': question, 'p50_us': p50}
+            for p50, name, question in by_question[:5]
+        ]
+    }
+
+
+def measure_throughput(sites, threads, duration, seed):
+    """Fallback answers per second with `threads` threads calling it for `duration` seconds"""
+    workload = calls(sites, 'knowledge')
+    stop = threading.Event()
+    counts = [0] * threads
+
+    def worker(index):
+        rnd = random.Random(seed + index)
+        order = workload[:]
+        rnd.shuffle(order)
+        n = 0
+        while not stop.is_set():
+            for question, context, company_name, _ in order:
+                generate_intelligent_fallback(question, context, company_name)
+            n += len(order)
+        counts[index] = n
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        started = time.perf_counter()
+        futures = [pool.submit(worker, i) for i in range(threads)]
+        time.sleep(duration)
+        stop.set()
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - started
+
+    total = sum(counts)
+    return {'threads': threads, 'calls': total, 'elapsed_s': elapsed,
+            'answers_per_s': total / elapsed if elapsed else 0.0}
+
+
+def print_summary(result):
+    summary = result['summary']
+    quality = summary['quality']
+    print(f"\n{quality['questions']} labeled questions over {result['config']['sites']} sites")
+    print(f"intent accuracy {quality['intent_accuracy'] * 100:.1f}%   "
+          f"answer hit rate {quality['answer_hit_rate'] * 100:.1f}%")
+    print(f"\n{'intent':<10} {'qs':>4} {'intent %':>9} {'hit %':>7} {'warm p50':>9} {'warm p99':>9}")
+    for intent, q in quality['per_intent'].items():
+        lat = summary['latency']['warm']['per_intent'].get(intent, {})
+        print(f"{intent:<10} {q['questions']:>4} {q['intent_accuracy'] * 100:>9.1f} "
+              f"{q['answer_hit_rate'] * 100:>7.1f} {lat.get('p50_us', 0):>9.1f} {lat.get('p99_us', 0):>9.1f}")
+
+    print(f"\n{'latency us':<10} {'calls':>8} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for form in ('warm', 'cold'):
+        s = summary['latency'][form]['overall']
+        print(f"{form:<10} {s['calls']:>8} {s['mean_us']:>9.1f} {s['p50_us']:>9.1f} "
+              f"{s['p95_us']:>9.1f} {s['p99_us']:>9.1f} {s['max_us']:>9.1f}")
+
+    print(f"\n{'threads':<10} {'answers/s':>10}")
+    for t in summary['throughput']:
+        print(f"{t['threads']:<10} {t['answers_per_s']:>10.0f}")
+
+    if result['config']['verbose'] and quality['misses']:
+        print("\nmisses:")
+        for miss in quality['misses']:
+            print(f"  [{miss['intent']} -> {miss['predicted']}{'' if miss['hit'] else ', no hit'}] "
+                  f"{miss['company_name']}: {miss['question']}")
+
+
+def save_result(result, name=None):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(RESULTS_DIR, f"{stamp}-{RESULT_SUFFIX}{'-' + name if name else ''}.json")
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def run(args):
+    sites = load_cases(args.fixtures)
+    threads = [int(t) for t in args.threads.split(',')]
+    summary = {
+        'quality': evaluate(sites),
+        'latency': {
+            'warm': measure_latency(sites, 'knowledge', args.repeat),
+            'cold': measure_latency(sites, 'context', args.repeat)
+        },
+        'throughput': [measure_throughput(sites, n, args.duration, args.seed) for n in threads]
+    }
+
+    config = {k: v for k, v in vars(args).items() if k not in ('func', 'name')}
+    config['sites'] = len(sites)
+    result = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': config,
+        'summary': summary,
+    }
+    print_summary(result)
+    if not args.no_save:
+        print(f"\nSaved {save_result(result, args.name)}")
+
+
+def headline(result):
+    """The numbers compared across runs"""
+    summary = result['summary']
+    throughput = summary['throughput']
+    return {
+        'intent_accuracy': summary['quality']['intent_accuracy'],
+        'answer_hit_rate': summary['quality']['answer_hit_rate'],
+        'warm_p50_us': summary['latency']['warm']['overall']['p50_us'],
+        'warm_p99_us': summary['latency']['warm']['overall']['p99_us'],
+        'cold_p50_us': summary['latency']['cold']['overall']['p50_us'],
+        'answers_per_s_1': throughput[0]['answers_per_s'] if throughput else 0.0,
+        'answers_per_s_max': max((t['answers_per_s'] for t in throughput), default=0.0),
+    }
+
+
+def compare(args):
+    runs = []
+    for path in args.results:
+        with open(path) as f:
+            runs.append((os.path.basename(path), headline(json.load(f))))
+
+    print(f"{'metric':<18}" + ''.join(f"{name[:28]:>30}" for name, _ in runs))
+    for key in runs[0][1]:
+        values = [values[key] for _, values in runs]
+        row = f"{key:<18}" + ''.join(f"{v:>30.3f}" for v in values)
+        if values[0]:
+            row += f"   ({(values[-1] - values[0]) / values[0] * 100:+.1f}%)"
+        print(row)
+
+
+def history(args):
+    paths = sorted(glob.glob(os.path.join(RESULTS_DIR, f"*-{RESULT_SUFFIX}*.json")))
+    if not paths:
+        print(f"No fallback results in {RESULTS_DIR}")
+        return
+    print(f"{'timestamp':<20} {'commit':<9} {'intent %':>9} {'hit %':>7} {'warm p50':>9} "
+          f"{'warm p99':>9} {'cold p50':>9} {'ans/s 1t':>9}")
+    for path in paths[-args.last:]:
+        with open(path) as f:
+            result = json.load(f)
+        h = headline(result)
+        print(f"{result['timestamp']:<20} {result['commit'] or '-':<9} {h['intent_accuracy'] * 100:>9.1f} "
+              f"{h['answer_hit_rate'] * 100:>7.1f} {h['warm_p50_us']:>9.1f} {h['warm_p99_us']:>9.1f} "
+              f"{h['cold_p50_us']:>9.1f} {h['answers_per_s_1']:>9.0f}")
+
+
+def capture(args):
+    """Add a company's saved scrape from the database to the fixture file (questions to be labeled)"""
+    import database
+
+    snapshot = database.get_company_snapshot(args.company_id)
+    if snapshot is None:
+        print(f"No snapshot for company {args.company_id}")
+        return 1
+
+    scraped_data = snapshot['scraped_data']
+    if 'data' not in scraped_data:
+        scraped_data = {'success': True, 'data': scraped_data, 'url': snapshot['website_url']}
+    scraped_data['data'].pop('full_text', None)
+
+    with open(args.fixtures) as f:
+        fixtures = json.load(f)
+    fixtures['sites'].append({
+        'company_name': args.company_name or snapshot['company_name'],
+        'website_url': snapshot['website_url'],
+        'scraped_data': scraped_data,
+        'questions': []
+    })
+    with open(args.fixtures, 'w') as f:
+        json.dump(fixtures, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+    print(f"Added {snapshot['website_url']} to {args.fixtures}; label its questions before the next run")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help='run the benchmark')
+    p.add_argument('--fixtures', default=FIXTURES)
+    p.add_argument('--repeat', type=int, default=200, help='timed calls per question')
+    p.add_argument('--threads', default='1,4,8', help='comma-separated thread counts for the throughput run')
+    p.add_argument('--duration', type=float, default=2, help='seconds per throughput run')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--name', help='suffix for the saved result file')
+    p.add_argument('--no-save', action='store_true')
+    p.add_argument('--verbose', action='store_true', help='list mislabeled and missed questions')
+    p.set_defaults(func=run)
+
+    c = sub.add_parser('compare', help='compare saved results')
+    c.add_argument('results', nargs='+')
+    c.set_defaults(func=compare)
+
+    h = sub.add_parser('history', help='saved results in order, one line per run')
+    h.add_argument('--last', type=int, default=20)
+    h.set_defaults(func=history)
+
+    s = sub.add_parser('capture', help="add a company's saved scrape to the fixtures")
+    s.add_argument('--company-id', type=int, required=True)
+    s.add_argument('--company-name', help='name the bot answers as (default: the stored company name)')
+    s.add_argument('--fixtures', default=FIXTURES)
+    s.set_defaults(func=capture)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
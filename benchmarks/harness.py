@@ -0,0 +1,344 @@
+"""
+Capacity benchmark for the chatbot API using local stand-ins.
+
+Starts benchmarks/fake_server.py (fake Gemini + in-process database) and a
+fixture website server, then drives an open-loop mix of /create-chatbot and
+/chat at a target request rate. Reports throughput, p50/p95/p99 latency,
+cache hit rate and error rates, and saves the run to benchmarks/results/.
+
+    python -m benchmarks.harness run --rps 50 --duration 30 --llm-latency-ms 400
+    python -m benchmarks.harness run --server async --rps 200 --llm-429-ratio 0.2
+    python -m benchmarks.harness compare benchmarks/results/A.json benchmarks/results/B.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from datetime import datetime
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FixtureSiteServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+QUESTION_TEMPLATES = [
+    "What services do you offer?",
+    "Tell me about the company",
+    "How can I contact you?",
+    "Where are you located?",
+    "Do you do {topic}?",
+    "What is your experience with {topic}?",
+]
+TOPICS = ['web development', 'mobile apps', 'AI consulting', 'ERP', 'cloud migration', 'data analytics']
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def question_pool(size, seed):
+    rnd = random.Random(seed)
+    pool = []
+    for i in range(size):
+        template = QUESTION_TEMPLATES[i % len(QUESTION_TEMPLATES)]
+        pool.append(template.format(topic=rnd.choice(TOPICS)) + ('' if i < len(QUESTION_TEMPLATES) else f" #{i}"))
+    return pool
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+class OpStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.cached = 0
+        self.fallback = 0
+
+    def record(self, status, seconds, body):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == 200:
+            self.latencies.append(seconds)
+            if body.get('cached'):
+                self.cached += 1
+            if body.get('fallback'):
+                self.fallback += 1
+
+    def summary(self, elapsed):
+        total = sum(self.statuses.values())
+        ok = len(self.latencies)
+        return {
+            'requests': total,
+            'ok': ok,
+            'throughput_rps': ok / elapsed if elapsed else 0.0,
+            'error_rate': (total - ok) / total if total else 0.0,
+            'statuses': {str(k): v for k, v in sorted(self.statuses.items(), key=lambda kv: str(kv[0]))},
+            'p50_ms': percentile(self.latencies, 50) * 1000,
+            'p95_ms': percentile(self.latencies, 95) * 1000,
+            'p99_ms': percentile(self.latencies, 99) * 1000,
+            'cache_hit_rate': self.cached / ok if ok else 0.0,
+            'fallback_rate': self.fallback / ok if ok else 0.0,
+        }
+
+
+class Workload:
+    def __init__(self, args, base_url, sites):
+        self.args = args
+        self.base_url = base_url
+        self.sites = sites
+        self.rnd = random.Random(args.seed)
+        self.questions = question_pool(args.question_pool, args.seed)
+        self.company_ids = []
+        self.stats = {'create': OpStats(), 'chat': OpStats()}
+        self.inflight = 0
+        self.shed = 0
+
+    async def post(self, session, op, path, payload):
+        start = time.perf_counter()
+        try:
+            async with session.post(f"{self.base_url}{path}", json=payload) as response:
+                try:
+                    body = await response.json(content_type=None)
+                except Exception:
+                    body = {}
+                self.stats[op].record(response.status, time.perf_counter() - start, body)
+                return body
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.stats[op].record(type(e).__name__, time.perf_counter() - start, {})
+            return {}
+
+    async def create(self, session, record=True):
+        site_id = self.rnd.randrange(self.args.sites)
+        payload = {'company_name': f"Fixture Company {site_id}", 'website_url': self.sites.url(site_id)}
+        body = await self.post(session, 'create', '/create-chatbot', payload)
+        if body.get('success'):
+            self.company_ids.append(body['company_id'])
+
+    async def chat(self, session):
+        payload = {
+            'company_id': self.rnd.choice(self.company_ids),
+            'question': self.rnd.choice(self.questions)
+        }
+        await self.post(session, 'chat', '/chat', payload)
+
+    async def one(self, session):
+        self.inflight += 1
+        try:
+            if not self.company_ids or self.rnd.random() < self.args.create_ratio:
+                await self.create(session)
+            else:
+                await self.chat(session)
+        finally:
+            self.inflight -= 1
+
+    async def run(self):
+        args = self.args
+        timeout = aiohttp.ClientTimeout(total=args.timeout)
+        connector = aiohttp.TCPConnector(limit=args.max_inflight)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            for _ in range(args.warm_bots):
+                await self.create(session)
+            self.stats['create'] = OpStats()
+
+            # Open loop: arrivals follow the target rate regardless of how fast the server answers
+            tasks = []
+            interval = 1.0 / args.rps
+            started = time.perf_counter()
+            next_at = started
+            while next_at < started + args.duration:
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if self.inflight >= args.max_inflight:
+                    self.shed += 1
+                else:
+                    tasks.append(asyncio.create_task(self.one(session)))
+                next_at += interval
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+
+        total_ok = sum(len(s.latencies) for s in self.stats.values())
+        return {
+            'elapsed_s': elapsed,
+            'throughput_rps': total_ok / elapsed if elapsed else 0.0,
+            'client_shed': self.shed,
+            'create': self.stats['create'].summary(elapsed),
+            'chat': self.stats['chat'].summary(elapsed),
+        }
+
+
+def start_server(args, port):
+    env = dict(os.environ)
+    env.update({
+        'BENCH_LLM_LATENCY_MS': str(args.llm_latency_ms),
+        'BENCH_LLM_JITTER_MS': str(args.llm_jitter_ms),
+        'BENCH_LLM_429_RATIO': str(args.llm_429_ratio),
+        'BENCH_LLM_STREAM_CHUNKS': str(args.llm_stream_chunks),
+        'BENCH_DB': args.db,
+        'GEMINI_API_KEY': '',
+    })
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.fake_server', '--server', args.server, '--port', str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL
+    )
+    return process
+
+
+async def wait_for_server(base_url, process, timeout=30):
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("benchmark server exited during startup (run with --verbose)")
+            try:
+                async with session.get(f"{base_url}/") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("benchmark server did not start")
+
+
+def print_summary(result):
+    print(f"\nserver={result['config']['server']} rps target={result['config']['rps']} "
+          f"achieved={result['summary']['throughput_rps']:.1f} client_shed={result['summary']['client_shed']}")
+    print(f"{'op':<8} {'reqs':>7} {'ok rps':>8} {'err %':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'cache %':>8} {'fallbk %':>8}")
+    for op in ('create', 'chat'):
+        s = result['summary'][op]
+        print(f"{op:<8} {s['requests']:>7} {s['throughput_rps']:>8.1f} {s['error_rate'] * 100:>7.2f} "
+              f"{s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f} "
+              f"{s['cache_hit_rate'] * 100:>8.1f} {s['fallback_rate'] * 100:>8.1f}")
+        if s['statuses']:
+            print(f"{'':<8} statuses: {s['statuses']}")
+
+
+def save_result(result, name=None):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    filename = f"{stamp}-{name or result['config']['server']}.json"
+    path = os.path.join(RESULTS_DIR, filename)
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+async def measure(args, inspect_server=None):
+    """
+    One benchmark run; returns the result (config and summary). If given,
+    inspect_server(pid) is called after the load, while the server still
+    runs, and what it returns is kept under 'server'.
+    """
+    sites = FixtureSiteServer(latency_ms=args.site_latency_ms, paragraphs=args.site_paragraphs).start()
+    port = args.port
+    base_url = f"http://127.0.0.1:{port}"
+    process = start_server(args, port)
+    server = None
+    try:
+        await wait_for_server(base_url, process)
+        summary = await Workload(args, base_url, sites).run()
+        if inspect_server is not None:
+            server = inspect_server(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+        sites.stop()
+
+    config = {k: v for k, v in vars(args).items() if k not in ('func', 'name', 'verbose')}
+    result = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': config,
+        'summary': summary,
+    }
+    if server is not None:
+        result['server'] = server
+    return result
+
+
+async def run(args):
+    result = await measure(args)
+    print_summary(result)
+    if not args.no_save:
+        print(f"\nSaved {save_result(result, args.name)}")
+
+
+def compare(args):
+    runs = []
+    for path in args.results:
+        with open(path) as f:
+            runs.append((os.path.basename(path), json.load(f)))
+
+    metrics = [('throughput_rps', 'ok rps'), ('p50_ms', 'p50 ms'), ('p95_ms', 'p95 ms'),
+               ('p99_ms', 'p99 ms'), ('error_rate', 'err rate'), ('cache_hit_rate', 'cache hit')]
+    for op in ('chat', 'create'):
+        print(f"\n[{op}]")
+        print(f"{'metric':<12}" + ''.join(f"{name[:28]:>30}" for name, _ in runs))
+        for key, label in metrics:
+            values = [run['summary'][op][key] for _, run in runs]
+            row = f"{label:<12}" + ''.join(f"{v:>30.3f}" for v in values)
+            if values[0]:
+                row += f"   ({(values[-1] - values[0]) / values[0] * 100:+.1f}%)"
+            print(row)
+
+
+def add_run_arguments(p):
+    p.add_argument('--server', choices=['flask', 'async'], default='flask')
+    p.add_argument('--db', choices=['fake', 'sqlite'], default='fake',
+                   help='in-memory database stand-in or a temporary SQLite file')
+    p.add_argument('--port', type=int, default=5100)
+    p.add_argument('--rps', type=float, default=50, help='target arrival rate')
+    p.add_argument('--duration', type=float, default=30, help='seconds of load')
+    p.add_argument('--create-ratio', type=float, default=0.02, help='fraction of requests that are /create-chatbot')
+    p.add_argument('--warm-bots', type=int, default=5, help='bots created before the timed run')
+    p.add_argument('--sites', type=int, default=50, help='distinct fixture websites')
+    p.add_argument('--question-pool', type=int, default=60, help='distinct questions (smaller = more cache hits)')
+    p.add_argument('--max-inflight', type=int, default=1000)
+    p.add_argument('--timeout', type=float, default=60)
+    p.add_argument('--llm-latency-ms', type=float, default=400)
+    p.add_argument('--llm-jitter-ms', type=float, default=100)
+    p.add_argument('--llm-429-ratio', type=float, default=0.0)
+    p.add_argument('--llm-stream-chunks', type=int, default=5)
+    p.add_argument('--site-latency-ms', type=float, default=50)
+    p.add_argument('--site-paragraphs', type=int, default=40, help='size of each fixture page')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--name', help='suffix for the saved result file')
+    p.add_argument('--no-save', action='store_true')
+    p.add_argument('--verbose', action='store_true', help='show server stderr')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help='run a benchmark')
+    add_run_arguments(p)
+    p.set_defaults(func=lambda a: asyncio.run(run(a)))
+
+    c = sub.add_parser('compare', help='compare saved results')
+    c.add_argument('results', nargs='+')
+    c.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Closed-loop load test for /chat.
+
+Creates one chatbot on each target server, then keeps --concurrency clients
+asking questions for --duration seconds and prints throughput and latency.
+Pass several --target URLs to compare the sync (gunicorn app:app) and
+asyncio (async_app) serving modes side by side.
+
+    python benchmarks/load_test.py \
+        --target sync=http://localhost:5000 --target async=http://localhost:5001 \
+        --website https://example.com --concurrency 200 --duration 30
+"""
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+QUESTIONS = [
+    "What services do you offer?",
+    "Tell me about the company",
+    "How can I contact you?",
+    "Where are you located?",
+    "Do you build mobile apps?",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+async def create_chatbot(session, base_url, company_name, website_url):
+    async with session.post(f"{base_url}/create-chatbot", json={
+        'company_name': company_name,
+        'website_url': website_url
+    }) as response:
+        data = await response.json()
+        if not data.get('success'):
+            raise RuntimeError(f"{base_url}: could not create chatbot: {data.get('error')}")
+        return data['company_id']
+
+
+async def client_loop(session, base_url, company_id, deadline, latencies, errors, worker_id):
+    i = worker_id
+    while time.perf_counter() < deadline:
+        # A unique suffix defeats the response cache so every request reaches the model
+        question = f"{QUESTIONS[i % len(QUESTIONS)]} ({worker_id}-{i})"
+        i += 1
+        start = time.perf_counter()
+        try:
+            async with session.post(f"{base_url}/chat", json={
+                'company_id': company_id,
+                'question': question
+            }) as response:
+                await response.read()
+                if response.status != 200:
+                    errors[response.status] = errors.get(response.status, 0) + 1
+                    continue
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_target(name, base_url, args):
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        company_id = await create_chatbot(session, base_url, args.company, args.website)
+
+        latencies = []
+        errors = {}
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*[
+            client_loop(session, base_url, company_id, deadline, latencies, errors, worker_id)
+            for worker_id in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+
+    return {
+        'target': name,
+        'requests': len(latencies),
+        'errors': sum(errors.values()),
+        'error_kinds': errors,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def print_report(results):
+    print(f"{'target':<10} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for r in results:
+        print(f"{r['target']:<10} {r['requests']:>9} {r['errors']:>7} {r['throughput_rps']:>9.1f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}")
+    if len(results) > 1 and results[0]['throughput_rps']:
+        base = results[0]
+        for r in results[1:]:
+            print(f"{r['target']} / {base['target']} throughput: {r['throughput_rps'] / base['throughput_rps']:.2f}x")
+
+
+def parse_target(value):
+    name, sep, url = value.partition('=')
+    if not sep:
+        name, url = value, value
+    return name, url.rstrip('/')
+
+
+async def main(args):
+    results = []
+    for name, base_url in args.target:
+        print(f"Running {name} ({base_url}) for {args.duration}s at concurrency {args.concurrency}...")
+        results.append(await run_target(name, base_url, args))
+    print_report(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', type=parse_target, required=True,
+                        help='name=base_url of a running server (repeatable)')
+    parser.add_argument('--website', required=True, help='website to create the chatbot from')
+    parser.add_argument('--company', default='Load Test Co')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--timeout', type=float, default=60)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,166 @@
+"""
+Benchmark: /chat latency while the same server is scraping websites.
+
+Runs the harness three times against large fixture pages and compares
+/chat latency:
+
+  - chat only: no scrapes
+  - in-process parsing: a share of requests are /create-chatbot, and their
+    HTML is parsed on the web worker's own threads (PARSE_PROCESSES=0)
+  - parse pool: the same mix, with parsing in the parse pool
+
+Shared scrapes are turned off so every /create-chatbot parses a page. If
+parsing is off the GIL, chat latency in the third run stays close to the
+first.
+
+After the parse pool run, the resident memory of each parser process is
+checked: they should load only the parsing code, not a copy of the web app.
+The benchmark exits with status 1 if one is above --max-parser-rss-mb.
+
+    python -m benchmarks.parse_bench
+    python -m benchmarks.parse_bench --server async --rps 40 --create-ratio 0.1 --site-paragraphs 4000
+"""
+import os
+import sys
+import copy
+import json
+import asyncio
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.harness import RESULTS_DIR, add_run_arguments, measure, git_commit
+
+RESULT_SUFFIX = 'parse'
+# Resident memory a parser process may use: the scraper and BeautifulSoup
+# plus a page being parsed, far less than a web worker
+MAX_PARSER_RSS_MB = 80
+
+
+def rss_mb(pid):
+    """Resident memory of a process in MB, or None (gone, or no /proc)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def worker_pids(pid):
+    """Spawned multiprocessing workers of a process (Linux only)"""
+    pids = []
+    for name in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{name}/cmdline", 'rb') as f:
+                cmdline = f.read()
+        except OSError:
+            continue
+        # The parent pid is the second field after the (command name)
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid and b'--multiprocessing-fork' in cmdline:
+            pids.append(int(name))
+    return pids
+
+
+def server_memory(pid):
+    parsers = [rss_mb(child) for child in worker_pids(pid)]
+    server = rss_mb(pid)
+    return {
+        'server_rss_mb': round(server, 1) if server is not None else None,
+        'parser_rss_mb': [round(rss, 1) for rss in parsers if rss is not None]
+    }
+
+
+def scenarios(args):
+    """(name, harness args, environment) for each run"""
+    chat_only = copy.copy(args)
+    chat_only.create_ratio = 0.0
+    return [
+        ('chat only', chat_only, {}),
+        ('in-process parsing', args, {'PARSE_PROCESSES': '0'}),
+        ('parse pool', args, {'PARSE_PROCESSES': str(args.parse_processes)}),
+    ]
+
+
+def run_scenario(args, env):
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        return asyncio.run(measure(args, inspect_server=server_memory))
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def print_report(runs):
+    print(f"\n{'scenario':<20} {'chats':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'creates':>8} {'create p50':>11}")
+    for name, result in runs:
+        chat, create = result['summary']['chat'], result['summary']['create']
+        print(f"{name:<20} {chat['ok']:>6} {chat['p50_ms']:>8.1f} {chat['p95_ms']:>8.1f} {chat['p99_ms']:>8.1f} "
+              f"{create['ok']:>8} {create['p50_ms']:>11.1f}")
+
+    baseline = runs[0][1]['summary']['chat']
+    for name, result in runs[1:]:
+        chat = result['summary']['chat']
+        if baseline['p95_ms']:
+            print(f"{name}: chat p95 {(chat['p95_ms'] - baseline['p95_ms']) / baseline['p95_ms'] * 100:+.1f}% vs chat only")
+
+
+def check_parser_memory(result, max_rss_mb):
+    """Print parser process memory; False if one is over max_rss_mb"""
+    memory = result.get('server', {})
+    parsers = memory.get('parser_rss_mb', [])
+    if not parsers:
+        print("\nparser memory: no parser processes found (not Linux, or no page was parsed)")
+        return True
+    print(f"\nparser memory: server {memory['server_rss_mb']} MB, parsers {parsers} MB (limit {max_rss_mb} MB each)")
+    if max(parsers) > max_rss_mb:
+        print("FAIL: parser processes are too large; are they importing the web app?")
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_run_arguments(parser)
+    parser.add_argument('--parse-processes', type=int, default=2, help='parse pool size for the third run')
+    parser.add_argument('--max-parser-rss-mb', type=float, default=MAX_PARSER_RSS_MB,
+                        help='largest resident memory allowed per parser process')
+    parser.set_defaults(rps=30, duration=20, create_ratio=0.05, llm_latency_ms=100, llm_jitter_ms=20,
+                        site_latency_ms=10, site_paragraphs=2000, sites=1000)
+    args = parser.parse_args()
+
+    os.environ['SHARED_SCRAPE_MAX_AGE'] = '0'
+    runs = []
+    for name, scenario_args, env in scenarios(args):
+        print(f"Running: {name}")
+        runs.append((name, run_scenario(scenario_args, env)))
+    print_report(runs)
+    memory_ok = check_parser_memory(runs[-1][1], args.max_parser_rss_mb)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{RESULT_SUFFIX}.json")
+        with open(path, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'runs': {name: result for name, result in runs}
+            }, f, indent=2)
+        print(f"\nSaved {path}")
+    if not memory_ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
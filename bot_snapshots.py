@@ -0,0 +1,398 @@
+"""
+Chatbot snapshot files.
+
+`python bot_snapshots.py export bots.snap` writes every stored chatbot to one
+versioned file: its name and URL, its AI context, the parsed knowledge
+(headings, services and paragraphs as offsets into the context) and its
+unexpired stored answers. Bots with the same content hash share one context.
+
+Workers started with SNAPSHOT_FILE=bots.snap map the file read-only and build
+bots straight from it, with no scraping, decompression or parsing: a bot's
+CompanyKnowledge is a view of the mapped pages, which every worker on the
+host shares through the page cache. Answers in the file are served like
+in-process cache hits. Bots whose content changed after the export (the
+database has another context hash for them) are loaded from the database as
+before.
+
+Layout (little-endian): a header, then fixed-size bot records sorted by
+company_id, context records sorted by content hash, answer records sorted by
+(context, question hash), and a heap of UTF-8 text and span offsets.
+"""
+import os
+import sys
+import mmap
+import time
+import struct
+import argparse
+import tempfile
+import threading
+from array import array
+from datetime import datetime
+
+import logs
+import database
+from knowledge import CompanyKnowledge
+
+MAGIC = b'CHATBOTS'
+FORMAT_VERSION = 1
+SUPPORTED_VERSIONS = (1,)
+
+# magic, version, bot count, context count, answer count,
+# bots/contexts/answers/heap section offsets, heap size, created at (epoch seconds)
+HEADER = struct.Struct('<8sH2xIIIQQQQQd')
+# company_id, context index, name offset/length, website_url offset/length
+BOT = struct.Struct('<qIQIQI4x')
+# content hash, text offset/length, spans offset, heading/service/paragraph counts,
+# title, description and emails ('\n'-joined) offset/length, first answer, answer count
+CONTEXT = struct.Struct('<32sQIQIIIQIQIQIII4x')
+# question hash, response offset/length, expires at (epoch seconds)
+ANSWER = struct.Struct('<32sQId4x')
+
+# Chatbot snapshot file to serve bots and answers from (empty = database only)
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "")
+# Seconds between checks for bots whose content changed since the export
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv("SNAPSHOT_CHECK_INTERVAL", "60"))
+
+
+def _align(offset, boundary=8):
+    return (offset + boundary - 1) // boundary * boundary
+
+
+class _Heap:
+    """Text and span arrays, spooled to a temporary file while the tables are built"""
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+
+    def add(self, data, boundary=1):
+        padding = _align(self.size, boundary) - self.size
+        if padding:
+            self.file.write(b'\0' * padding)
+        offset = self.size + padding
+        self.file.write(data)
+        self.size = offset + len(data)
+        return offset, len(data)
+
+    def add_text(self, text):
+        return self.add(text.encode('utf-8'))
+
+
+def write_snapshot_file(path, snapshots, load_answers=database.get_live_answers):
+    """
+    Write snapshots ({'company_id', 'company_name', 'website_url', 'context',
+    'context_hash'}) and load_answers(context_hashes)' answers to path
+    (atomically); returns (bots, contexts, answers) counts
+    """
+    if sys.byteorder != 'little':
+        raise RuntimeError("Snapshot files are written on little-endian hosts only")
+
+    heap = _Heap()
+    bots = []
+    contexts = {}
+    try:
+        for snapshot in snapshots:
+            context_hash = snapshot['context_hash']
+            if context_hash not in contexts:
+                knowledge = CompanyKnowledge(snapshot['context'])
+                text = heap.add(bytes(knowledge.buffer))
+                spans = array('I')
+                for field in (knowledge.headings, knowledge.services, knowledge.paragraphs):
+                    spans.extend(field.offsets)
+                spans_offset, _ = heap.add(spans.tobytes(), boundary=4)
+                contexts[context_hash] = (
+                    text + (spans_offset, len(knowledge.headings), len(knowledge.services), len(knowledge.paragraphs))
+                    + heap.add_text(knowledge.title) + heap.add_text(knowledge.description)
+                    + heap.add_text('\n'.join(knowledge.emails))
+                )
+            bots.append((snapshot['company_id'], context_hash)
+                        + heap.add_text(snapshot['company_name']) + heap.add_text(snapshot['website_url']))
+
+        by_context = {}
+        for context_hash, question_hash, response, expires_at in load_answers(list(contexts)):
+            if context_hash in contexts:
+                by_context.setdefault(context_hash, []).append(
+                    (bytes.fromhex(question_hash),) + heap.add_text(response) + (expires_at.timestamp(),)
+                )
+
+        context_order = sorted(contexts)
+        context_index = {context_hash: i for i, context_hash in enumerate(context_order)}
+        context_records = []
+        answer_records = []
+        for context_hash in context_order:
+            answers = sorted(by_context.get(context_hash, []))
+            context_records.append(CONTEXT.pack(bytes.fromhex(context_hash), *contexts[context_hash],
+                                                len(answer_records), len(answers)))
+            answer_records.extend(ANSWER.pack(*answer) for answer in answers)
+        bots.sort()
+        bot_records = [BOT.pack(company_id, context_index[context_hash], *strings)
+                       for company_id, context_hash, *strings in bots]
+
+        bots_offset = _align(HEADER.size)
+        contexts_offset = _align(bots_offset + BOT.size * len(bot_records))
+        answers_offset = _align(contexts_offset + CONTEXT.size * len(context_records))
+        heap_offset = _align(answers_offset + ANSWER.size * len(answer_records))
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(bot_records), len(context_records),
+                                    len(answer_records), bots_offset, contexts_offset, answers_offset,
+                                    heap_offset, heap.size, time.time()))
+                for offset, records in ((bots_offset, bot_records), (contexts_offset, context_records),
+                                        (answers_offset, answer_records)):
+                    f.write(b'\0' * (offset - f.tell()))
+                    f.write(b''.join(records))
+                f.write(b'\0' * (heap_offset - f.tell()))
+                heap.file.seek(0)
+                while True:
+                    chunk = heap.file.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    finally:
+        heap.file.close()
+
+    return len(bot_records), len(context_records), len(answer_records)
+
+
+class SnapshotFile:
+    """
+    Read-only, memory-mapped chatbot snapshot file. Lookups are binary
+    searches over the mapped records; nothing is read until it is used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        if len(self._mmap) < HEADER.size:
+            raise ValueError(f"{path} is not a chatbot snapshot file")
+        (magic, version, self.bot_count, self.context_count, self.answer_count, self._bots, self._contexts,
+         self._answers, self._heap, heap_size, self.created_at) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a chatbot snapshot file")
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"{path} has unsupported snapshot format version {version}")
+        if sys.byteorder != 'little':
+            raise ValueError("Snapshot files can only be mapped on little-endian hosts")
+        if self._heap + heap_size > len(self._mmap):
+            raise ValueError(f"{path} is truncated")
+
+        self._knowledge = {}  # context index -> CompanyKnowledge, shared by that context's bots
+        self._lock = threading.Lock()
+        self.stale = set()
+        self.checked_at = 0.0
+
+    def _bot(self, index):
+        return BOT.unpack_from(self._mmap, self._bots + index * BOT.size)
+
+    def _context(self, index):
+        return CONTEXT.unpack_from(self._mmap, self._contexts + index * CONTEXT.size)
+
+    def _text(self, offset, length):
+        return str(self._view[self._heap + offset:self._heap + offset + length], 'utf-8')
+
+    def _find(self, count, key_of, key):
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if key_of(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < count and key_of(low) == key else None
+
+    def _knowledge_for(self, index, record):
+        knowledge = self._knowledge.get(index)
+        if knowledge is not None:
+            return knowledge
+
+        (_, text_offset, text_length, spans_offset, headings, services, paragraphs,
+         title_offset, title_length, description_offset, description_length,
+         emails_offset, emails_length, _, _) = record
+        start = self._heap + text_offset
+        spans_start = self._heap + spans_offset
+        spans = self._view[spans_start:spans_start + 8 * (headings + services + paragraphs)].cast('I')
+        emails = self._text(emails_offset, emails_length)
+        knowledge = CompanyKnowledge.from_parts(
+            self._view[start:start + text_length],
+            self._text(title_offset, title_length),
+            self._text(description_offset, description_length),
+            spans[:2 * headings],
+            spans[2 * headings:2 * (headings + services)],
+            spans[2 * (headings + services):],
+            emails.split('\n') if emails else []
+        )
+        with self._lock:
+            return self._knowledge.setdefault(index, knowledge)
+
+    def bot(self, company_id):
+        """Chatbot entry for company_id (as the registry holds it), or None if absent or stale"""
+        if company_id in self.stale:
+            return None
+        index = self._find(self.bot_count, lambda i: self._bot(i)[0], company_id)
+        if index is None:
+            return None
+
+        _, context_index, name_offset, name_length, url_offset, url_length = self._bot(index)
+        context = self._context(context_index)
+        return {
+            'company_id': company_id,
+            'company_name': self._text(name_offset, name_length),
+            'website_url': self._text(url_offset, url_length),
+            'knowledge': self._knowledge_for(context_index, context),
+            'context_hash': context[0].hex(),
+            'ready': True
+        }
+
+    def company_ids(self, newest_first=False):
+        indexes = range(self.bot_count - 1, -1, -1) if newest_first else range(self.bot_count)
+        for index in indexes:
+            company_id = self._bot(index)[0]
+            if company_id not in self.stale:
+                yield company_id
+
+    def answer(self, context_hash, question_hash):
+        """Unexpired exported answer (with the company name placeholder), or None"""
+        if not self.answer_count or not isinstance(context_hash, str) or len(context_hash) != 64:
+            return None
+        try:
+            context_key = bytes.fromhex(context_hash)
+        except ValueError:
+            return None
+        context_index = self._find(self.context_count, lambda i: self._context(i)[0], context_key)
+        if context_index is None:
+            return None
+
+        first, count = self._context(context_index)[-2:]
+
+        def answer(i):
+            return ANSWER.unpack_from(self._mmap, self._answers + (first + i) * ANSWER.size)
+
+        index = self._find(count, lambda i: answer(i)[0], bytes.fromhex(question_hash))
+        if index is None:
+            return None
+        _, offset, length, expires_at = answer(index)
+        return self._text(offset, length) if expires_at > time.time() else None
+
+    def check_against_database(self):
+        """Mark bots whose stored context changed since the export as stale; False if the database is unavailable"""
+        self.checked_at = time.time()
+        current = database.get_context_hashes()
+        if current is None:
+            return False
+        stale = set()
+        for index in range(self.bot_count):
+            company_id, context_index = self._bot(index)[:2]
+            if current.get(company_id) != self._context(context_index)[0].hex():
+                stale.add(company_id)
+        self.stale = stale
+        return True
+
+    def recheck(self, interval=SNAPSHOT_CHECK_INTERVAL):
+        """check_against_database, at most once per interval seconds (bots re-created elsewhere go stale)"""
+        if time.time() - self.checked_at >= interval:
+            with self._lock:
+                if time.time() - self.checked_at < interval:
+                    return
+                self.checked_at = time.time()
+            self.check_against_database()
+
+    def info(self):
+        return {
+            'path': self.path,
+            'format_version': FORMAT_VERSION,
+            'bots': self.bot_count,
+            'contexts': self.context_count,
+            'answers': self.answer_count,
+            'bytes': len(self._mmap),
+            'created_at': datetime.fromtimestamp(self.created_at).isoformat(timespec='seconds'),
+            'stale_bots': len(self.stale)
+        }
+
+    def close(self):
+        self._knowledge.clear()
+        self._view.release()
+        self._mmap.close()
+
+
+_current = None
+_current_loaded = False
+_current_lock = threading.Lock()
+
+
+def current():
+    """
+    The SNAPSHOT_FILE snapshot, mapped and checked against the database on
+    first use; None if it isn't set or can't be read
+    """
+    global _current, _current_loaded
+    if _current_loaded:
+        return _current
+    with _current_lock:
+        if not _current_loaded:
+            if SNAPSHOT_FILE:
+                try:
+                    snapshots = SnapshotFile(SNAPSHOT_FILE)
+                    snapshots.check_against_database()
+                    info = snapshots.info()
+                    logs.info('snapshot_file_mapped', path=SNAPSHOT_FILE, bots=info['bots'], stale_bots=info['stale_bots'])
+                    _current = snapshots
+                except (OSError, ValueError) as e:
+                    logs.warning('snapshot_file_unused', path=SNAPSHOT_FILE, error=str(e))
+            _current_loaded = True
+    return _current
+
+
+def export(path, limit=None, answers=True):
+    """Export stored chatbots (all, or the first limit by company_id) to a snapshot file"""
+    snapshots = database.iter_company_snapshots()
+    if limit:
+        snapshots = (snapshot for _, snapshot in zip(range(limit), snapshots))
+    return write_snapshot_file(path, snapshots, database.get_live_answers if answers else lambda hashes: [])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export chatbots to a memory-mappable snapshot file")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    export_parser = subcommands.add_parser('export', help="write stored chatbots and their answers to a file")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--limit', type=int, help="only the first N companies")
+    export_parser.add_argument('--no-answers', action='store_true', help="leave out stored answers")
+    info_parser = subcommands.add_parser('info', help="describe a snapshot file")
+    info_parser.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        snapshots = SnapshotFile(args.path)
+        snapshots.check_against_database()
+        for key, value in snapshots.info().items():
+            print(f"{key}: {value}")
+        snapshots.close()
+        return 0
+
+    conn = database.get_connection()
+    if conn is None:
+        print("Database is not reachable")
+        return 1
+    conn.close()
+
+    start = time.time()
+    bots, contexts, answers = export(args.path, args.limit, answers=not args.no_answers)
+    print(f"Exported {bots} chatbots ({contexts} distinct contexts, {answers} answers) to {args.path} "
+          f"({os.path.getsize(args.path)} bytes, {time.time() - start:.1f}s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
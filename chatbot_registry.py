@@ -0,0 +1,308 @@
+import os
+import sys
+import time
+import secrets
+import threading
+import itertools
+from collections import OrderedDict
+
+import logs
+import database
+import scraper
+import bot_snapshots
+import scrape_codec
+from knowledge import CompanyKnowledge
+
+# Memory budget for resident chatbot contexts (bytes)
+REGISTRY_MAX_BYTES = int(os.getenv("REGISTRY_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Ids handed out when the database is not available (in-memory operation).
+# They are negative so they never collide with AUTO_INCREMENT ids, and random
+# so two gunicorn workers never hand out the same one. 52 bits keeps them
+# exact as JavaScript numbers.
+LOCAL_ID_BITS = 52
+
+
+def allocate_local_id():
+    """Allocate a company id for running without a database, unique across worker processes"""
+    return -(secrets.randbits(LOCAL_ID_BITS) + 1)
+
+
+def estimate_size(bot):
+    """Approximate memory held by a chatbot entry, not counting its (shared) knowledge"""
+    return sum(sys.getsizeof(value) for key, value in bot.items() if key != 'knowledge') + sys.getsizeof(bot)
+
+
+def forget_answers(context_hash):
+    """Drop in-process answers for a context no resident bot uses any more"""
+    import ai_chatbot
+    ai_chatbot.forget_context(context_hash)
+
+
+# Bots loaded into each worker at startup (most recently updated first)
+REGISTRY_PRELOAD = int(os.getenv("REGISTRY_PRELOAD", "100"))
+# Seconds between checks of resident bots against their stored context hash (0 = never)
+REGISTRY_CHECK_INTERVAL = float(os.getenv("REGISTRY_CHECK_INTERVAL", "60"))
+
+
+def bot_from_snapshot(snapshot):
+    return {
+        'company_id': snapshot['company_id'],
+        'company_name': snapshot['company_name'],
+        'website_url': snapshot['website_url'],
+        'knowledge': CompanyKnowledge(snapshot['context']),
+        'context_hash': snapshot['context_hash'],
+        'ready': True
+    }
+
+
+def load_chatbot_from_database(company_id):
+    """Rebuild a chatbot entry from its stored snapshot (or, for older data, its scraped rows)"""
+    if company_id <= 0:
+        return None
+
+    snapshot = database.get_company_snapshot(company_id)
+    if snapshot:
+        return bot_from_snapshot(snapshot)
+
+    company_data = database.get_company_data(company_id)
+    if not company_data:
+        return None
+
+    company = company_data['company']
+    scraped_data = database.scraped_data_from_rows(company_data['scraped_data'])
+    if not scraped_data['paragraphs'] and scraped_data['full_text']:
+        # Rows saved before per-item storage only kept the full text
+        scraped_data['paragraphs'] = [scraped_data['full_text']]
+    scraped_result = {'success': True, 'data': scraped_data}
+    context = scraper.format_scraped_data_for_ai(scraped_result)
+
+    return {
+        'company_id': company_id,
+        'company_name': company['company_name'],
+        'website_url': company['website_url'],
+        'knowledge': CompanyKnowledge(context),
+        'context_hash': scrape_codec.context_hash(company['website_url'], context),
+        'ready': True
+    }
+
+
+def load_chatbot(company_id):
+    """A chatbot from the mapped snapshot file (SNAPSHOT_FILE), else from the database"""
+    snapshots = bot_snapshots.current()
+    bot = None
+    if snapshots is not None:
+        snapshots.recheck()
+        bot = snapshots.bot(company_id)
+    return bot or load_chatbot_from_database(company_id)
+
+
+class ChatbotRegistry:
+    """
+    Thread-safe LRU of chatbots keyed by company_id, each holding its context
+    as a CompanyKnowledge. Hot tenants stay in memory up to max_bytes; cold
+    tenants are rebuilt on first use, from the mapped snapshot file if there is
+    one, else from the database. Tenants whose context
+    has the same content hash hold one shared copy of it, counted once.
+    Every check_interval seconds resident tenants are compared with their
+    stored context hash, and those changed by another process are dropped.
+    """
+
+    def __init__(self, max_bytes=REGISTRY_MAX_BYTES, loader=load_chatbot, on_release=forget_answers,
+                 check_interval=REGISTRY_CHECK_INTERVAL):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.checked_at = time.time()
+        self._loader = loader
+        self._on_release = on_release
+        self._bots = OrderedDict()
+        self._sizes = {}
+        self._contexts = {}  # context_hash -> [knowledge, resident bots using it]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def get(self, company_id):
+        """Return the chatbot for company_id, loading it from the database if cold"""
+        self.recheck()
+        with self._lock:
+            bot = self._bots.get(company_id)
+            if bot is not None:
+                self._bots.move_to_end(company_id)
+                return bot
+
+            # Only one thread rehydrates a given tenant; others wait for it
+            pending = self._loading.get(company_id)
+            if pending is None:
+                pending = self._loading[company_id] = threading.Event()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            pending.wait()
+            with self._lock:
+                return self._bots.get(company_id)
+
+        try:
+            bot = self._loader(company_id)
+        except Exception as e:
+            logs.error('chatbot_load_failed', company_id=company_id, error=str(e))
+            bot = None
+
+        released = []
+        with self._lock:
+            # A concurrent put() wins over the (older) database copy
+            if company_id in self._bots:
+                bot = self._bots[company_id]
+            elif bot is not None:
+                released = self._insert(company_id, bot)
+            del self._loading[company_id]
+        pending.set()
+        self._release(released)
+        return bot
+
+    def put(self, company_id, company_name, website_url, context):
+        """Register (or replace) the chatbot for company_id"""
+        bot = {
+            'company_id': company_id,
+            'company_name': company_name,
+            'website_url': website_url,
+            'knowledge': CompanyKnowledge(context),
+            'context_hash': scrape_codec.context_hash(website_url, context),
+            'ready': True
+        }
+        snapshots = bot_snapshots.current()
+        if snapshots is not None:
+            # The exported copy is out of date from now on
+            snapshots.stale.add(company_id)
+        with self._lock:
+            released = self._insert(company_id, bot)
+        self._release(released)
+        return bot
+
+    def replace(self, company_id, company_name, website_url, context):
+        """put() for a chatbot that is resident; returns False (and does nothing) if it isn't"""
+        with self._lock:
+            if company_id not in self._bots:
+                return False
+        self.put(company_id, company_name, website_url, context)
+        return True
+
+    def preload(self, limit=REGISTRY_PRELOAD):
+        """Warm the registry with the most recently updated bots; returns how many were loaded"""
+        if limit <= 0:
+            return 0
+        snapshots = bot_snapshots.current()
+        if snapshots is not None:
+            # Mapped bots cost a few page faults each; highest company ids first
+            bots = (snapshots.bot(company_id) for company_id in itertools.islice(snapshots.company_ids(True), limit))
+        else:
+            bots = (bot_from_snapshot(snapshot) for snapshot in database.get_recent_company_snapshots(limit))
+
+        loaded = 0
+        released = []
+        for bot in bots:
+            with self._lock:
+                if bot['company_id'] in self._bots:
+                    continue
+                released += self._insert(bot['company_id'], bot)
+            loaded += 1
+        self._release(released)
+        return loaded
+
+    def check_against_database(self):
+        """
+        Drop resident bots whose stored context changed since they were loaded
+        (refreshed or re-created in another process); returns how many, or
+        None if the database is unavailable
+        """
+        self.checked_at = time.time()
+        with self._lock:
+            resident = {company_id: bot['context_hash'] for company_id, bot in self._bots.items() if company_id > 0}
+        if not resident:
+            return 0
+        current = database.get_context_hashes(resident)
+        if current is None:
+            return None
+        dropped = 0
+        released = []
+        with self._lock:
+            for company_id, context_hash in resident.items():
+                bot = self._bots.get(company_id)
+                stored = current.get(company_id)
+                # Skip bots replaced in this process since the read
+                if bot is not None and bot['context_hash'] == context_hash and stored not in (None, context_hash):
+                    released += self._remove(company_id)
+                    dropped += 1
+        self._release(released)
+        if dropped:
+            logs.info('registry_stale_bots_dropped', bots=dropped)
+        return dropped
+
+    def recheck(self):
+        """check_against_database, at most once per check_interval seconds"""
+        if self.check_interval > 0 and time.time() - self.checked_at >= self.check_interval:
+            with self._lock:
+                if time.time() - self.checked_at < self.check_interval:
+                    return
+                self.checked_at = time.time()
+            self.check_against_database()
+
+    def evict(self, company_id):
+        """Drop a chatbot from memory; it will be reloaded on next use"""
+        with self._lock:
+            released = self._remove(company_id) if company_id in self._bots else []
+        self._release(released)
+
+    def stats(self):
+        """Current residency of the registry"""
+        with self._lock:
+            return {
+                'resident_bots': len(self._bots),
+                'shared_contexts': len(self._contexts),
+                'resident_bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _insert(self, company_id, bot):
+        """Add or replace a bot; returns the context hashes no resident bot uses any more"""
+        released = self._remove(company_id) if company_id in self._bots else []
+
+        shared = self._contexts.get(bot['context_hash'])
+        if shared is None:
+            shared = self._contexts[bot['context_hash']] = [bot['knowledge'], 0]
+            self._bytes += bot['knowledge'].nbytes()
+        shared[1] += 1
+        bot['knowledge'] = shared[0]
+
+        size = estimate_size(bot)
+        self._bots[company_id] = bot
+        self._bots.move_to_end(company_id)
+        self._sizes[company_id] = size
+        self._bytes += size
+
+        # Evict least recently used tenants, but always keep the newest one
+        while self._bytes > self.max_bytes and len(self._bots) > 1:
+            released += self._remove(next(iter(self._bots)))
+        return [context_hash for context_hash in released if context_hash not in self._contexts]
+
+    def _remove(self, company_id):
+        bot = self._bots.pop(company_id)
+        self._bytes -= self._sizes.pop(company_id)
+        shared = self._contexts[bot['context_hash']]
+        shared[1] -= 1
+        if shared[1]:
+            return []
+        del self._contexts[bot['context_hash']]
+        self._bytes -= shared[0].nbytes()
+        return [bot['context_hash']]
+
+    def _release(self, released):
+        # Outside the lock: the callback may take its time
+        if self._on_release:
+            for context_hash in released:
+                self._on_release(context_hash)
+
+
+registry = ChatbotRegistry()
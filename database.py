@@ -1,32 +1,110 @@
 import mysql.connector
-from mysql.connector import pooling
 import os
+import json
+import base64
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
+
+import logs
+import metrics
+import scrape_codec
+import sqlite_backend
+from db_pool import ConnectionPool
+from latency_sketch import LatencySketch
 
 load_dotenv()
 
+# "mysql" (default) or "sqlite" for an embedded database file (SQLITE_PATH)
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql").lower()
+
+DB_ERRORS = (mysql.connector.Error, sqlite_backend.Error)
+
 # Database connection pool for better performance
 db_config = {
     "host": os.getenv("DB_HOST", "localhost"),
     "user": os.getenv("DB_USER", "root"),
     "password": os.getenv("DB_PASSWORD", ""),
-    "database": os.getenv("DB_NAME", "chatbot_db"),
-    "pool_name": "chatbot_pool",
-    "pool_size": 5
+    "database": os.getenv("DB_NAME", "chatbot_db")
+}
+
+if DB_BACKEND == 'sqlite':
+    connection_pool = sqlite_backend.SQLiteConnectionPool(
+        os.getenv("SQLITE_PATH", "chatbot.db"),
+        busy_timeout=float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+    )
+else:
+    connection_pool = ConnectionPool(
+        db_config,
+        size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_POOL_MAX_OVERFLOW", "10")),
+        timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+        recycle=float(os.getenv("DB_POOL_RECYCLE", "1800")),
+        pre_ping=float(os.getenv("DB_POOL_PRE_PING", "30")),
+        reconnect_interval=float(os.getenv("DB_RECONNECT_INTERVAL", "5"))
+    )
+
+# Statements whose syntax differs between backends (sqlite_backend.SQL has the SQLite versions)
+MYSQL_SQL = {
+    # LAST_INSERT_ID(id) makes lastrowid the existing id when the company is already there
+    'upsert_company': (
+        "INSERT INTO companies (company_name, website_url) VALUES (%s, %s) "
+        "ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), updated_at = NOW()"
+    ),
+    'upsert_chat_rollup': (
+        "INSERT INTO chat_rollups "
+        "(company_id, granularity, bucket_start, chats, cached_chats, fallback_chats, total_response_ms, last_chat_at) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE chats = chats + VALUES(chats), "
+        "cached_chats = cached_chats + VALUES(cached_chats), "
+        "fallback_chats = fallback_chats + VALUES(fallback_chats), "
+        "total_response_ms = total_response_ms + VALUES(total_response_ms), "
+        "last_chat_at = GREATEST(COALESCE(last_chat_at, VALUES(last_chat_at)), VALUES(last_chat_at))"
+    ),
+    'upsert_chat_latency_bin': (
+        "INSERT INTO chat_latency_bins (company_id, granularity, bucket_start, bin, count) "
+        "VALUES (%s, %s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE count = count + VALUES(count)"
+    ),
+    'insert_ignore': "INSERT IGNORE",
+    'prune_chat_latency_bins': "DELETE FROM chat_latency_bins WHERE granularity = %s AND bucket_start < %s LIMIT %s",
+    'prune_chat_rollups': "DELETE FROM chat_rollups WHERE granularity = %s AND bucket_start < %s LIMIT %s",
+    'purge_expired_answers': "DELETE FROM context_answers WHERE expires_at <= %s LIMIT %s",
+    'upsert_shared_context': (
+        "INSERT INTO shared_contexts (context_hash, website_url, format_version, scraped_blob, context_blob, scraped_at) "
+        "VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE scraped_at = VALUES(scraped_at)"
+    ),
+    'upsert_api_usage': (
+        "INSERT INTO api_usage (company_id, api_name, usage_date, request_count, error_count, "
+        "prompt_tokens, output_tokens, total_latency_ms, last_request_at, tokens_used) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE request_count = request_count + VALUES(request_count), "
+        "error_count = error_count + VALUES(error_count), "
+        "prompt_tokens = prompt_tokens + VALUES(prompt_tokens), "
+        "output_tokens = output_tokens + VALUES(output_tokens), "
+        "total_latency_ms = total_latency_ms + VALUES(total_latency_ms), "
+        "tokens_used = tokens_used + VALUES(tokens_used), "
+        "last_request_at = GREATEST(COALESCE(last_request_at, VALUES(last_request_at)), VALUES(last_request_at))"
+    ),
 }
 
-try:
-    connection_pool = pooling.MySQLConnectionPool(**db_config)
-except mysql.connector.Error as err:
-    print(f"Error creating connection pool: {err}")
-    connection_pool = None
+SQL = sqlite_backend.SQL if DB_BACKEND == 'sqlite' else MYSQL_SQL
 
-def get_connection():
-    """Get a connection from the pool"""
-    if connection_pool:
-        return connection_pool.get_connection()
-    return None
+# Seconds a /chat answer store lookup may spend (waiting for a connection,
+# then running the query) before it counts as a cache miss
+ANSWER_LOOKUP_TIMEOUT = float(os.getenv("ANSWER_LOOKUP_TIMEOUT", "0.25"))
+
+def get_connection(timeout=None):
+    """
+    Get a connection from the pool, or None while the database is unreachable,
+    when no connection came free within timeout seconds (default
+    DB_POOL_TIMEOUT), or when opening one failed. Every helper treats None as
+    "database unavailable" and degrades instead of raising.
+    """
+    try:
+        return connection_pool.get_connection(timeout=timeout)
+    except DB_ERRORS as err:
+        logs.warning('database_connection_unavailable', error=str(err))
+        return None
 
 def create_tables():
     """Create necessary database tables if they don't exist"""
@@ -34,6 +112,17 @@ def create_tables():
     if not conn:
         return False
     
+    if DB_BACKEND == 'sqlite':
+        try:
+            sqlite_backend.create_tables(conn)
+            print("Database tables created successfully!")
+            return True
+        except DB_ERRORS as err:
+            print(f"Error creating tables: {err}")
+            return False
+        finally:
+            conn.close()
+    
     cursor = conn.cursor()
     
     try:
@@ -43,19 +132,21 @@ def create_tables():
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 company_name VARCHAR(255) NOT NULL,
                 website_url VARCHAR(500) NOT NULL,
+                daily_token_budget INT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                UNIQUE KEY uniq_company_site (company_name, website_url),
                 INDEX idx_company_name (company_name)
             )
         """)
         
-        # Scraped data table
+        # Scraped data table (one row per heading, paragraph, list item, section...)
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS scraped_data (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 company_id INT NOT NULL,
                 content_type VARCHAR(50),
-                content_text TEXT,
+                content_text MEDIUMTEXT,
                 metadata JSON,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
@@ -71,66 +162,561 @@ def create_tables():
                 user_question TEXT NOT NULL,
                 bot_response TEXT NOT NULL,
                 response_time_ms INT,
+                cached BOOLEAN NOT NULL DEFAULT FALSE,
+                fallback BOOLEAN NOT NULL DEFAULT FALSE,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+                INDEX idx_company_created_id (company_id, created_at, id),
+                INDEX idx_created_at (created_at)
+            )
+        """)
+        
+        # Old chat history moved out by the retention job (analytics.py retention)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chat_history_archive (
+                id INT PRIMARY KEY,
+                company_id INT NOT NULL,
+                user_question TEXT NOT NULL,
+                bot_response TEXT NOT NULL,
+                response_time_ms INT,
+                cached BOOLEAN NOT NULL DEFAULT FALSE,
+                fallback BOOLEAN NOT NULL DEFAULT FALSE,
+                created_at TIMESTAMP NULL,
                 INDEX idx_company_id_created (company_id, created_at)
             )
         """)
         
+        # Hourly/daily chat counters per company, updated with every history batch
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chat_rollups (
+                company_id INT NOT NULL,
+                granularity ENUM('hour', 'day') NOT NULL,
+                bucket_start DATETIME NOT NULL,
+                chats INT NOT NULL DEFAULT 0,
+                cached_chats INT NOT NULL DEFAULT 0,
+                fallback_chats INT NOT NULL DEFAULT 0,
+                total_response_ms BIGINT NOT NULL DEFAULT 0,
+                last_chat_at DATETIME NULL,
+                PRIMARY KEY (company_id, granularity, bucket_start),
+                FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+                INDEX idx_granularity_bucket (granularity, bucket_start)
+            )
+        """)
+        
+        # Latency sketch per rollup bucket (latency_sketch.py): one row per non-empty bin
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chat_latency_bins (
+                company_id INT NOT NULL,
+                granularity ENUM('hour', 'day') NOT NULL,
+                bucket_start DATETIME NOT NULL,
+                bin SMALLINT NOT NULL,
+                count INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (company_id, granularity, bucket_start, bin),
+                FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+                INDEX idx_granularity_bucket (granularity, bucket_start)
+            )
+        """)
+        
+        # Compressed, versioned copy of a full scrape and AI context, stored once per
+        # content hash (site + content) and shared by every company pointing at it
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS shared_contexts (
+                context_hash CHAR(64) PRIMARY KEY,
+                website_url VARCHAR(500) NOT NULL,
+                format_version SMALLINT NOT NULL,
+                scraped_blob LONGBLOB NOT NULL,
+                context_blob LONGBLOB NOT NULL,
+                scraped_at DATETIME NOT NULL,
+                INDEX idx_url_scraped_at (website_url, scraped_at)
+            )
+        """)
+        
+        # Which shared context each company's bot is rebuilt from (one row instead of
+        # re-scraping). Blobs here are empty except in rows written before sharing.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS company_snapshots (
+                company_id INT PRIMARY KEY,
+                format_version SMALLINT NOT NULL,
+                scraped_blob LONGBLOB NOT NULL,
+                context_blob LONGBLOB NOT NULL,
+                context_hash CHAR(64) NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+                INDEX idx_updated_at (updated_at),
+                INDEX idx_context_hash (context_hash)
+            )
+        """)
+        
+        # Gemini answers that survive restarts (ai_chatbot L2 cache). Keyed by the
+        # context they were generated from, so companies with the same site and
+        # content share them and a changed re-scrape never serves them
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS context_answers (
+                context_hash CHAR(64) NOT NULL,
+                question_hash CHAR(64) NOT NULL,
+                response MEDIUMTEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at DATETIME NOT NULL,
+                PRIMARY KEY (context_hash, question_hash),
+                INDEX idx_expires_at (expires_at)
+            )
+        """)
+        
+        # LLM requests and tokens per tenant per day (flushed in batches by usage.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS api_usage (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT NULL,
+                company_id INT NULL,
+                api_name VARCHAR(50),
+                usage_date DATE NULL,
+                request_count INT DEFAULT 0,
+                error_count INT DEFAULT 0,
+                tokens_used BIGINT DEFAULT 0,
+                prompt_tokens BIGINT DEFAULT 0,
+                output_tokens BIGINT DEFAULT 0,
+                total_latency_ms BIGINT DEFAULT 0,
+                last_request_at TIMESTAMP NULL,
+                quota_reset_at TIMESTAMP NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE KEY uniq_company_api_day (company_id, api_name, usage_date),
+                CONSTRAINT fk_api_usage_company FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+                INDEX idx_user_api (user_id, api_name),
+                INDEX idx_usage_date_tokens (usage_date, tokens_used)
+            )
+        """)
+        
+        # When each bot is next re-scraped and how often its site has changed (refresh.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS refresh_schedule (
+                company_id INT PRIMARY KEY,
+                next_refresh_at DATETIME NOT NULL,
+                interval_s INT NOT NULL,
+                last_checked_at DATETIME NULL,
+                last_changed_at DATETIME NULL,
+                checks INT NOT NULL DEFAULT 0,
+                changes INT NOT NULL DEFAULT 0,
+                consecutive_failures INT NOT NULL DEFAULT 0,
+                last_error VARCHAR(500) NULL,
+                FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+                INDEX idx_next_refresh_at (next_refresh_at)
+            )
+        """)
+        
+        # Which scheduler process is active (one row, leased like refresh_schedule claims)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS refresh_leader (
+                id TINYINT PRIMARY KEY,
+                owner VARCHAR(128) NOT NULL,
+                lease_until DATETIME NOT NULL
+            )
+        """)
+        
         conn.commit()
+        merged = dedupe_companies(cursor)
+        conn.commit()
+        if merged:
+            print(f"Merged {merged} duplicate companies into the newest of each")
+        migrate_schema(cursor)
         print("Database tables created successfully!")
         return True
         
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         print(f"Error creating tables: {err}")
         return False
     finally:
         cursor.close()
         conn.close()
 
-def save_company(company_name, website_url):
-    """Save or update company information"""
+# Upgrades for tables created by older versions (each one is idempotent)
+SCHEMA_MIGRATIONS = [
+    "ALTER TABLE companies ADD UNIQUE KEY uniq_company_site (company_name, website_url)",
+    "ALTER TABLE scraped_data MODIFY content_text MEDIUMTEXT",
+    "ALTER TABLE chat_history ADD COLUMN cached BOOLEAN NOT NULL DEFAULT FALSE",
+    "ALTER TABLE chat_history ADD COLUMN fallback BOOLEAN NOT NULL DEFAULT FALSE",
+    "ALTER TABLE chat_history ADD INDEX idx_created_at (created_at)",
+    "ALTER TABLE chat_history ADD INDEX idx_company_created_id (company_id, created_at, id)",
+    "ALTER TABLE chat_history DROP INDEX idx_company_id_created",
+    "ALTER TABLE companies ADD COLUMN daily_token_budget INT NULL",
+    "ALTER TABLE company_snapshots ADD INDEX idx_context_hash (context_hash)",
+    # Per-company answers, superseded by the shared context_answers
+    "DROP TABLE IF EXISTS answer_cache",
+    # api_usage as created by database_schema.sql (per user, never written)
+    "ALTER TABLE api_usage MODIFY user_id INT NULL",
+    "ALTER TABLE api_usage MODIFY tokens_used BIGINT DEFAULT 0",
+    "ALTER TABLE api_usage ADD COLUMN company_id INT NULL AFTER user_id",
+    "ALTER TABLE api_usage ADD COLUMN usage_date DATE NULL AFTER api_name",
+    "ALTER TABLE api_usage ADD COLUMN error_count INT DEFAULT 0 AFTER request_count",
+    "ALTER TABLE api_usage ADD COLUMN prompt_tokens BIGINT DEFAULT 0 AFTER tokens_used",
+    "ALTER TABLE api_usage ADD COLUMN output_tokens BIGINT DEFAULT 0 AFTER prompt_tokens",
+    "ALTER TABLE api_usage ADD COLUMN total_latency_ms BIGINT DEFAULT 0 AFTER output_tokens",
+    "ALTER TABLE api_usage ADD UNIQUE KEY uniq_company_api_day (company_id, api_name, usage_date)",
+    "ALTER TABLE api_usage ADD INDEX idx_usage_date_tokens (usage_date, tokens_used)",
+    "ALTER TABLE api_usage ADD CONSTRAINT fk_api_usage_company FOREIGN KEY (company_id) "
+    "REFERENCES companies(id) ON DELETE CASCADE",
+]
+
+# Duplicate column / duplicate key name / no such key / duplicate foreign key name:
+# the migration already ran
+ALREADY_MIGRATED = (1060, 1061, 1091, 1826)
+
+# Migrations the upserts depend on: if one of these fails, create_tables fails
+REQUIRED_MIGRATIONS = (SCHEMA_MIGRATIONS[0],)
+
+def dedupe_companies(cursor):
+    """
+    Merge companies with the same (company_name, website_url) into the newest
+    one, so uniq_company_site can be added to tables from before it existed.
+    Their chat history moves to the kept company; their scrapes, snapshots,
+    rollups and usage rows are dropped with them. Returns how many were merged.
+    """
+    cursor.execute(
+        "SELECT c.id, d.keep_id FROM companies c JOIN ("
+        "SELECT company_name, website_url, MAX(id) AS keep_id FROM companies "
+        "GROUP BY company_name, website_url HAVING COUNT(*) > 1) d "
+        "ON c.company_name = d.company_name AND c.website_url = d.website_url "
+        "WHERE c.id <> d.keep_id"
+    )
+    merges = [(keep_id, duplicate_id) for duplicate_id, keep_id in cursor.fetchall()]
+    if not merges:
+        return 0
+    for table in ('chat_history', 'chat_history_archive'):
+        cursor.executemany(f"UPDATE {table} SET company_id = %s WHERE company_id = %s", merges)
+    cursor.executemany("DELETE FROM companies WHERE id = %s", [(duplicate_id,) for _, duplicate_id in merges])
+    return len(merges)
+
+def migrate_schema(cursor):
+    """Apply SCHEMA_MIGRATIONS to an existing database"""
+    for statement in SCHEMA_MIGRATIONS:
+        try:
+            cursor.execute(statement)
+        except DB_ERRORS as err:
+            if err.errno in ALREADY_MIGRATED:
+                continue
+            if statement in REQUIRED_MIGRATIONS:
+                raise
+            print(f"Schema migration skipped ({statement}): {err}")
+
+def get_company_data(company_id):
+    """Retrieve all scraped data for a company"""
+    conn = get_connection()
+    if not conn:
+        return None
+    
+    cursor = conn.cursor(dictionary=True)
+    
+    try:
+        # Get company info
+        cursor.execute(
+            "SELECT * FROM companies WHERE id = %s",
+            (company_id,)
+        )
+        company = cursor.fetchone()
+        
+        if not company:
+            return None
+        
+        # Get scraped data
+        cursor.execute(
+            "SELECT content_type, content_text, metadata FROM scraped_data WHERE company_id = %s ORDER BY id",
+            (company_id,)
+        )
+        scraped_data = cursor.fetchall()
+        
+        return {
+            "company": company,
+            "scraped_data": scraped_data
+        }
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='retrieving company data', error=str(err))
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@metrics.timed('db.save_chat_history')
+def save_chat_history(company_id, user_question, bot_response, response_time_ms, cached=False, fallback=False):
+    """Save chat interaction to history"""
+    return save_chat_history_batch(
+        [(company_id, user_question, bot_response, response_time_ms, cached, fallback, datetime.now())]
+    )
+
+@metrics.timed('db.save_chat_history_batch')
+def save_chat_history_batch(rows):
+    """
+    Save many (company_id, user_question, bot_response, response_time_ms, cached, fallback, created_at)
+    rows in one multi-row INSERT and fold them into the analytics rollups in the same transaction
+    """
+    if not rows:
+        return True
+    
+    conn = get_connection()
+    if not conn:
+        return False
+    
+    import analytics  # imports this module
+    counter_rows, bin_rows = analytics.rollup_batch(rows)
+    cursor = conn.cursor()
+    
+    try:
+        # executemany rewrites a plain INSERT ... VALUES into a single multi-row statement
+        cursor.executemany(
+            "INSERT INTO chat_history "
+            "(company_id, user_question, bot_response, response_time_ms, cached, fallback, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            rows
+        )
+        cursor.executemany(SQL['upsert_chat_rollup'], counter_rows)
+        cursor.executemany(SQL['upsert_chat_latency_bin'], bin_rows)
+        conn.commit()
+        return True
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='saving chat history batch', error=str(err))
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+# Largest page /chat-history serves, and rows per query when exporting
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "200"))
+HISTORY_EXPORT_BATCH = int(os.getenv("HISTORY_EXPORT_BATCH", "1000"))
+
+# Keyset pagination: the inner query walks idx_company_created_id (covering it,
+# since InnoDB secondary indexes carry the primary key) and only the page's
+# rows are then fetched by id, so page N costs the same as page 1
+CHAT_HISTORY_PAGE_QUERY = (
+    "SELECT h.id, h.user_question, h.bot_response, h.response_time_ms, h.cached, h.fallback, h.created_at "
+    "FROM (SELECT id FROM chat_history WHERE company_id = %s{where} "
+    "ORDER BY created_at {order}, id {order} LIMIT %s) page "
+    "JOIN chat_history h ON h.id = page.id "
+    "ORDER BY h.created_at {order}, h.id {order}"
+)
+
+def encode_history_cursor(created_at, row_id):
+    """Opaque cursor for the position just past a chat history row"""
+    token = f"{created_at.isoformat()}|{row_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(token).decode('ascii').rstrip('=')
+
+def decode_history_cursor(cursor_token):
+    """(created_at, id) from encode_history_cursor, or None if it is malformed"""
+    try:
+        padded = cursor_token + '=' * (-len(cursor_token) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def chat_history_record(row):
+    """JSON-ready chat history row"""
+    return {
+        'id': row['id'],
+        'question': row['user_question'],
+        'response': row['bot_response'],
+        'response_time_ms': row['response_time_ms'],
+        'cached': bool(row['cached']),
+        'fallback': bool(row['fallback']),
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None
+    }
+
+def get_chat_history_page(company_id, limit=50, after=None, newest_first=True, since=None, until=None):
+    """
+    One page of a company's chat history, keyset-paginated on (created_at, id).
+    after is the (created_at, id) position returned by the previous page.
+    Returns (records, next_position), next_position is None on the last page;
+    returns (None, None) when the database is unavailable.
+    """
+    conn = get_connection()
+    if not conn:
+        return None, None
+    
+    where = ""
+    params = [company_id]
+    if after is not None:
+        # (created_at, id) past the cursor, spelled out with a plain bound on created_at
+        # so both MySQL and SQLite seek straight to it in the index
+        op = '<' if newest_first else '>'
+        where += f" AND created_at {op}= %s AND (created_at {op} %s OR (created_at = %s AND id {op} %s))"
+        params += [after[0], after[0], after[0], after[1]]
+    if since is not None:
+        where += " AND created_at >= %s"
+        params.append(since)
+    if until is not None:
+        where += " AND created_at < %s"
+        params.append(until)
+    params.append(limit + 1)
+    
+    cursor = conn.cursor(dictionary=True)
+    
+    try:
+        cursor.execute(CHAT_HISTORY_PAGE_QUERY.format(where=where, order='DESC' if newest_first else 'ASC'), params)
+        rows = cursor.fetchall()
+        next_position = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_position = (rows[-1]['created_at'], rows[-1]['id'])
+        return [chat_history_record(row) for row in rows], next_position
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading chat history', error=str(err))
+        return None, None
+    finally:
+        cursor.close()
+        conn.close()
+
+def iter_chat_history(company_id, since=None, until=None, batch_size=HISTORY_EXPORT_BATCH):
+    """
+    Yield every chat history record for a company, oldest first, one keyset
+    page (and one short query) at a time so exports never hold all rows
+    """
+    after = None
+    while True:
+        records, after = get_chat_history_page(
+            company_id, batch_size, after=after, newest_first=False, since=since, until=until
+        )
+        if records is None:
+            raise RuntimeError("Database is not available")
+        yield from records
+        if after is None:
+            return
+
+def get_chat_rollups(company_id, granularity, since, until):
+    """Rollup rows (each with a merged 'sketch') for a company between since and until, or None without a database"""
     conn = get_connection()
     if not conn:
         return None
     
+    cursor = conn.cursor(dictionary=True)
+    
+    try:
+        cursor.execute(
+            "SELECT bucket_start, chats, cached_chats, fallback_chats, total_response_ms, last_chat_at "
+            "FROM chat_rollups WHERE company_id = %s AND granularity = %s "
+            "AND bucket_start >= %s AND bucket_start < %s ORDER BY bucket_start",
+            (company_id, granularity, since, until)
+        )
+        rollups = cursor.fetchall()
+        cursor.execute(
+            "SELECT bucket_start, bin, count FROM chat_latency_bins "
+            "WHERE company_id = %s AND granularity = %s AND bucket_start >= %s AND bucket_start < %s",
+            (company_id, granularity, since, until)
+        )
+        bins = {}
+        for row in cursor.fetchall():
+            bins.setdefault(row['bucket_start'], {})[row['bin']] = row['count']
+        for rollup in rollups:
+            rollup['sketch'] = LatencySketch(bins.get(rollup['bucket_start']))
+        return rollups
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading chat rollups', error=str(err))
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@metrics.timed('db.archive_chat_history_batch')
+def archive_chat_history_batch(cutoff, batch_size, archive=True):
+    """Move (or delete) up to batch_size chat_history rows older than cutoff; returns how many"""
+    conn = get_connection()
+    if not conn:
+        return 0
+    
     cursor = conn.cursor()
     
     try:
-        # Check if company already exists
+        # Oldest rows first, bounded by id so each batch is a short transaction
         cursor.execute(
-            "SELECT id FROM companies WHERE company_name = %s AND website_url = %s",
-            (company_name, website_url)
+            "SELECT id FROM chat_history WHERE created_at < %s ORDER BY created_at, id LIMIT %s",
+            (cutoff, batch_size)
         )
-        result = cursor.fetchone()
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return 0
         
-        if result:
-            company_id = result[0]
-            # Update timestamp
-            cursor.execute(
-                "UPDATE companies SET updated_at = NOW() WHERE id = %s",
-                (company_id,)
-            )
-        else:
-            # Insert new company
+        placeholders = ', '.join(['%s'] * len(ids))
+        if archive:
             cursor.execute(
-                "INSERT INTO companies (company_name, website_url) VALUES (%s, %s)",
-                (company_name, website_url)
+                SQL['insert_ignore'] + " INTO chat_history_archive "
+                "(id, company_id, user_question, bot_response, response_time_ms, cached, fallback, created_at) "
+                "SELECT id, company_id, user_question, bot_response, response_time_ms, cached, fallback, created_at "
+                f"FROM chat_history WHERE id IN ({placeholders})",
+                ids
             )
-            company_id = cursor.lastrowid
+        cursor.execute(f"DELETE FROM chat_history WHERE id IN ({placeholders})", ids)
+        conn.commit()
+        return len(ids)
         
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='archiving chat history', error=str(err))
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+def prune_chat_rollups_batch(granularity, cutoff, batch_size):
+    """Delete up to batch_size rollup buckets (and their latency bins) older than cutoff"""
+    conn = get_connection()
+    if not conn:
+        return 0
+    
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute(SQL['prune_chat_latency_bins'], (granularity, cutoff, batch_size))
+        deleted = cursor.rowcount
+        cursor.execute(SQL['prune_chat_rollups'], (granularity, cutoff, batch_size))
+        deleted += cursor.rowcount
         conn.commit()
-        return company_id
+        return deleted
         
-    except mysql.connector.Error as err:
-        print(f"Error saving company: {err}")
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='pruning chat rollups', error=str(err))
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_cached_answer(context_hash, question_hash):
+    """
+    Unexpired stored answer for a question about this context, or None.
+    Runs on the /chat path, so it gives up after ANSWER_LOOKUP_TIMEOUT: a
+    busy pool or slow query is a cache miss, not an error.
+    """
+    conn = get_connection(timeout=ANSWER_LOOKUP_TIMEOUT)
+    if not conn:
+        return None
+    
+    cursor = conn.cursor()
+    
+    try:
+        # MAX_EXECUTION_TIME is a MySQL optimizer hint; SQLite reads it as a comment
+        cursor.execute(
+            f"SELECT /*+ MAX_EXECUTION_TIME({max(1, int(ANSWER_LOOKUP_TIMEOUT * 1000))}) */ response "
+            "FROM context_answers "
+            "WHERE context_hash = %s AND question_hash = %s AND expires_at > %s",
+            (context_hash, question_hash, datetime.now())
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='reading answer cache', error=str(err))
         return None
     finally:
         cursor.close()
         conn.close()
 
-def save_scraped_data(company_id, content_type, content_text, metadata=None):
-    """Save scraped website data"""
+@metrics.timed('db.save_cached_answers')
+def save_cached_answers(rows):
+    """Store many (context_hash, question_hash, response, expires_at) answers"""
+    if not rows:
+        return True
+    
     conn = get_connection()
     if not conn:
         return False
@@ -138,60 +724,256 @@ def save_scraped_data(company_id, content_type, content_text, metadata=None):
     cursor = conn.cursor()
     
     try:
-        cursor.execute(
-            "INSERT INTO scraped_data (company_id, content_type, content_text, metadata) VALUES (%s, %s, %s, %s)",
-            (company_id, content_type, content_text, str(metadata) if metadata else None)
+        cursor.executemany(
+            "REPLACE INTO context_answers (context_hash, question_hash, response, expires_at) "
+            "VALUES (%s, %s, %s, %s)",
+            rows
         )
         conn.commit()
         return True
         
-    except mysql.connector.Error as err:
-        print(f"Error saving scraped data: {err}")
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='saving answer cache', error=str(err))
+        conn.rollback()
         return False
     finally:
         cursor.close()
         conn.close()
 
-def get_company_data(company_id):
-    """Retrieve all scraped data for a company"""
+def purge_expired_answers_batch(batch_size):
+    """Delete up to batch_size expired stored answers; returns how many"""
+    conn = get_connection()
+    if not conn:
+        return 0
+    
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute(SQL['purge_expired_answers'], (datetime.now(), batch_size))
+        conn.commit()
+        return cursor.rowcount
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='purging answer cache', error=str(err))
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+@metrics.timed('db.save_api_usage')
+def save_api_usage(rows):
+    """
+    Add many (company_id, api_name, usage_date, request_count, error_count,
+    prompt_tokens, output_tokens, total_latency_ms, last_request_at) rows to api_usage
+    """
+    if not rows:
+        return True
+    
+    conn = get_connection()
+    if not conn:
+        return False
+    
+    cursor = conn.cursor()
+    
+    try:
+        # tokens_used (prompt + output) is kept for the original api_usage consumers
+        cursor.executemany(SQL['upsert_api_usage'], [row + (row[5] + row[6],) for row in rows])
+        conn.commit()
+        return True
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='saving API usage', error=str(err))
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_token_budgets(company_ids, api_name, usage_date):
+    """{company_id: (daily_token_budget or None, tokens used on usage_date)}, or None without a database"""
     conn = get_connection()
     if not conn:
         return None
     
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor()
     
     try:
-        # Get company info
+        placeholders = ', '.join(['%s'] * len(company_ids))
         cursor.execute(
-            "SELECT * FROM companies WHERE id = %s",
-            (company_id,)
+            "SELECT c.id, c.daily_token_budget, COALESCE(u.tokens_used, 0) FROM companies c "
+            "LEFT JOIN api_usage u ON u.company_id = c.id AND u.api_name = %s AND u.usage_date = %s "
+            f"WHERE c.id IN ({placeholders})",
+            [api_name, usage_date] + list(company_ids)
         )
-        company = cursor.fetchone()
+        return {company_id: (budget, int(tokens)) for company_id, budget, tokens in cursor.fetchall()}
         
-        if not company:
-            return None
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading token budgets', error=str(err))
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_api_usage(usage_date, company_id=None, limit=20):
+    """
+    Per-tenant LLM usage for a day, heaviest first (or one tenant's rows for
+    the days up to usage_date); None without a database
+    """
+    conn = get_connection()
+    if not conn:
+        return None
+    
+    cursor = conn.cursor(dictionary=True)
+    
+    try:
+        query = (
+            "SELECT u.company_id, c.company_name, u.usage_date, u.request_count, u.error_count, "
+            "u.prompt_tokens, u.output_tokens, u.tokens_used, u.total_latency_ms, u.last_request_at, "
+            "c.daily_token_budget "
+            "FROM api_usage u JOIN companies c ON c.id = u.company_id "
+        )
+        if company_id is None:
+            cursor.execute(query + "WHERE u.usage_date = %s ORDER BY u.tokens_used DESC LIMIT %s", (usage_date, limit))
+        else:
+            cursor.execute(
+                query + "WHERE u.company_id = %s AND u.usage_date <= %s ORDER BY u.usage_date DESC LIMIT %s",
+                (company_id, usage_date, limit)
+            )
+        return cursor.fetchall()
         
-        # Get scraped data
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading API usage', error=str(err))
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_unscheduled_companies(limit):
+    """(company_id, updated_at) of companies with a snapshot but no refresh_schedule row yet"""
+    conn = get_connection()
+    if not conn:
+        return []
+    
+    cursor = conn.cursor()
+    
+    try:
         cursor.execute(
-            "SELECT content_type, content_text FROM scraped_data WHERE company_id = %s",
-            (company_id,)
+            "SELECT s.company_id, s.updated_at FROM company_snapshots s "
+            "LEFT JOIN refresh_schedule r ON r.company_id = s.company_id "
+            "WHERE r.company_id IS NULL LIMIT %s",
+            (limit,)
         )
-        scraped_data = cursor.fetchall()
+        return [tuple(row) for row in cursor.fetchall()]
         
-        return {
-            "company": company,
-            "scraped_data": scraped_data
-        }
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading unscheduled companies', error=str(err))
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def add_refresh_schedule(rows):
+    """Insert (company_id, next_refresh_at, interval_s) rows, keeping existing ones"""
+    if not rows:
+        return True
+    
+    conn = get_connection()
+    if not conn:
+        return False
+    
+    cursor = conn.cursor()
+    
+    try:
+        cursor.executemany(
+            SQL['insert_ignore'] + " INTO refresh_schedule (company_id, next_refresh_at, interval_s) VALUES (%s, %s, %s)",
+            rows
+        )
+        conn.commit()
+        return True
         
-    except mysql.connector.Error as err:
-        print(f"Error retrieving company data: {err}")
-        return None
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='adding refresh schedule', error=str(err))
+        conn.rollback()
+        return False
     finally:
         cursor.close()
         conn.close()
 
-def save_chat_history(company_id, user_question, bot_response, response_time_ms):
-    """Save chat interaction to history"""
+# Columns of a scheduled refresh, with what is needed to re-scrape and compare it
+REFRESH_QUERY = (
+    "SELECT r.company_id, r.next_refresh_at, r.interval_s, r.last_checked_at, r.last_changed_at, "
+    "r.checks, r.changes, r.consecutive_failures, r.last_error, "
+    "c.company_name, c.website_url, s.context_hash "
+    "FROM refresh_schedule r JOIN companies c ON c.id = r.company_id "
+    "JOIN company_snapshots s ON s.company_id = r.company_id "
+)
+
+def get_due_refreshes(now, limit, after=None):
+    """
+    Scheduled refreshes due by now, most overdue first, keyset-paginated on
+    (next_refresh_at, company_id): after is the last row's pair from the previous page
+    """
+    conn = get_connection()
+    if not conn:
+        return []
+    
+    where = "WHERE r.next_refresh_at <= %s"
+    params = [now]
+    if after is not None:
+        where += " AND r.next_refresh_at >= %s AND (r.next_refresh_at > %s OR (r.next_refresh_at = %s AND r.company_id > %s))"
+        params += [after[0], after[0], after[0], after[1]]
+    params.append(limit)
+    
+    cursor = conn.cursor(dictionary=True)
+    
+    try:
+        cursor.execute(REFRESH_QUERY + where + " ORDER BY r.next_refresh_at, r.company_id LIMIT %s", params)
+        return cursor.fetchall()
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading due refreshes', error=str(err))
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def claim_refreshes(claims, lease_until):
+    """
+    Push (company_id, next_refresh_at as read) refreshes to lease_until unless
+    another scheduler already did; returns the company_ids this caller claimed
+    """
+    conn = get_connection()
+    if not conn:
+        return []
+    
+    cursor = conn.cursor()
+    
+    try:
+        claimed = []
+        for company_id, next_refresh_at in claims:
+            cursor.execute(
+                "UPDATE refresh_schedule SET next_refresh_at = %s WHERE company_id = %s AND next_refresh_at = %s",
+                (lease_until, company_id, next_refresh_at)
+            )
+            if cursor.rowcount:
+                claimed.append(company_id)
+        conn.commit()
+        return claimed
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='claiming refreshes', error=str(err))
+        conn.rollback()
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def acquire_refresh_lead(owner, now, lease_until):
+    """
+    Take or renew the refresh scheduler lease for owner, unless another
+    owner holds it past now; returns True if owner holds it until lease_until
+    """
     conn = get_connection()
     if not conn:
         return False
@@ -200,19 +982,107 @@ def save_chat_history(company_id, user_question, bot_response, response_time_ms)
     
     try:
         cursor.execute(
-            "INSERT INTO chat_history (company_id, user_question, bot_response, response_time_ms) VALUES (%s, %s, %s, %s)",
-            (company_id, user_question, bot_response, response_time_ms)
+            SQL['insert_ignore'] + " INTO refresh_leader (id, owner, lease_until) VALUES (1, %s, %s)",
+            (owner, lease_until)
+        )
+        cursor.execute(
+            "UPDATE refresh_leader SET owner = %s, lease_until = %s WHERE id = 1 AND (owner = %s OR lease_until < %s)",
+            (owner, lease_until, owner, now)
+        )
+        cursor.execute("SELECT owner FROM refresh_leader WHERE id = 1")
+        row = cursor.fetchone()
+        conn.commit()
+        return row is not None and row[0] == owner
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='acquiring refresh lead', error=str(err))
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def release_refresh_lead(owner):
+    """Give up the refresh scheduler lease if owner holds it, so another scheduler takes over"""
+    conn = get_connection()
+    if not conn:
+        return False
+    
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("DELETE FROM refresh_leader WHERE id = 1 AND owner = %s", (owner,))
+        conn.commit()
+        return True
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='releasing refresh lead', error=str(err))
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def record_refreshes(rows):
+    """
+    Store refresh outcomes: (next_refresh_at, interval_s, checked_at, changed_at
+    or None, changed 0/1, consecutive_failures, error or None, company_id) rows
+    """
+    conn = get_connection()
+    if not conn:
+        return False
+    
+    cursor = conn.cursor()
+    
+    try:
+        cursor.executemany(
+            "UPDATE refresh_schedule SET next_refresh_at = %s, interval_s = %s, last_checked_at = %s, "
+            "last_changed_at = COALESCE(%s, last_changed_at), checks = checks + 1, changes = changes + %s, "
+            "consecutive_failures = %s, last_error = %s WHERE company_id = %s",
+            rows
         )
         conn.commit()
         return True
         
-    except mysql.connector.Error as err:
-        print(f"Error saving chat history: {err}")
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='recording refreshes', error=str(err))
+        conn.rollback()
         return False
     finally:
         cursor.close()
         conn.close()
 
+def get_refresh_schedule(now, company_id=None, limit=20):
+    """
+    {'scheduled', 'due', 'refreshes'}: how many bots are scheduled and due, and
+    the next refreshes (or one company's), or None if the database is unavailable
+    """
+    conn = get_connection()
+    if not conn:
+        return None
+    
+    cursor = conn.cursor(dictionary=True)
+    
+    try:
+        cursor.execute(
+            "SELECT COUNT(*) AS scheduled, COALESCE(SUM(CASE WHEN next_refresh_at <= %s THEN 1 ELSE 0 END), 0) AS due "
+            "FROM refresh_schedule",
+            (now,)
+        )
+        counts = cursor.fetchone()
+        if company_id is not None:
+            cursor.execute(REFRESH_QUERY + "WHERE r.company_id = %s", (company_id,))
+        else:
+            cursor.execute(REFRESH_QUERY + "ORDER BY r.next_refresh_at LIMIT %s", (limit,))
+        return {'scheduled': int(counts['scheduled']), 'due': int(counts['due']), 'refreshes': cursor.fetchall()}
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading refresh schedule', error=str(err))
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
 def get_latest_company():
     """Get the most recently created/updated company"""
     conn = get_connection()
@@ -227,32 +1097,386 @@ def get_latest_company():
         )
         return cursor.fetchone()
         
-    except mysql.connector.Error as err:
-        print(f"Error getting latest company: {err}")
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='getting latest company', error=str(err))
         return None
     finally:
         cursor.close()
         conn.close()
 
-def clear_company_data(company_id):
-    """Clear all scraped data for a company (for re-scraping)"""
+def scraped_rows(scraped_data):
+    """Flatten a scraped_data dict into (content_type, content_text, metadata) rows, one per item"""
+    rows = [
+        ('title', scraped_data.get('title', ''), None),
+        ('meta_description', scraped_data.get('meta_description', ''), None),
+    ]
+    if scraped_data.get('full_text'):
+        # Only scrapes from before full_text was dropped (it repeated the other items)
+        rows.append(('full_text', scraped_data['full_text'], None))
+    for heading in scraped_data.get('headings', []):
+        rows.append(('heading', heading, None))
+    for paragraph in scraped_data.get('paragraphs', []):
+        rows.append(('paragraph', paragraph, None))
+    for item in scraped_data.get('lists', []):
+        rows.append(('list_item', item, None))
+    for key, text in scraped_data.get('sections', {}).items():
+        rows.append(('section', text, json.dumps({'key': key})))
+    contact = scraped_data.get('contact_info', {})
+    for email in contact.get('emails', []):
+        rows.append(('email', email, None))
+    for phone in contact.get('phones', []):
+        rows.append(('phone', phone, None))
+    return rows
+
+def scraped_data_from_rows(rows):
+    """Rebuild the scraped_data dict from rows returned by get_company_data"""
+    data = {
+        'title': '',
+        'meta_description': '',
+        'full_text': '',
+        'headings': [],
+        'paragraphs': [],
+        'lists': [],
+        'sections': {},
+        'contact_info': {'emails': [], 'phones': []}
+    }
+    plural = {'heading': 'headings', 'paragraph': 'paragraphs', 'list_item': 'lists'}
+    
+    for row in rows:
+        content_type = row['content_type']
+        text = row['content_text'] or ''
+        if content_type in ('title', 'meta_description', 'full_text'):
+            data[content_type] = text
+        elif content_type in plural:
+            data[plural[content_type]].append(text)
+        elif content_type == 'section':
+            metadata = row.get('metadata')
+            if isinstance(metadata, (str, bytes)):
+                metadata = json.loads(metadata)
+            data['sections'][(metadata or {}).get('key', str(len(data['sections'])))] = text
+        elif content_type == 'email':
+            data['contact_info']['emails'].append(text)
+        elif content_type == 'phone':
+            data['contact_info']['phones'].append(text)
+    
+    return data
+
+@metrics.timed('db.save_scraped_company')
+def save_scraped_company(company_name, website_url, scraped_data, context=None):
+    """
+    Upsert a company and replace its scraped data (and, with context, point
+    its snapshot at the shared copy of that content) in one transaction.
+    Returns company_id, or None if the database is unavailable or the write failed.
+    """
     conn = get_connection()
     if not conn:
-        return False
+        return None
+    
+    cursor = conn.cursor()
+    
+    try:
+        company_id = write_scraped_companies(cursor, [(company_name, website_url, scraped_data, context)])[0]
+        conn.commit()
+        return company_id
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='saving scraped company', error=str(err))
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@metrics.timed('db.save_scraped_companies')
+def save_scraped_companies(companies):
+    """
+    save_scraped_company for a batch of (company_name, website_url, scraped_data, context)
+    in one transaction, with one statement per table rather than per company.
+    Returns the company_ids in order, or None if the database is unavailable or the write failed.
+    """
+    conn = get_connection()
+    if not conn:
+        return None
     
     cursor = conn.cursor()
     
+    try:
+        company_ids = write_scraped_companies(cursor, companies)
+        conn.commit()
+        return company_ids
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='saving scraped companies', companies=len(companies), error=str(err))
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def write_scraped_companies(cursor, companies):
+    """The statements behind save_scraped_company(ies); the caller commits"""
+    company_ids = []
+    latest = {}
+    for company_name, website_url, scraped_data, context in companies:
+        cursor.execute(SQL['upsert_company'], (company_name, website_url))
+        company_ids.append(cursor.lastrowid)
+        # The same company twice in a batch: the last one wins
+        latest[cursor.lastrowid] = (website_url, scraped_data, context)
+    
+    placeholders = ', '.join(['%s'] * len(latest))
+    cursor.execute(f"DELETE FROM scraped_data WHERE company_id IN ({placeholders})", list(latest))
+    cursor.executemany(
+        "INSERT INTO scraped_data (company_id, content_type, content_text, metadata) VALUES (%s, %s, %s, %s)",
+        [
+            (company_id, content_type, text, metadata)
+            for company_id, (_, scraped_data, _) in latest.items()
+            for content_type, text, metadata in scraped_rows(scraped_data)
+        ]
+    )
+    
+    snapshots = {}
+    shared = {}
+    now = datetime.now()
+    for company_id, (website_url, scraped_data, context) in latest.items():
+        if context is None:
+            continue
+        version, scraped_blob, context_blob, context_hash = scrape_codec.encode_snapshot(
+            website_url, scraped_data, context
+        )
+        snapshots[company_id] = (company_id, version, b'', b'', context_hash)
+        shared[context_hash] = (context_hash, scrape_codec.canonical_url(website_url), version, scraped_blob,
+                                context_blob, now)
+    if not snapshots:
+        return company_ids
+    
+    placeholders = ', '.join(['%s'] * len(snapshots))
+    cursor.execute(
+        f"SELECT company_id, context_hash FROM company_snapshots WHERE company_id IN ({placeholders})",
+        list(snapshots)
+    )
+    previous = dict(cursor.fetchall())
+    cursor.executemany(SQL['upsert_shared_context'], list(shared.values()))
+    cursor.executemany(
+        "REPLACE INTO company_snapshots (company_id, format_version, scraped_blob, context_blob, context_hash) "
+        "VALUES (%s, %s, %s, %s, %s)",
+        list(snapshots.values())
+    )
+    for old_hash in set(previous.values()) - set(shared):
+        release_shared_context(cursor, old_hash)
+    
+    return company_ids
+
+def release_shared_context(cursor, context_hash):
+    """Delete a shared context and its stored answers once no company uses it"""
+    cursor.execute("SELECT 1 FROM company_snapshots WHERE context_hash = %s LIMIT 1", (context_hash,))
+    if cursor.fetchone() is None:
+        cursor.execute("DELETE FROM shared_contexts WHERE context_hash = %s", (context_hash,))
+        cursor.execute("DELETE FROM context_answers WHERE context_hash = %s", (context_hash,))
+
+def decode_snapshot_row(row):
+    return scrape_codec.decode_snapshot(row['format_version'], row['scraped_blob'], row['context_blob'])
+
+def _snapshot_from_row(row, decoded):
+    if decoded is None:
+        return None
+    scraped_data, context = decoded
+    return {
+        'company_id': row['company_id'],
+        'company_name': row['company_name'],
+        'website_url': row['website_url'],
+        'scraped_data': scraped_data,
+        'context': context,
+        'context_hash': row['context_hash']
+    }
+
+# Snapshots written before contexts were shared keep their own blobs
+SNAPSHOT_QUERY = (
+    "SELECT s.company_id, s.context_hash, c.company_name, c.website_url, "
+    "COALESCE(x.format_version, s.format_version) AS format_version, "
+    "COALESCE(x.scraped_blob, s.scraped_blob) AS scraped_blob, "
+    "COALESCE(x.context_blob, s.context_blob) AS context_blob "
+    "FROM company_snapshots s JOIN companies c ON c.id = s.company_id "
+    "LEFT JOIN shared_contexts x ON x.context_hash = s.context_hash "
+)
+
+def get_company_snapshot(company_id):
+    """Load a company's decoded snapshot, or None if missing or in an unknown format"""
+    conn = get_connection()
+    if not conn:
+        return None
+    
+    cursor = conn.cursor(dictionary=True)
+    
+    try:
+        cursor.execute(SNAPSHOT_QUERY + "WHERE s.company_id = %s", (company_id,))
+        row = cursor.fetchone()
+        return _snapshot_from_row(row, decode_snapshot_row(row)) if row else None
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading company snapshot', error=str(err))
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_recent_company_snapshots(limit):
+    """Decoded snapshots of the most recently updated companies (for warming a worker)"""
+    conn = get_connection()
+    if not conn:
+        return []
+    
+    cursor = conn.cursor(dictionary=True)
+    
+    try:
+        cursor.execute(SNAPSHOT_QUERY + "ORDER BY s.updated_at DESC LIMIT %s", (limit,))
+        snapshots = []
+        decoded = {}
+        for row in cursor.fetchall():
+            # Companies sharing a context decode it once and share the result
+            if row['context_hash'] not in decoded:
+                decoded[row['context_hash']] = decode_snapshot_row(row)
+            snapshot = _snapshot_from_row(row, decoded[row['context_hash']])
+            if snapshot:
+                snapshots.append(snapshot)
+        return snapshots
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading company snapshots', error=str(err))
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def iter_company_snapshots(batch_size=500):
+    """Every company's decoded snapshot in company_id order, read batch_size rows per query"""
+    after = 0
+    while True:
+        conn = get_connection()
+        if not conn:
+            return
+        
+        cursor = conn.cursor(dictionary=True)
+        
+        try:
+            cursor.execute(SNAPSHOT_QUERY + "WHERE s.company_id > %s ORDER BY s.company_id LIMIT %s",
+                           (after, batch_size))
+            rows = cursor.fetchall()
+        except DB_ERRORS as err:
+            logs.error('database_error', operation='loading company snapshots', error=str(err))
+            return
+        finally:
+            cursor.close()
+            conn.close()
+        
+        decoded = {}
+        for row in rows:
+            if row['context_hash'] not in decoded:
+                decoded[row['context_hash']] = decode_snapshot_row(row)
+            snapshot = _snapshot_from_row(row, decoded[row['context_hash']])
+            if snapshot:
+                yield snapshot
+        if len(rows) < batch_size:
+            return
+        after = rows[-1]['company_id']
+
+def get_context_hashes(company_ids=None, batch_size=500):
+    """
+    {company_id: context_hash} for every stored snapshot (or just these
+    companies'), or None if the database is unavailable
+    """
+    conn = get_connection()
+    if not conn:
+        return None
+    
+    cursor = conn.cursor()
+    
+    try:
+        if company_ids is None:
+            cursor.execute("SELECT company_id, context_hash FROM company_snapshots")
+            return dict(cursor.fetchall())
+        company_ids = list(company_ids)
+        hashes = {}
+        for i in range(0, len(company_ids), batch_size):
+            chunk = company_ids[i:i + batch_size]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(
+                f"SELECT company_id, context_hash FROM company_snapshots WHERE company_id IN ({placeholders})",
+                chunk
+            )
+            hashes.update(cursor.fetchall())
+        return hashes
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading context hashes', error=str(err))
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_live_answers(context_hashes, batch_size=500):
+    """Unexpired stored answers (context_hash, question_hash, response, expires_at) for these contexts"""
+    conn = get_connection()
+    if not conn:
+        return []
+    
+    cursor = conn.cursor()
+    
+    try:
+        context_hashes = list(context_hashes)
+        answers = []
+        now = datetime.now()
+        for i in range(0, len(context_hashes), batch_size):
+            chunk = context_hashes[i:i + batch_size]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(
+                "SELECT context_hash, question_hash, response, expires_at FROM context_answers "
+                f"WHERE context_hash IN ({placeholders}) AND expires_at > %s",
+                chunk + [now]
+            )
+            answers.extend(tuple(row) for row in cursor.fetchall())
+        return answers
+        
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading stored answers', error=str(err))
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+# Bots created for a site that any tenant scraped less than this many seconds
+# ago reuse that scrape (0 = always scrape)
+SHARED_SCRAPE_MAX_AGE = int(os.getenv("SHARED_SCRAPE_MAX_AGE", "900"))
+
+def get_shared_scrape(website_url, max_age=SHARED_SCRAPE_MAX_AGE):
+    """
+    The latest stored scrape of a site, if fresher than max_age seconds:
+    {'scraped_data', 'context', 'context_hash'}, or None
+    """
+    if max_age <= 0:
+        return None
+    
+    conn = get_connection()
+    if not conn:
+        return None
+    
+    cursor = conn.cursor(dictionary=True)
+    
     try:
         cursor.execute(
-            "DELETE FROM scraped_data WHERE company_id = %s",
-            (company_id,)
+            "SELECT context_hash, format_version, scraped_blob, context_blob FROM shared_contexts "
+            "WHERE website_url = %s AND scraped_at >= %s ORDER BY scraped_at DESC LIMIT 1",
+            (scrape_codec.canonical_url(website_url), datetime.now() - timedelta(seconds=max_age))
         )
-        conn.commit()
-        return True
+        row = cursor.fetchone()
+        decoded = decode_snapshot_row(row) if row else None
+        if decoded is None:
+            return None
+        scraped_data, context = decoded
+        return {'scraped_data': scraped_data, 'context': context, 'context_hash': row['context_hash']}
         
-    except mysql.connector.Error as err:
-        print(f"Error clearing company data: {err}")
-        return False
+    except DB_ERRORS as err:
+        logs.error('database_error', operation='loading shared scrape', error=str(err))
+        return None
     finally:
         cursor.close()
         conn.close()
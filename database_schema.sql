@@ -26,19 +26,21 @@ CREATE TABLE IF NOT EXISTS companies (
     user_id INT NOT NULL,
     company_name VARCHAR(255) NOT NULL,
     website_url VARCHAR(500) NOT NULL,
+    daily_token_budget INT NULL COMMENT 'Gemini tokens per day before the fallback answers (NULL = DAILY_TOKEN_BUDGET)',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    UNIQUE KEY uniq_company_site (company_name, website_url),
     INDEX idx_user_id (user_id),
     INDEX idx_company_name (company_name)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
--- Scraped data table: Store extracted website content
+-- Scraped data table: Store extracted website content (one row per item)
 CREATE TABLE IF NOT EXISTS scraped_data (
     id INT AUTO_INCREMENT PRIMARY KEY,
     company_id INT NOT NULL,
-    content_type VARCHAR(50) COMMENT 'Type of content: title, meta_description, full_text, etc.',
-    content_text TEXT,
+    content_type VARCHAR(50) COMMENT 'Type of content: title, meta_description, full_text, heading, paragraph, list_item, section, email, phone',
+    content_text MEDIUMTEXT,
     metadata JSON COMMENT 'Additional metadata in JSON format',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
@@ -54,13 +56,114 @@ CREATE TABLE IF NOT EXISTS chat_history (
     user_question TEXT NOT NULL,
     bot_response TEXT NOT NULL,
     response_time_ms INT COMMENT 'Response time in milliseconds',
+    cached BOOLEAN NOT NULL DEFAULT FALSE COMMENT 'Answered from the response cache',
+    fallback BOOLEAN NOT NULL DEFAULT FALSE COMMENT 'Answered by the offline fallback',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
     INDEX idx_user_company (user_id, company_id),
+    INDEX idx_company_created_id (company_id, created_at, id) COMMENT 'Keyset pagination of a tenant''s history',
     INDEX idx_created_at (created_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Chat history older than HISTORY_RETENTION_DAYS, moved here by `python analytics.py retention`
+CREATE TABLE IF NOT EXISTS chat_history_archive (
+    id INT PRIMARY KEY,
+    company_id INT NOT NULL,
+    user_question TEXT NOT NULL,
+    bot_response TEXT NOT NULL,
+    response_time_ms INT,
+    cached BOOLEAN NOT NULL DEFAULT FALSE,
+    fallback BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMP NULL,
+    INDEX idx_company_id_created (company_id, created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Chat rollups: per company per hour/day, updated in the same transaction as chat_history
+CREATE TABLE IF NOT EXISTS chat_rollups (
+    company_id INT NOT NULL,
+    granularity ENUM('hour', 'day') NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    chats INT NOT NULL DEFAULT 0,
+    cached_chats INT NOT NULL DEFAULT 0,
+    fallback_chats INT NOT NULL DEFAULT 0,
+    total_response_ms BIGINT NOT NULL DEFAULT 0,
+    last_chat_at DATETIME NULL,
+    PRIMARY KEY (company_id, granularity, bucket_start),
+    FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+    INDEX idx_granularity_bucket (granularity, bucket_start)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Latency sketch bins per rollup bucket (see latency_sketch.py); counts add up when merged
+CREATE TABLE IF NOT EXISTS chat_latency_bins (
+    company_id INT NOT NULL,
+    granularity ENUM('hour', 'day') NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    bin SMALLINT NOT NULL COMMENT 'ceil(log_gamma(response_time_ms))',
+    count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (company_id, granularity, bucket_start, bin),
+    FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+    INDEX idx_granularity_bucket (granularity, bucket_start)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Shared contexts: compressed, versioned scrape + AI context, stored once per content hash
+-- and shared by every company whose site and content are the same
+CREATE TABLE IF NOT EXISTS shared_contexts (
+    context_hash CHAR(64) PRIMARY KEY COMMENT 'SHA-256 of the canonical website URL and the AI context',
+    website_url VARCHAR(500) NOT NULL COMMENT 'scrape_codec.canonical_url',
+    format_version SMALLINT NOT NULL COMMENT 'scrape_codec.SNAPSHOT_FORMAT_VERSION',
+    scraped_blob LONGBLOB NOT NULL COMMENT 'zlib-compressed JSON of the full scraped_data',
+    context_blob LONGBLOB NOT NULL COMMENT 'zlib-compressed AI context',
+    scraped_at DATETIME NOT NULL,
+    INDEX idx_url_scraped_at (website_url, scraped_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Company snapshots: the shared context each company's bot is rebuilt from
+CREATE TABLE IF NOT EXISTS company_snapshots (
+    company_id INT PRIMARY KEY,
+    format_version SMALLINT NOT NULL COMMENT 'scrape_codec.SNAPSHOT_FORMAT_VERSION',
+    scraped_blob LONGBLOB NOT NULL COMMENT 'Empty; only snapshots written before shared_contexts keep their blobs here',
+    context_blob LONGBLOB NOT NULL COMMENT 'Empty; see scraped_blob',
+    context_hash CHAR(64) NOT NULL COMMENT 'shared_contexts.context_hash',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+    INDEX idx_updated_at (updated_at),
+    INDEX idx_context_hash (context_hash)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Context answers: Gemini answers kept across restarts, keyed by the shared context they came from
+CREATE TABLE IF NOT EXISTS context_answers (
+    context_hash CHAR(64) NOT NULL COMMENT 'shared_contexts.context_hash',
+    question_hash CHAR(64) NOT NULL COMMENT 'SHA-256 of the normalized question',
+    response MEDIUMTEXT NOT NULL COMMENT 'Company name replaced by {{company_name}}',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at DATETIME NOT NULL,
+    PRIMARY KEY (context_hash, question_hash),
+    INDEX idx_expires_at (expires_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Refresh schedule: when each bot is next re-scraped and how often its site changes
+CREATE TABLE IF NOT EXISTS refresh_schedule (
+    company_id INT PRIMARY KEY,
+    next_refresh_at DATETIME NOT NULL,
+    interval_s INT NOT NULL COMMENT 'Seconds between checks; shrinks when the site changes, grows when it does not',
+    last_checked_at DATETIME NULL,
+    last_changed_at DATETIME NULL,
+    checks INT NOT NULL DEFAULT 0,
+    changes INT NOT NULL DEFAULT 0,
+    consecutive_failures INT NOT NULL DEFAULT 0,
+    last_error VARCHAR(500) NULL,
+    FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+    INDEX idx_next_refresh_at (next_refresh_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Refresh leader: the one scheduler process allowed to run checks (a single leased row)
+CREATE TABLE IF NOT EXISTS refresh_leader (
+    id TINYINT PRIMARY KEY COMMENT 'Always 1',
+    owner VARCHAR(128) NOT NULL COMMENT 'host:pid:nonce of the active scheduler',
+    lease_until DATETIME NOT NULL COMMENT 'Another scheduler may take over after this'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- User sessions table: Track active user sessions
 CREATE TABLE IF NOT EXISTS user_sessions (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -78,31 +181,40 @@ CREATE TABLE IF NOT EXISTS user_sessions (
 -- API usage tracking: Monitor API calls and quota
 CREATE TABLE IF NOT EXISTS api_usage (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    user_id INT NOT NULL,
+    user_id INT NULL,
+    company_id INT NULL,
     api_name VARCHAR(50) COMMENT 'gemini, openai, etc.',
+    usage_date DATE NULL,
     request_count INT DEFAULT 0,
-    tokens_used INT DEFAULT 0,
+    error_count INT DEFAULT 0,
+    tokens_used BIGINT DEFAULT 0 COMMENT 'prompt_tokens + output_tokens',
+    prompt_tokens BIGINT DEFAULT 0,
+    output_tokens BIGINT DEFAULT 0,
+    total_latency_ms BIGINT DEFAULT 0,
     last_request_at TIMESTAMP NULL,
     quota_reset_at TIMESTAMP NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-    INDEX idx_user_api (user_id, api_name)
+    CONSTRAINT fk_api_usage_company FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+    UNIQUE KEY uniq_company_api_day (company_id, api_name, usage_date),
+    INDEX idx_user_api (user_id, api_name),
+    INDEX idx_usage_date_tokens (usage_date, tokens_used)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
--- Optional: Create a view for easy querying
+-- Optional: Create a view for easy querying (reads the daily rollups, not raw chat_history)
 CREATE OR REPLACE VIEW user_activity AS
 SELECT 
     u.id as user_id,
     u.username,
     u.email,
     COUNT(DISTINCT c.id) as total_companies,
-    COUNT(DISTINCT ch.id) as total_chats,
-    AVG(ch.response_time_ms) as avg_response_time_ms,
-    MAX(ch.created_at) as last_chat_at,
+    COALESCE(SUM(r.chats), 0) as total_chats,
+    SUM(r.total_response_ms) / NULLIF(SUM(r.chats), 0) as avg_response_time_ms,
+    MAX(r.last_chat_at) as last_chat_at,
     u.created_at as user_since
 FROM users u
 LEFT JOIN companies c ON u.id = c.user_id
-LEFT JOIN chat_history ch ON u.id = ch.user_id
+LEFT JOIN chat_rollups r ON r.company_id = c.id AND r.granularity = 'day'
 GROUP BY u.id, u.username, u.email, u.created_at;
 
 -- Insert a default demo user (password: demo123 - hashed with bcrypt)
@@ -0,0 +1,264 @@
+import time
+import threading
+from collections import deque
+
+import mysql.connector
+from mysql.connector import errors
+
+import logs
+import metrics
+
+
+class PoolTimeout(errors.PoolError):
+    """No connection became free within the pool timeout"""
+
+
+# Client errors meaning the server can't be reached at all (can't connect
+# through the socket or to the host, server gone away, connection lost).
+# Anything else (e.g. 1040 "Too many connections") only fails that checkout.
+CONNECTIVITY_ERRORS = (2002, 2003, 2006, 2013)
+
+
+def is_connectivity_error(err):
+    return getattr(err, 'errno', None) in CONNECTIVITY_ERRORS
+
+
+class _Entry:
+    __slots__ = ('raw', 'created_at', 'last_used')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class PooledConnection:
+    """Checked-out connection; close() returns it to the pool instead of closing it"""
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def close(self):
+        if self._entry is not None:
+            entry, self._entry = self._entry, None
+            self._pool._release(entry)
+
+    def __getattr__(self, name):
+        if self._entry is None:
+            raise errors.OperationalError("Connection already returned to the pool")
+        return getattr(self._entry.raw, name)
+
+
+class ConnectionPool:
+    """
+    MySQL connection pool with overflow, bounded waits and health checks.
+
+    Keeps up to `size` idle connections and opens up to `max_overflow` more
+    under load (closed again when returned). get_connection() waits at most
+    `timeout` seconds for a free slot and then raises PoolTimeout. Connections
+    idle for more than `pre_ping` seconds are pinged before reuse and any
+    older than `recycle` seconds are replaced. If MySQL can't be reached,
+    get_connection() returns None straight away and a background thread keeps
+    retrying every `reconnect_interval` seconds until it comes back. Other
+    connect errors (such as the server's connection limit) only fail the
+    checkout that hit them.
+    """
+
+    def __init__(self, config, size=5, max_overflow=10, timeout=5.0, recycle=1800,
+                 pre_ping=30, reconnect_interval=5.0, connect=mysql.connector.connect):
+        self.config = config
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.reconnect_interval = reconnect_interval
+        self._connect = connect
+        self._idle = deque()
+        self._open = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._available = False
+        self._reconnecting = False
+
+        try:
+            self._adopt(self._new_entry())
+            self._available = True
+        except mysql.connector.Error as err:
+            logs.error('database_pool_create_failed', error=str(err))
+            self._start_reconnect()
+
+    @property
+    def available(self):
+        return self._available
+
+    def get_connection(self, timeout=None):
+        """Check out a connection, or None while the database is unreachable"""
+        if not self._available:
+            return None
+
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        entry = None
+
+        with self._cond:
+            while True:
+                if not self._available:
+                    return None
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._open < self.size + self.max_overflow:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics.DB_POOL_EVENTS.labels('timeout').inc()
+                    raise PoolTimeout(f"No database connection free after {timeout}s")
+                self._waiting += 1
+                metrics.DB_POOL_WAITING.inc()
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                    metrics.DB_POOL_WAITING.dec()
+
+        metrics.DB_POOL_WAIT.observe(time.monotonic() - started)
+
+        try:
+            entry = self._checkout(entry)
+        except mysql.connector.Error as err:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            self._update_gauges()
+            if is_connectivity_error(err):
+                self._mark_unavailable()
+            else:
+                metrics.DB_POOL_EVENTS.labels('connect_failed').inc()
+            raise
+
+        metrics.DB_POOL_IN_USE.inc()
+        self._update_gauges()
+        return PooledConnection(self, entry)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'available': self._available,
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle),
+                'waiting': self._waiting
+            }
+
+    def _checkout(self, entry):
+        """Validate an idle entry (or open a new one for a reserved slot)"""
+        if entry is None:
+            return self._new_entry()
+
+        now = time.monotonic()
+        if now - entry.created_at > self.recycle:
+            metrics.DB_POOL_EVENTS.labels('recycled').inc()
+            self._close_raw(entry.raw)
+            return self._new_entry()
+
+        if now - entry.last_used > self.pre_ping:
+            try:
+                entry.raw.ping(reconnect=False)
+            except mysql.connector.Error:
+                metrics.DB_POOL_EVENTS.labels('stale').inc()
+                self._close_raw(entry.raw)
+                return self._new_entry()
+        return entry
+
+    def _new_entry(self):
+        raw = self._connect(**self.config)
+        metrics.DB_POOL_EVENTS.labels('opened').inc()
+        return _Entry(raw)
+
+    def _adopt(self, entry):
+        """Add a freshly opened connection to the idle set"""
+        with self._cond:
+            self._open += 1
+        metrics.DB_POOL_IN_USE.inc()
+        self._release(entry)
+
+    def _release(self, entry):
+        metrics.DB_POOL_IN_USE.dec()
+        try:
+            # Never hand a half-finished transaction to the next caller
+            if entry.raw.in_transaction:
+                entry.raw.rollback()
+        except mysql.connector.Error:
+            self._discard(entry)
+            return
+
+        entry.last_used = time.monotonic()
+        with self._cond:
+            if len(self._idle) < self.size:
+                self._idle.append(entry)
+                entry = None
+            else:
+                # Overflow connection: close it rather than keep it idle
+                self._open -= 1
+            self._cond.notify()
+        if entry is not None:
+            self._close_raw(entry.raw)
+        self._update_gauges()
+
+    def _discard(self, entry):
+        self._close_raw(entry.raw)
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+        self._update_gauges()
+
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _mark_unavailable(self):
+        with self._cond:
+            if not self._available:
+                return
+            self._available = False
+            # Idle connections are almost certainly dead too
+            while self._idle:
+                self._close_raw(self._idle.pop().raw)
+                self._open -= 1
+            self._cond.notify_all()
+        logs.error('database_unreachable', reconnect_interval_s=self.reconnect_interval)
+        self._start_reconnect()
+
+    def _start_reconnect(self):
+        with self._cond:
+            if self._reconnecting:
+                return
+            self._reconnecting = True
+        threading.Thread(target=self._reconnect_loop, name="db-reconnect", daemon=True).start()
+
+    def _reconnect_loop(self):
+        while True:
+            time.sleep(self.reconnect_interval)
+            try:
+                entry = self._new_entry()
+            except mysql.connector.Error:
+                metrics.DB_POOL_EVENTS.labels('reconnect_failed').inc()
+                continue
+            self._adopt(entry)
+            with self._cond:
+                self._available = True
+                self._reconnecting = False
+            logs.warning('database_restored')
+            return
+
+    def _update_gauges(self):
+        metrics.DB_POOL_OPEN.set(self._open)
+        metrics.DB_POOL_IDLE.set(len(self._idle))
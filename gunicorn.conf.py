@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+
+# Per-worker metric files are merged by /metrics (see metrics.py)
+multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "chatbot_prometheus")
+)
+
+# Threads per worker; admission control (admission.py) bounds how many of them
+# are busy with Gemini calls or scrapes at once
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+
+def on_starting(server):
+    # Samples from a previous run must not leak into this one
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def post_worker_init(worker):
+    # Rebuild the most recently used bots from their stored snapshots (no scraping)
+    from chatbot_registry import registry
+    loaded = registry.preload()
+    if loaded:
+        print(f"Preloaded {loaded} chatbots")
+    # Re-scrape stale bots in the background (REFRESH_ENABLED; one worker leads at a time)
+    import refresh
+    refresh.start()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    # Flush buffered chat history before the worker goes away
+    import write_behind
+    write_behind.close_all()
+    # Then the log lines those flushes produced
+    import logs
+    logs.close()
+    import parse_pool
+    parse_pool.close()
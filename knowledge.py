@@ -0,0 +1,147 @@
+import re
+import sys
+from array import array
+
+EMAIL_PATTERN = re.compile(r'[\w\.-]+@[\w\.-]+\.\w+')
+
+
+class TextSpans:
+    """
+    Read-only sequence of strings stored as (start, end) byte offsets into a
+    shared UTF-8 buffer (bytes, or a memoryview of a mapped snapshot file)
+    """
+
+    __slots__ = ('_buffer', '_offsets')
+
+    def __init__(self, buffer, offsets):
+        self._buffer = buffer
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) // 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('span index out of range')
+        start, end = self._offsets[2 * index], self._offsets[2 * index + 1]
+        return str(self._buffer[start:end], 'utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    def nbytes(self):
+        return sys.getsizeof(self) + sys.getsizeof(self._offsets)
+
+
+class CompanyKnowledge:
+    """
+    Immutable, compact form of a bot's AI context.
+
+    The context is kept once, as UTF-8 bytes (the formatted context has emoji,
+    which would make a str take 4 bytes per character); headings, services and
+    paragraphs are offsets into it rather than separate strings. The prompt
+    builder uses .text, the fallback answers use the parsed fields.
+    """
+
+    __slots__ = ('_buffer', 'title', 'description', 'headings', 'services', 'paragraphs', 'emails', 'phones')
+
+    def __init__(self, context):
+        buffer = context.encode('utf-8')
+        spans = {'headings': array('I'), 'services': array('I'), 'paragraphs': array('I')}
+        title = description = ''
+        emails = []
+        current_section = None
+
+        position = 0
+        for raw_line in context.split('\n'):
+            line_start = position
+            position += len(raw_line.encode('utf-8')) + 1
+            line = raw_line.strip()
+            if not line:
+                continue
+
+            if line.startswith('COMPANY:'):
+                title = line.replace('COMPANY:', '').strip()
+            elif line.startswith('DESCRIPTION:'):
+                description = line.replace('DESCRIPTION:', '').strip()
+            elif 'KEY TOPICS:' in line:
+                current_section = 'headings'
+            elif 'SERVICES & FEATURES:' in line:
+                current_section = 'services'
+            elif 'DETAILED CONTENT:' in line:
+                current_section = 'paragraphs'
+            elif 'CONTACT' in line:
+                current_section = 'contact'
+            elif current_section in ('headings', 'services') and line.startswith('•'):
+                self._add_span(spans[current_section], raw_line, line_start, line[1:].strip())
+            elif current_section == 'paragraphs' and len(line) > 30:
+                self._add_span(spans['paragraphs'], raw_line, line_start, line)
+            elif current_section == 'contact':
+                emails.extend(EMAIL_PATTERN.findall(line))
+
+        self._set(buffer, title, description, spans['headings'], spans['services'], spans['paragraphs'], emails)
+
+    @classmethod
+    def from_parts(cls, buffer, title, description, headings, services, paragraphs, emails):
+        """
+        Knowledge from an already parsed context: buffer is its UTF-8 text and
+        headings/services/paragraphs are (start, end) offset sequences into it.
+        Used to map bots from a snapshot file without copying or re-parsing them.
+        """
+        knowledge = cls.__new__(cls)
+        knowledge._set(buffer, title, description, headings, services, paragraphs, emails)
+        return knowledge
+
+    def _set(self, buffer, title, description, headings, services, paragraphs, emails):
+        setattr_ = super().__setattr__
+        setattr_('_buffer', buffer)
+        setattr_('title', sys.intern(title))
+        setattr_('description', sys.intern(description))
+        setattr_('headings', TextSpans(buffer, headings))
+        setattr_('services', TextSpans(buffer, services))
+        setattr_('paragraphs', TextSpans(buffer, paragraphs))
+        setattr_('emails', tuple(sys.intern(email) for email in emails))
+        setattr_('phones', ())
+
+    @staticmethod
+    def _add_span(offsets, raw_line, line_start, text):
+        if not text:
+            offsets.extend((line_start, line_start))
+            return
+        start = line_start + len(raw_line[:raw_line.index(text)].encode('utf-8'))
+        offsets.extend((start, start + len(text.encode('utf-8'))))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompanyKnowledge is immutable')
+
+    @property
+    def text(self):
+        """The full AI context (decoded on each use, for the prompt)"""
+        return str(self._buffer, 'utf-8')
+
+    @property
+    def buffer(self):
+        """The context as UTF-8 bytes (or a memoryview of them)"""
+        return self._buffer
+
+    def nbytes(self):
+        """Approximate memory held by this object (a mapped snapshot file's pages are shared, not counted)"""
+        return (sys.getsizeof(self) + sys.getsizeof(self._buffer) + sys.getsizeof(self.title)
+                + sys.getsizeof(self.description) + sys.getsizeof(self.emails)
+                + self.headings.nbytes() + self.services.nbytes() + self.paragraphs.nbytes())
+
+
+def as_knowledge(company_context):
+    """CompanyKnowledge for a context string (or the object itself)"""
+    if isinstance(company_context, CompanyKnowledge):
+        return company_context
+    return CompanyKnowledge(company_context or '')
@@ -0,0 +1,55 @@
+import math
+
+# Quantiles are accurate to within 2% of the true value. A response time v (ms)
+# is counted in bin ceil(log_gamma(v)); two sketches merge by adding bin counts,
+# so hourly rollups combine into daily ones (and across workers) exactly.
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+
+
+def bin_index(value_ms):
+    """Bin for a response time; everything at or below 1ms shares bin 0"""
+    if value_ms <= 1:
+        return 0
+    return int(math.ceil(math.log(value_ms) / _LOG_GAMMA))
+
+
+def bin_value(index):
+    """Representative response time for a bin (within RELATIVE_ACCURACY of any value in it)"""
+    if index <= 0:
+        return 0
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class LatencySketch:
+    """Mergeable response-time histogram with log-spaced bins"""
+
+    __slots__ = ('bins', 'count')
+
+    def __init__(self, bins=None):
+        self.bins = dict(bins or {})
+        self.count = sum(self.bins.values())
+
+    def add(self, value_ms, n=1):
+        index = bin_index(value_ms)
+        self.bins[index] = self.bins.get(index, 0) + n
+        self.count += n
+
+    def merge(self, other):
+        for index, n in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + n
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        """Approximate q-quantile in ms, or None for an empty sketch"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return round(bin_value(index), 1)
+        return round(bin_value(max(self.bins)), 1)
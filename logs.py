@@ -0,0 +1,239 @@
+"""
+Structured, non-blocking logging.
+
+log() and its level helpers turn an event into one JSON line, tagged with
+the current request id, and put it on a bounded in-memory queue. A
+background thread writes queued lines to stdout (or LOG_FILE) in batches.
+When the queue is full the line is dropped and counted; the writer reports
+drops in a later line. A slow log pipe can never stall a request.
+
+Info and debug events can be sampled (LOG_SAMPLE_INFO, LOG_SAMPLE_DEBUG).
+The decision is made per request id, so a sampled request keeps all of its
+lines. Sampled lines carry sample_rate so counts can be scaled back up.
+Warnings and errors are always kept.
+
+Every request ends with a "request" line: endpoint, status, duration and the
+time spent in each metrics.time_stage stage.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import queue
+import atexit
+import random
+import threading
+import contextvars
+from datetime import datetime, timezone
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+LOG_LEVEL = LEVELS.get(os.getenv("LOG_LEVEL", "info").lower(), LEVELS['info'])
+# Fraction of requests whose info/debug lines are kept
+LOG_SAMPLE_RATES = {
+    'debug': float(os.getenv("LOG_SAMPLE_DEBUG", "1.0")),
+    'info': float(os.getenv("LOG_SAMPLE_INFO", "1.0")),
+    'warning': 1.0,
+    'error': 1.0
+}
+# Lines held in memory before new ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Where lines go (default stdout)
+LOG_FILE = os.getenv("LOG_FILE")
+# Incoming request id header (also echoed on responses)
+REQUEST_ID_HEADER = "X-Request-Id"
+
+# Lines written per write() call
+WRITE_BATCH = 500
+
+_request = contextvars.ContextVar('log_request', default=None)
+
+
+class RequestLog:
+    """Request id and stage timings of the request being served"""
+    __slots__ = ('request_id', 'endpoint', 'start', 'stages', 'sample_point')
+
+    def __init__(self, request_id, endpoint):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.stages = {}
+        # Where this request falls in [0, 1): it is kept at rate r if below r
+        self.sample_point = (zlib.crc32(request_id.encode('utf-8')) & 0xffffffff) / 2 ** 32
+
+
+class LogWriter:
+    """Bounded queue of formatted lines drained by a background thread"""
+
+    def __init__(self, stream=None, path=None, max_queue=LOG_QUEUE_SIZE):
+        self.stream = stream
+        self.path = path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._counts_lock = threading.Lock()
+        self._dropped = 0
+        self._written = 0
+
+    def submit(self, line):
+        """Queue a line; returns False if it had to be dropped"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            with self._counts_lock:
+                self._dropped += 1
+            return False
+        return True
+
+    def stats(self):
+        with self._counts_lock:
+            return {'queued': self._queue.qsize(), 'written': self._written, 'dropped': self._dropped}
+
+    def close(self, timeout=5):
+        """Stop the writer thread after writing everything queued"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._drain()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    if self.stream is None:
+                        self.stream = open(self.path, 'a', encoding='utf-8') if self.path else sys.stdout
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        reported = 0
+        while not self._stop.is_set():
+            try:
+                lines = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(lines) < WRITE_BATCH:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self._counts_lock:
+                dropped = self._dropped
+            if dropped > reported:
+                lines.append(format_line('warning', 'log_lines_dropped', None, 1.0,
+                                         {'dropped': dropped - reported, 'dropped_total': dropped}))
+                reported = dropped
+            self._write(lines)
+        self._drain()
+
+    def _drain(self):
+        lines = []
+        while True:
+            try:
+                lines.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if lines:
+            self._write(lines)
+
+    def _write(self, lines):
+        try:
+            self.stream.write('\n'.join(lines) + '\n')
+            self.stream.flush()
+        except Exception:
+            # Nowhere left to report it; the lines are lost
+            return
+        with self._counts_lock:
+            self._written += len(lines)
+
+
+def format_line(level, event, request_id, sample_rate, fields):
+    record = {
+        'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+        'level': level,
+        'event': event,
+        'pid': os.getpid()
+    }
+    if request_id:
+        record['request_id'] = request_id
+    if sample_rate < 1.0:
+        record['sample_rate'] = sample_rate
+    record.update(fields)
+    return json.dumps(record, ensure_ascii=False, default=str)
+
+
+def log(level, event, **fields):
+    """Queue one event; returns False if it was filtered, sampled out or dropped"""
+    if LEVELS[level] < LOG_LEVEL:
+        return False
+    current = _request.get()
+    rate = LOG_SAMPLE_RATES[level]
+    if rate < 1.0:
+        point = current.sample_point if current is not None else random.random()
+        if point >= rate:
+            return False
+    return writer.submit(format_line(level, event, current.request_id if current else None, rate, fields))
+
+
+def debug(event, **fields):
+    return log('debug', event, **fields)
+
+
+def info(event, **fields):
+    return log('info', event, **fields)
+
+
+def warning(event, **fields):
+    return log('warning', event, **fields)
+
+
+def error(event, **fields):
+    return log('error', event, **fields)
+
+
+def new_request_id(incoming=None):
+    """The caller's request id if it looks sane, else a new one"""
+    if incoming and len(incoming) <= 128 and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex[:16]
+
+
+def start_request(endpoint, incoming_id=None):
+    """Tag log lines of the current request with an id; returns a token for finish_request"""
+    current = RequestLog(new_request_id(incoming_id), endpoint or 'unknown')
+    return _request.set(current), current
+
+
+def request_id():
+    current = _request.get()
+    return current.request_id if current else None
+
+
+def record_stage(name, seconds):
+    """Called by metrics.time_stage for every stage; a no-op outside a request"""
+    current = _request.get()
+    if current is not None:
+        current.stages[name] = current.stages.get(name, 0.0) + seconds
+
+
+def finish_request(started, status):
+    """Log the request line for a request started with start_request"""
+    token, current = started
+    info('request', endpoint=current.endpoint, status=status,
+         duration_ms=round((time.perf_counter() - current.start) * 1000, 2),
+         stages={name: round(seconds * 1000, 2) for name, seconds in current.stages.items()})
+    _request.reset(token)
+
+
+writer = LogWriter(path=LOG_FILE)
+
+
+def close():
+    writer.close()
+
+
+atexit.register(close)
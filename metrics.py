@@ -0,0 +1,138 @@
+import os
+import time
+import functools
+import contextvars
+from contextlib import contextmanager
+
+import logs
+import profiling
+
+from prometheus_client import (
+    REGISTRY, Counter, Gauge, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST, multiprocess
+)
+
+# Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+# (set by gunicorn.conf.py) and /metrics merges them, so counts cover all workers.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REQUEST_LATENCY = Histogram(
+    'chatbot_request_seconds', 'End-to-end request latency', ['endpoint'], buckets=LATENCY_BUCKETS
+)
+REQUESTS = Counter(
+    'chatbot_requests_total', 'Requests by endpoint and HTTP status', ['endpoint', 'status']
+)
+STAGE_LATENCY = Histogram(
+    'chatbot_stage_seconds', 'Latency of each stage of a request', ['endpoint', 'stage'], buckets=LATENCY_BUCKETS
+)
+STAGE_TOTAL = Counter(
+    'chatbot_stage_total', 'Stage executions by outcome', ['endpoint', 'stage', 'outcome']
+)
+ADMISSION = Counter(
+    'chatbot_admission_total', 'Admission control decisions', ['endpoint', 'outcome']
+)
+ADMISSION_WAIT = Histogram(
+    'chatbot_admission_wait_seconds', 'Time spent queued for admission', ['endpoint'], buckets=LATENCY_BUCKETS
+)
+WRITE_BEHIND_ROWS = Counter(
+    'chatbot_write_behind_rows_total', 'Rows through write-behind queues', ['queue', 'outcome']
+)
+WRITE_BEHIND_BATCH = Histogram(
+    'chatbot_write_behind_batch_rows', 'Rows per write-behind flush', ['queue'],
+    buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000)
+)
+LLM_TOKENS = Counter(
+    'chatbot_llm_tokens_total', 'Tokens sent to and generated by the LLM', ['kind']
+)
+DB_POOL_OPEN = Gauge(
+    'chatbot_db_pool_open_connections', 'Open MySQL connections (idle + in use)', multiprocess_mode='livesum'
+)
+DB_POOL_IDLE = Gauge(
+    'chatbot_db_pool_idle_connections', 'Idle MySQL connections', multiprocess_mode='livesum'
+)
+DB_POOL_IN_USE = Gauge(
+    'chatbot_db_pool_in_use_connections', 'Checked-out MySQL connections', multiprocess_mode='livesum'
+)
+DB_POOL_WAITING = Gauge(
+    'chatbot_db_pool_waiting_threads', 'Threads waiting for a MySQL connection', multiprocess_mode='livesum'
+)
+DB_POOL_WAIT = Histogram(
+    'chatbot_db_pool_wait_seconds', 'Time to check out a MySQL connection', buckets=LATENCY_BUCKETS
+)
+DB_POOL_EVENTS = Counter(
+    'chatbot_db_pool_events_total', 'Connection pool events (opened, recycled, stale, timeout, connect_failed, reconnect_failed)', ['event']
+)
+
+# Endpoint the current request is serving; stages deep in scraper/ai_chatbot/database
+# read it so their samples are attributed to /chat or /create-chatbot.
+current_endpoint = contextvars.ContextVar('current_endpoint', default='none')
+
+
+class Stage:
+    """Handle yielded by time_stage; set .outcome to label the sample"""
+    __slots__ = ('name', 'outcome')
+
+    def __init__(self, name):
+        self.name = name
+        self.outcome = 'ok'
+
+
+@contextmanager
+def time_stage(name):
+    """Record latency and outcome of one stage of the current request"""
+    stage = Stage(name)
+    start = time.perf_counter()
+    try:
+        yield stage
+    except BaseException:
+        if stage.outcome == 'ok':
+            stage.outcome = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        endpoint = current_endpoint.get()
+        STAGE_LATENCY.labels(endpoint, name).observe(elapsed)
+        STAGE_TOTAL.labels(endpoint, name, stage.outcome).inc()
+        profiling.record(name, elapsed)
+        logs.record_stage(name, elapsed)
+
+
+def timed(name):
+    """Decorator form of time_stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with time_stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_request(endpoint):
+    """Mark the start of a request; returns a token for finish_request"""
+    token = current_endpoint.set(endpoint or 'unknown')
+    return token, time.perf_counter()
+
+
+def finish_request(started, status):
+    """Record the end of a request started with start_request"""
+    token, start = started
+    endpoint = current_endpoint.get()
+    REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+    REQUESTS.labels(endpoint, str(status)).inc()
+    current_endpoint.reset(token)
+
+
+def in_context(func, *args):
+    """Bind func to the caller's context so executor threads keep the endpoint label"""
+    return functools.partial(contextvars.copy_context().run, func, *args)
+
+
+def render():
+    """Prometheus text exposition of all metrics (merged across workers if multiprocess)"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
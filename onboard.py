@@ -0,0 +1,295 @@
+"""
+Bulk chatbot onboarding.
+
+Creates chatbots for a CSV or JSONL file of companies (company_name,
+website_url) without going through /create-chatbot. Websites are scraped by
+a pool of worker processes, each fetching several sites at a time, so HTML
+parsing uses every core. Results are written in batches (one transaction per
+batch), and every finished company is appended to a checkpoint file with its
+timings or error. Running the same command again skips the companies the
+checkpoint already has.
+
+    python onboard.py companies.csv
+    python onboard.py companies.jsonl --processes 8 --threads 16 --checkpoint onboard-run1.jsonl
+
+Bots are loaded from the database the first time someone chats with them, so
+running servers don't need a restart.
+
+Scrape workers are spawned and re-import this script, so it imports database
+(and opens its connection pool) only inside the functions that write.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from datetime import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import scraper
+import parse_pool
+import scrape_codec
+
+# Worker processes scraping websites
+ONBOARD_PROCESSES = int(os.getenv("ONBOARD_PROCESSES", str(os.cpu_count() or 1)))
+# Websites each worker process fetches at a time
+ONBOARD_THREADS = int(os.getenv("ONBOARD_THREADS", "8"))
+# Websites handed to a worker process per task
+ONBOARD_CHUNK_SIZE = int(os.getenv("ONBOARD_CHUNK_SIZE", "16"))
+# Companies written per database transaction
+ONBOARD_BATCH_SIZE = int(os.getenv("ONBOARD_BATCH_SIZE", "200"))
+
+
+def read_companies(path):
+    """
+    (company_name, website_url) pairs from a CSV file (with a company_name,
+    website_url header, or those two columns without one) or a JSONL file;
+    duplicates and incomplete rows are dropped
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.ndjson', '.json')):
+            rows = [json.loads(line) for line in f if line.strip()]
+            pairs = [(row.get('company_name'), row.get('website_url')) for row in rows]
+        else:
+            rows = list(csv.reader(f))
+            if rows and 'company_name' in rows[0] and 'website_url' in rows[0]:
+                name_col, url_col = rows[0].index('company_name'), rows[0].index('website_url')
+                rows = rows[1:]
+            else:
+                name_col, url_col = 0, 1
+            pairs = [(row[name_col], row[url_col]) for row in rows if len(row) > max(name_col, url_col)]
+
+    companies = {}
+    for company_name, website_url in pairs:
+        company_name = (company_name or '').strip()
+        website_url = (website_url or '').strip()
+        if company_name and website_url:
+            key = (company_name, scraper.normalize_url(website_url))
+            companies.setdefault(key, key)
+    return list(companies)
+
+
+class Checkpoint:
+    """Append-only JSONL record of finished companies, read back to resume a run"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        needs_newline = False
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    needs_newline = not line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash: that company runs again
+                        continue
+                    self.entries[(entry['company_name'], entry['website_url'])] = entry
+        self._file = open(path, 'a', encoding='utf-8')
+        if needs_newline:
+            self._file.write('\n')
+
+    def status(self, company):
+        entry = self.entries.get(company)
+        return entry['status'] if entry else None
+
+    def record(self, entries):
+        for entry in entries:
+            self._file.write(json.dumps(entry) + '\n')
+            self.entries[(entry['company_name'], entry['website_url'])] = entry
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def entry(company, status, scrape_ms=None, save_ms=None, company_id=None, error=None, shared=False):
+    company_name, website_url = company
+    return {
+        'company_name': company_name,
+        'website_url': website_url,
+        'status': status,
+        'company_id': company_id,
+        'error': error,
+        'scrape_ms': scrape_ms,
+        'save_ms': save_ms,
+        'shared_scrape': shared,
+        'finished_at': datetime.now().isoformat(timespec='seconds')
+    }
+
+
+def save_batch(batch):
+    """
+    Write scraped companies [(company, scraped_data, context, scrape_ms, shared)]
+    in one transaction; if that fails, company by company so one bad row
+    doesn't fail the rest. Returns their checkpoint entries.
+    """
+    import database
+    start = time.perf_counter()
+    company_ids = database.save_scraped_companies([
+        (company_name, website_url, scraped_data, context)
+        for (company_name, website_url), scraped_data, context, _, _ in batch
+    ])
+    if company_ids is None:
+        company_ids = [
+            database.save_scraped_company(company_name, website_url, scraped_data, context)
+            for (company_name, website_url), scraped_data, context, _, _ in batch
+        ]
+    # Each company's share of the batch write
+    save_ms = int((time.perf_counter() - start) * 1000 / len(batch))
+
+    return [
+        entry(company, 'ok', scrape_ms, save_ms, company_id, shared=shared) if company_id
+        else entry(company, 'failed', scrape_ms, error='database write failed', shared=shared)
+        for (company, _, _, scrape_ms, shared), company_id in zip(batch, company_ids)
+    ]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def onboard(companies, checkpoint, processes=ONBOARD_PROCESSES, threads=ONBOARD_THREADS,
+            chunk_size=ONBOARD_CHUNK_SIZE, batch_size=ONBOARD_BATCH_SIZE,
+            max_age=None, retry_failed=False):
+    """
+    Scrape and save companies not yet in the checkpoint; returns a summary of
+    the run. max_age defaults to SHARED_SCRAPE_MAX_AGE.
+    """
+    import database
+    if max_age is None:
+        max_age = database.SHARED_SCRAPE_MAX_AGE
+    skip = ('ok', 'failed') if not retry_failed else ('ok',)
+    pending = [company for company in companies if checkpoint.status(company) not in skip]
+
+    # Each website is scraped once for all the companies that use it
+    sites = {}
+    for company in pending:
+        sites.setdefault(scrape_codec.canonical_url(company[1]), []).append(company)
+
+    started = time.perf_counter()
+    counts = {'ok': 0, 'failed': 0}
+    scrape_times = []
+    batch = []
+
+    def finish(entries):
+        checkpoint.record(entries)
+        for e in entries:
+            counts[e['status']] += 1
+        done = counts['ok'] + counts['failed']
+        elapsed = time.perf_counter() - started
+        rate = done / elapsed * 3600 if elapsed else 0.0
+        eta = (len(pending) - done) / rate * 60 if rate else 0.0
+        print(f"{done}/{len(pending)} done ({counts['failed']} failed), {rate:.0f} companies/hour, "
+              f"~{eta:.0f} min left")
+
+    def scraped(group, result, context, scrape_ms, shared=False):
+        if not result['success']:
+            finish([entry(company, 'failed', scrape_ms, error=result.get('error'), shared=shared)
+                    for company in group])
+            return
+        scrape_times.append(scrape_ms)
+        batch.extend((company, result['data'], context, scrape_ms, shared) for company in group)
+        if len(batch) >= batch_size:
+            finish(save_batch(batch))
+            batch.clear()
+
+    to_scrape = []
+    for group in sites.values():
+        shared = database.get_shared_scrape(group[0][1], max_age) if max_age else None
+        if shared:
+            scraped(group, {'success': True, 'data': shared['scraped_data']}, shared['context'], 0, shared=True)
+        else:
+            to_scrape.append(group)
+
+    # Spawned, so workers import the scraper but not database (and its
+    # connection pool). They are separate processes already, so they parse in
+    # their own threads.
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=parse_pool.disable)
+    try:
+        futures = {}
+        for i in range(0, len(to_scrape), chunk_size):
+            chunk = to_scrape[i:i + chunk_size]
+            future = executor.submit(scraper.scrape_many, [group[0][1] for group in chunk], threads)
+            futures[future] = chunk
+
+        for future in as_completed(futures):
+            chunk = futures.pop(future)
+            try:
+                results = future.result()
+            except Exception as e:
+                finish([entry(company, 'failed', error=f"worker failed: {str(e)}")
+                        for group in chunk for company in group])
+                continue
+            for group, (_, result, context, scrape_ms) in zip(chunk, results):
+                scraped(group, result, context, scrape_ms)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Keep what was scraped before an interrupt
+        if batch:
+            finish(save_batch(batch))
+
+    elapsed = time.perf_counter() - started
+    return {
+        'companies': len(companies),
+        'skipped': len(companies) - len(pending),
+        'websites': len(sites),
+        'ok': counts['ok'],
+        'failed': counts['failed'],
+        'elapsed_s': round(elapsed, 1),
+        'companies_per_hour': round((counts['ok'] + counts['failed']) / elapsed * 3600) if elapsed else 0,
+        'scrape_p50_ms': percentile(scrape_times, 50),
+        'scrape_p95_ms': percentile(scrape_times, 95)
+    }
+
+
+def main(argv=None):
+    import database
+    parser = argparse.ArgumentParser(description="Create chatbots for a file of companies")
+    parser.add_argument('input', help="CSV or JSONL file with company_name and website_url")
+    parser.add_argument('--checkpoint', help="progress file (default: <input>.checkpoint.jsonl)")
+    parser.add_argument('--processes', type=int, default=ONBOARD_PROCESSES)
+    parser.add_argument('--threads', type=int, default=ONBOARD_THREADS, help="concurrent fetches per process")
+    parser.add_argument('--chunk-size', type=int, default=ONBOARD_CHUNK_SIZE)
+    parser.add_argument('--batch-size', type=int, default=ONBOARD_BATCH_SIZE)
+    parser.add_argument('--max-age', type=int, default=database.SHARED_SCRAPE_MAX_AGE,
+                        help="reuse scrapes of the same website up to this many seconds old (0 = always scrape)")
+    parser.add_argument('--retry-failed', action='store_true', help="retry companies the checkpoint has as failed")
+    args = parser.parse_args(argv)
+
+    companies = read_companies(args.input)
+    if not companies:
+        print(f"No companies in {args.input}")
+        return 1
+
+    conn = database.get_connection()
+    if conn is None:
+        print("Database is not reachable")
+        return 1
+    conn.close()
+
+    checkpoint = Checkpoint(args.checkpoint or args.input + '.checkpoint.jsonl')
+    try:
+        result = onboard(companies, checkpoint, args.processes, args.threads, args.chunk_size,
+                         args.batch_size, args.max_age, args.retry_failed)
+    finally:
+        checkpoint.close()
+
+    print(f"{result['ok']} chatbots created, {result['failed']} failed, {result['skipped']} already done "
+          f"({result['websites']} websites, {result['elapsed_s']}s, {result['companies_per_hour']} companies/hour)")
+    if result['scrape_p50_ms'] is not None:
+        print(f"scrape p50 {result['scrape_p50_ms']} ms, p95 {result['scrape_p95_ms']} ms")
+    print(f"Progress and errors: {checkpoint.path}")
+    return 0 if not result['failed'] else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
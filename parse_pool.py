@@ -0,0 +1,162 @@
+"""
+Process pool for CPU-heavy HTML parsing.
+
+BeautifulSoup parsing and text extraction hold the GIL for as long as they
+run: a few large pages parsed in a web worker stall every /chat request that
+worker is serving. run() hands such work to a small pool of separate
+processes instead, so the calling thread only waits (without the GIL) for
+the result. Only the raw page bytes go in and the compact extracted result
+comes back.
+
+The pool is bounded: at most PARSE_MAX_PENDING tasks are queued or running,
+and callers wait up to PARSE_QUEUE_TIMEOUT seconds for a slot before giving
+up. Each task may use PARSE_CPU_LIMIT seconds of CPU time; a page that takes
+longer fails with ParseTimeout instead of occupying a worker. With
+PARSE_PROCESSES=0 work runs in the calling thread, as it did before.
+
+Workers are spawned, so each re-imports the parent's entry script as
+__mp_main__: entry scripts keep their work under `if __name__ == '__main__'`
+and import nothing at module level that a parser doesn't need (under
+gunicorn the entry script is gunicorn's own).
+"""
+import os
+import atexit
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Parser processes per web worker (0 = parse in the calling thread)
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", str(min(2, os.cpu_count() or 1))))
+# Tasks queued or running at once
+PARSE_MAX_PENDING = int(os.getenv("PARSE_MAX_PENDING", "16"))
+# Seconds to wait for a free slot
+PARSE_QUEUE_TIMEOUT = float(os.getenv("PARSE_QUEUE_TIMEOUT", "30"))
+# CPU seconds one task may use
+PARSE_CPU_LIMIT = float(os.getenv("PARSE_CPU_LIMIT", "10"))
+
+
+class ParsePoolBusy(Exception):
+    """No slot became free within the queue timeout"""
+
+
+class ParseTimeout(Exception):
+    """A task used more than its CPU time limit"""
+
+
+def _on_cpu_limit(signum, frame):
+    raise ParseTimeout()
+
+
+def _init_worker():
+    # Workers are only signalled by their own CPU timer
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGPROF, _on_cpu_limit)
+
+
+def _run_limited(cpu_limit, func, args):
+    """Runs in a worker: func(*args) with a CPU time limit"""
+    if not hasattr(signal, 'setitimer'):
+        return func(*args)
+    # ITIMER_PROF counts the process's user + system CPU time
+    signal.setitimer(signal.ITIMER_PROF, cpu_limit)
+    try:
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+
+
+class ParsePool:
+    """Bounded pool of parser processes, started on first use"""
+
+    def __init__(self, processes=PARSE_PROCESSES, max_pending=PARSE_MAX_PENDING,
+                 queue_timeout=PARSE_QUEUE_TIMEOUT, cpu_limit=PARSE_CPU_LIMIT):
+        self.processes = processes
+        self.queue_timeout = queue_timeout
+        self.cpu_limit = cpu_limit
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._lock = threading.Lock()
+        self._executor = None
+        self._counts = {'completed': 0, 'timed_out': 0, 'busy': 0, 'crashed': 0}
+
+    def run(self, func, *args):
+        """
+        func(*args) in a parser process; func, args and the result must be
+        picklable. Raises ParsePoolBusy, ParseTimeout, or whatever func raised.
+        """
+        if self.processes <= 0:
+            return func(*args)
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._count('busy')
+            raise ParsePoolBusy(f"{self.processes} parser processes are busy")
+        try:
+            executor = self._get_executor()
+            future = executor.submit(_run_limited, self.cpu_limit, func, args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            result = future.result()
+        except ParseTimeout:
+            self._count('timed_out')
+            raise
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a fresh pool for the next task
+            self._count('crashed')
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        self._count('completed')
+        return result
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: a forked copy of a threaded web worker could inherit held locks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker
+                )
+            return self._executor
+
+    def _count(self, outcome):
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, processes=self.processes, running=self._executor is not None)
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+pool = ParsePool()
+
+
+def run(func, *args):
+    return pool.run(func, *args)
+
+
+def disable():
+    """Parse in the calling thread from now on (for processes that are workers already)"""
+    pool.close()
+    pool.processes = 0
+
+
+def close():
+    pool.close()
+
+
+atexit.register(close)
@@ -0,0 +1,191 @@
+import os
+import time
+import hmac
+import queue
+import atexit
+import random
+import pstats
+import cProfile
+import threading
+import contextvars
+
+import logs
+
+# Profiling is opt-in per request: send "X-Profile: 1" (timings only) or
+# "X-Profile: cpu" (timings plus a cProfile dump) together with
+# "X-Profile-Token: <PROFILE_TOKEN>", or sample a fraction of requests with
+# PROFILE_SAMPLE_RATE. Without PROFILE_TOKEN the headers are ignored, so
+# clients can't switch profiling on. When nothing applies the only cost is
+# one ContextVar lookup per stage.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = "X-Profile"
+PROFILE_TOKEN_HEADER = "X-Profile-Token"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_DIR_MAX_BYTES = int(os.getenv("PROFILE_DIR_MAX_BYTES", str(100 * 1024 * 1024)))
+# cProfile dumps waiting to be written; more are dropped
+PROFILE_QUEUE_SIZE = int(os.getenv("PROFILE_QUEUE_SIZE", "8"))
+
+_current = contextvars.ContextVar('profile_session', default=None)
+_retention_lock = threading.Lock()
+
+
+class ProfileSession:
+    """Stage timings (and optionally a cProfile) for one request"""
+    __slots__ = ('timings', 'profiler', 'start')
+
+    def __init__(self, capture_cpu):
+        self.timings = []
+        self.profiler = cProfile.Profile() if capture_cpu else None
+        self.start = time.perf_counter()
+
+
+def authorized(token):
+    return bool(PROFILE_TOKEN) and bool(token) and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+def wants_profile(headers):
+    """
+    Decide from the request headers and sample rate whether to profile;
+    returns None, 'timings' or 'cpu'
+    """
+    header_value = headers.get(PROFILE_HEADER)
+    if header_value and authorized(headers.get(PROFILE_TOKEN_HEADER)):
+        value = header_value.strip().lower()
+        if value == 'cpu':
+            return 'cpu'
+        if value in ('1', 'true', 'yes', 'timings'):
+            return 'timings'
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return 'cpu'
+    return None
+
+
+def start(mode):
+    """Begin profiling the current request; returns a token for finish()"""
+    if not mode:
+        return None
+    session = ProfileSession(capture_cpu=(mode == 'cpu'))
+    token = _current.set(session)
+    if session.profiler:
+        try:
+            session.profiler.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            session.profiler = None
+    return token, session
+
+
+def record(stage, seconds):
+    """Called by metrics.time_stage for every stage; a no-op unless profiling"""
+    session = _current.get()
+    if session is not None:
+        session.timings.append((stage, seconds))
+
+
+def finish(started, label='request'):
+    """Stop profiling; returns the Server-Timing header value"""
+    token, session = started
+    _current.reset(token)
+    total = time.perf_counter() - session.start
+
+    if session.profiler:
+        session.profiler.disable()
+        writer.submit(session.profiler, label)
+
+    return server_timing(session.timings, total)
+
+
+def server_timing(timings, total):
+    """Format stage timings as a Server-Timing header value"""
+    parts = []
+    counts = {}
+    for stage, seconds in timings:
+        # The same stage can run more than once (e.g. several DB writes)
+        counts[stage] = counts.get(stage, 0) + 1
+        name = stage.replace('.', '-')
+        if counts[stage] > 1:
+            name = f"{name}-{counts[stage]}"
+        parts.append(f"{name};dur={seconds * 1000:.2f}")
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ', '.join(parts)
+
+
+class ProfileWriter:
+    """Writes cProfile dumps (and trims PROFILE_DIR) on a background thread, off the request path"""
+
+    def __init__(self, max_queue=PROFILE_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, profiler, label):
+        """Queue a stopped profiler; returns False if the queue was full and it was dropped"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-writer", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((profiler, label))
+        except queue.Full:
+            logs.warning('profile_dropped', label=label)
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                save_profile(*item)
+            finally:
+                self._queue.task_done()
+
+    def close(self, timeout=5):
+        """Write what is queued, then stop the thread"""
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+
+def save_profile(profiler, label):
+    """Write a .prof file to PROFILE_DIR and trim the directory to its size budget"""
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        filename = f"{int(time.time() * 1000)}-{os.getpid()}-{label}.prof"
+        pstats.Stats(profiler).dump_stats(os.path.join(PROFILE_DIR, filename))
+        enforce_retention()
+    except Exception as e:
+        logs.warning('profile_save_failed', label=label, error=str(e))
+
+
+def enforce_retention():
+    """Delete the oldest profiles until PROFILE_DIR fits in PROFILE_DIR_MAX_BYTES"""
+    with _retention_lock:
+        entries = []
+        for name in os.listdir(PROFILE_DIR):
+            if not name.endswith('.prof'):
+                continue
+            path = os.path.join(PROFILE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= PROFILE_DIR_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+writer = ProfileWriter()
+atexit.register(writer.close)
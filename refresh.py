@@ -0,0 +1,390 @@
+"""
+Staleness-driven re-scraping of chatbots.
+
+Every bot with a snapshot gets a refresh_schedule row: when it is next
+checked and its current interval. A check re-scrapes the site and compares
+the new context hash with the bot's. A change halves the interval, down to
+REFRESH_MIN_INTERVAL. No change grows it by half, up to
+REFRESH_MAX_INTERVAL, so rarely changing sites are checked less and less.
+Failures back off exponentially.
+
+Due bots are picked most overdue first, under a crawl budget:
+REFRESH_CONCURRENCY scrapes at a time, REFRESH_BYTES_PER_MINUTE of
+downloaded HTML, and at most one fetch per host every REFRESH_HOST_DELAY
+seconds. Bots sharing a website are checked with one scrape. A round pages
+through the due bots past hosts that are busy or cooling down (up to
+REFRESH_SCAN_LIMIT rows), so one slow host never holds up the others.
+
+The budget and host delays are kept in memory, so only one scheduler runs
+checks at a time: each scheduler tries to take a lease on the single
+refresh_leader row every round, and the others stand by until it expires
+(REFRESH_LEADER_LEASE). The budget therefore holds however many processes
+run a scheduler. Checks are also claimed in the database, so a scheduler
+taking over never repeats a check that is still running.
+
+Run it in the app workers (REFRESH_ENABLED=true) or as its own process:
+
+    python refresh.py run
+    python refresh.py status [--company-id 12]
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+import logs
+import metrics
+import database
+import scraper
+import scrape_codec
+import write_behind
+
+REFRESH_ENABLED = os.getenv("REFRESH_ENABLED", "false").lower() == "true"
+# Scrapes in flight at once
+REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY", "2"))
+# HTML downloaded per minute (0 = unlimited)
+REFRESH_BYTES_PER_MINUTE = int(os.getenv("REFRESH_BYTES_PER_MINUTE", str(20 * 1024 * 1024)))
+# Seconds between two fetches from the same host
+REFRESH_HOST_DELAY = float(os.getenv("REFRESH_HOST_DELAY", "60"))
+# Bounds and starting point of each bot's check interval (seconds)
+REFRESH_MIN_INTERVAL = int(os.getenv("REFRESH_MIN_INTERVAL", str(6 * 3600)))
+REFRESH_DEFAULT_INTERVAL = int(os.getenv("REFRESH_DEFAULT_INTERVAL", str(24 * 3600)))
+REFRESH_MAX_INTERVAL = int(os.getenv("REFRESH_MAX_INTERVAL", str(30 * 24 * 3600)))
+# Seconds between scheduling rounds
+REFRESH_POLL_INTERVAL = float(os.getenv("REFRESH_POLL_INTERVAL", "10"))
+# Seconds a claimed check may take before another scheduler may retry it
+REFRESH_LEASE = int(os.getenv("REFRESH_LEASE", "900"))
+# Seconds the active scheduler keeps the lead without renewing it (renewed every round)
+REFRESH_LEADER_LEASE = int(os.getenv("REFRESH_LEADER_LEASE", "60"))
+# Due rows a round reads at most while looking for hosts it may fetch from
+REFRESH_SCAN_LIMIT = int(os.getenv("REFRESH_SCAN_LIMIT", "2000"))
+
+# Bots added to the schedule per round
+SEED_BATCH = 1000
+
+
+def next_interval(interval, changed, min_interval=REFRESH_MIN_INTERVAL, max_interval=REFRESH_MAX_INTERVAL):
+    """Check interval after a successful check"""
+    interval = interval / 2 if changed else interval * 1.5
+    return int(min(max_interval, max(min_interval, interval)))
+
+
+def failure_delay(interval, failures, min_interval=REFRESH_MIN_INTERVAL, max_interval=REFRESH_MAX_INTERVAL):
+    """Seconds until the next attempt after the given number of consecutive failures"""
+    return int(min(max_interval, max(min_interval, interval) * 2 ** min(failures - 1, 16)))
+
+
+def host_of(website_url):
+    return (urlsplit(website_url).hostname or website_url).lower()
+
+
+class RefreshScheduler:
+    """Picks due bots each round and re-scrapes them on a small thread pool"""
+
+    def __init__(self, concurrency=REFRESH_CONCURRENCY, bytes_per_minute=REFRESH_BYTES_PER_MINUTE,
+                 host_delay=REFRESH_HOST_DELAY, poll_interval=REFRESH_POLL_INTERVAL,
+                 leader_lease=REFRESH_LEADER_LEASE):
+        self.concurrency = concurrency
+        self.bytes_per_minute = bytes_per_minute
+        self.host_delay = host_delay
+        self.poll_interval = poll_interval
+        self.leader_lease = max(leader_lease, int(poll_interval * 2) + 1)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._leading = False
+        self._lock = threading.Lock()
+        self._in_flight = {}  # host -> company_ids being checked
+        self._host_ready = {}  # host -> time.time() its next fetch may start
+        self._bandwidth = float(bytes_per_minute)
+        self._refilled_at = time.time()
+        self._totals = {'checked': 0, 'changed': 0, 'failed': 0, 'bytes': 0}
+        self._executor = None
+        self._stop = threading.Event()
+        self._thread = None
+        write_behind.register(self)
+
+    def start(self):
+        """Run scheduling rounds on a background thread"""
+        if self._thread is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="refresh")
+            self._thread = threading.Thread(target=self._run, name="refresh-scheduler", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._leading:
+            self._leading = False
+            database.release_refresh_lead(self.owner)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logs.error('refresh_round_failed', error=str(e))
+            self._stop.wait(self.poll_interval)
+
+    def _refill(self, now):
+        # Called with the lock held
+        if self.bytes_per_minute > 0:
+            rate = self.bytes_per_minute / 60.0
+            self._bandwidth = min(float(self.bytes_per_minute), self._bandwidth + (now - self._refilled_at) * rate)
+        self._refilled_at = now
+
+    def lead(self):
+        """Take or renew the lead; True if this scheduler is the one that runs checks"""
+        now = datetime.now()
+        lease_until = (now + timedelta(seconds=self.leader_lease)).replace(microsecond=0)
+        leading = database.acquire_refresh_lead(self.owner, now, lease_until)
+        if leading != self._leading:
+            if leading:
+                logs.info('refresh_lead_acquired', owner=self.owner)
+            else:
+                logs.warning('refresh_lead_lost', owner=self.owner)
+            self._leading = leading
+        return leading
+
+    def tick(self):
+        """
+        One scheduling round: if this scheduler leads, schedule new bots, then
+        start due checks the budget allows; returns how many
+        """
+        if not self.lead():
+            return 0
+        self.seed()
+        now = time.time()
+        with self._lock:
+            self._refill(now)
+            free = self.concurrency - sum(len(ids) for ids in self._in_flight.values())
+            if free <= 0 or (self.bytes_per_minute > 0 and self._bandwidth <= 0):
+                return 0
+            busy = {host for host, ready in self._host_ready.items() if ready > now} | set(self._in_flight)
+
+        # Bots sharing a website are checked together; one group per host per round.
+        # Pages past the rows of busy hosts until every free slot has a group
+        groups = {}
+        hosts = set()
+        due_by = datetime.now()
+        after = None
+        scanned = 0
+        while len(groups) < free and scanned < REFRESH_SCAN_LIMIT:
+            page = database.get_due_refreshes(due_by, free * 4, after)
+            for refresh in page:
+                host = host_of(refresh['website_url'])
+                site = scrape_codec.canonical_url(refresh['website_url'])
+                if site in groups:
+                    groups[site].append(refresh)
+                elif host not in busy and host not in hosts and len(groups) < free:
+                    groups[site] = [refresh]
+                    hosts.add(host)
+            scanned += len(page)
+            if len(page) < free * 4:
+                break
+            after = (page[-1]['next_refresh_at'], page[-1]['company_id'])
+        if not groups:
+            return 0
+
+        lease_until = (datetime.now() + timedelta(seconds=REFRESH_LEASE)).replace(microsecond=0)
+        claimed = set(database.claim_refreshes(
+            [(refresh['company_id'], refresh['next_refresh_at']) for group in groups.values() for refresh in group],
+            lease_until
+        ))
+
+        started = 0
+        for group in groups.values():
+            group = [refresh for refresh in group if refresh['company_id'] in claimed]
+            if not group:
+                continue
+            host = host_of(group[0]['website_url'])
+            with self._lock:
+                self._in_flight[host] = [refresh['company_id'] for refresh in group]
+                self._host_ready[host] = now + self.host_delay
+            self._executor.submit(self._check, host, group)
+            started += 1
+        return started
+
+    def _check(self, host, group):
+        try:
+            self.check(group)
+        except Exception as e:
+            logs.error('refresh_failed', website_url=group[0]['website_url'], error=str(e))
+        finally:
+            with self._lock:
+                self._in_flight.pop(host, None)
+                self._host_ready[host] = time.time() + self.host_delay
+
+    def check(self, group):
+        """Re-scrape one website and update the bots that use it; returns the company_ids that changed"""
+        website_url = group[0]['website_url']
+        with metrics.time_stage('refresh') as stage:
+            result = scraper.scrape_website(website_url)
+            checked_at = datetime.now().replace(microsecond=0)
+            with self._lock:
+                self._bandwidth -= result.get('bytes', 0)
+                self._totals['bytes'] += result.get('bytes', 0)
+                self._totals['checked'] += len(group)
+
+            changed = []
+            if result['success']:
+                context = scraper.format_scraped_data_for_ai(result)
+                changed = [refresh for refresh in group
+                           if scrape_codec.context_hash(refresh['website_url'], context) != refresh['context_hash']]
+                if changed and database.save_scraped_companies([
+                    (refresh['company_name'], refresh['website_url'], result['data'], context) for refresh in changed
+                ]) is None:
+                    result = {'success': False, 'error': 'database write failed'}
+
+            if not result['success']:
+                stage.outcome = 'failed'
+                rows = []
+                for refresh in group:
+                    failures = refresh['consecutive_failures'] + 1
+                    rows.append((checked_at + timedelta(seconds=failure_delay(refresh['interval_s'], failures)),
+                                 refresh['interval_s'], checked_at, None, 0, failures,
+                                 (result.get('error') or 'scrape failed')[:500], refresh['company_id']))
+                database.record_refreshes(rows)
+                with self._lock:
+                    self._totals['failed'] += len(group)
+                return []
+
+            stage.outcome = 'changed' if changed else 'unchanged'
+            changed_ids = {refresh['company_id'] for refresh in changed}
+            rows = []
+            for refresh in group:
+                was_changed = refresh['company_id'] in changed_ids
+                interval = next_interval(refresh['interval_s'], was_changed)
+                rows.append((checked_at + timedelta(seconds=interval), interval, checked_at,
+                             checked_at if was_changed else None, int(was_changed), 0, None, refresh['company_id']))
+            database.record_refreshes(rows)
+            with self._lock:
+                self._totals['changed'] += len(changed)
+
+        if changed:
+            # Bots resident in this process answer from the new content right away
+            from chatbot_registry import registry
+            for refresh in changed:
+                registry.replace(refresh['company_id'], refresh['company_name'], refresh['website_url'], context)
+        return sorted(changed_ids)
+
+    def seed(self, limit=SEED_BATCH, default_interval=REFRESH_DEFAULT_INTERVAL):
+        """Schedule bots that have no refresh_schedule row yet; returns how many"""
+        now = datetime.now()
+        rows = []
+        for company_id, updated_at in database.get_unscheduled_companies(limit):
+            # Jittered so bots onboarded together don't all come due together
+            due = (updated_at or now) + timedelta(seconds=default_interval * random.uniform(0.5, 1.0))
+            rows.append((company_id, max(due, now).replace(microsecond=0), default_interval))
+        database.add_refresh_schedule(rows)
+        return len(rows)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            self._refill(now)
+            return {
+                'running': self._thread is not None and not self._stop.is_set(),
+                'leading': self._leading,
+                'owner': self.owner,
+                'concurrency': self.concurrency,
+                'in_flight': sum(len(ids) for ids in self._in_flight.values()),
+                'hosts_in_flight': sorted(self._in_flight),
+                'hosts_cooling_down': sum(1 for ready in self._host_ready.values() if ready > now),
+                'bandwidth_bytes_per_minute': self.bytes_per_minute or None,
+                'bandwidth_available_bytes': int(self._bandwidth) if self.bytes_per_minute else None,
+                'totals': dict(self._totals)
+            }
+
+
+def refresh_entry(row):
+    return {
+        'company_id': row['company_id'],
+        'company_name': row['company_name'],
+        'website_url': row['website_url'],
+        'next_refresh_at': row['next_refresh_at'].isoformat(),
+        'interval_s': row['interval_s'],
+        'last_checked_at': row['last_checked_at'].isoformat() if row['last_checked_at'] else None,
+        'last_changed_at': row['last_changed_at'].isoformat() if row['last_changed_at'] else None,
+        'checks': row['checks'],
+        'changes': row['changes'],
+        'change_ratio': round(row['changes'] / row['checks'], 3) if row['checks'] else None,
+        'consecutive_failures': row['consecutive_failures'],
+        'last_error': row['last_error']
+    }
+
+
+def schedule_report(company_id=None, limit=20):
+    """Queue depth and upcoming refreshes (or one company's schedule) with this process's scheduler state"""
+    schedule = database.get_refresh_schedule(datetime.now(), company_id, limit)
+    if schedule is None:
+        return {'success': False, 'error': 'The refresh schedule is not available without a database'}
+
+    report = {
+        'success': True,
+        'enabled': REFRESH_ENABLED,
+        'scheduled': schedule['scheduled'],
+        'queue_depth': schedule['due'],
+        'scheduler': scheduler.stats(),
+        'refreshes': [refresh_entry(row) for row in schedule['refreshes']]
+    }
+    if company_id is not None:
+        report['company_id'] = company_id
+    return report
+
+
+scheduler = RefreshScheduler()
+
+
+def start():
+    """Start the scheduler in this process if REFRESH_ENABLED"""
+    if REFRESH_ENABLED:
+        scheduler.start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-scrape chatbots whose websites may have changed")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('run', help="run the scheduler in the foreground")
+    status = subcommands.add_parser('status', help="show the queue and upcoming refreshes")
+    status.add_argument('--company-id', type=int)
+    status.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    conn = database.get_connection()
+    if conn is None:
+        print("Database is not reachable")
+        return 1
+    conn.close()
+
+    if args.command == 'status':
+        report = schedule_report(args.company_id, args.limit)
+        print(f"{report['scheduled']} bots scheduled, {report['queue_depth']} due")
+        for refresh in report['refreshes']:
+            print(f"{refresh['next_refresh_at']}  every {refresh['interval_s'] / 3600:.1f}h  "
+                  f"{refresh['changes']}/{refresh['checks']} changed  {refresh['company_name']} ({refresh['website_url']})"
+                  + (f"  failing: {refresh['last_error']}" if refresh['consecutive_failures'] else ''))
+        return 0
+
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(60)
+            stats = scheduler.stats()
+            print(f"Refresh: {stats['totals']['checked']} checked, {stats['totals']['changed']} changed, "
+                  f"{stats['totals']['failed']} failed, {stats['in_flight']} in flight"
+                  + ("" if stats['leading'] else " (standing by: another scheduler leads)"))
+    except KeyboardInterrupt:
+        scheduler.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
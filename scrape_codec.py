@@ -0,0 +1,62 @@
+import json
+import zlib
+import hashlib
+from urllib.parse import urlsplit
+
+# Bump when the encoded layout changes; decode() rejects versions it doesn't know
+SNAPSHOT_FORMAT_VERSION = 1
+SUPPORTED_VERSIONS = (1,)
+
+
+def encode(obj):
+    """Compact JSON, zlib-compressed"""
+    return zlib.compress(json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8'), 6)
+
+
+def decode(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def canonical_url(website_url):
+    """
+    Site identity for content addressing: host (lowercase, no www. or default
+    port), path without trailing slash and query; the scheme is ignored
+    """
+    parts = urlsplit(website_url.strip() if '//' in website_url else '//' + website_url.strip())
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port not in (None, 80, 443):
+        host = f"{host}:{parts.port}"
+    canonical = host + parts.path.rstrip('/')
+    return f"{canonical}?{parts.query}" if parts.query else canonical
+
+
+def context_hash(website_url, context):
+    """
+    Content address of a bot's context: the same site with the same content
+    hashes the same for every tenant, so they share memory, storage and answers
+    """
+    digest = hashlib.sha256(canonical_url(website_url).encode('utf-8'))
+    digest.update(b'\n')
+    digest.update(context.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def encode_snapshot(website_url, scraped_data, context):
+    """Everything needed to rebuild a bot without re-scraping: (version, scraped_blob, context_blob, context_hash)"""
+    return (
+        SNAPSHOT_FORMAT_VERSION,
+        encode(scraped_data),
+        zlib.compress(context.encode('utf-8'), 6),
+        context_hash(website_url, context)
+    )
+
+
+def decode_snapshot(format_version, scraped_blob, context_blob):
+    """Returns (scraped_data, context), or None for an unknown format version"""
+    if format_version not in SUPPORTED_VERSIONS:
+        return None
+    scraped_data = decode(scraped_blob) if scraped_blob else None
+    context = zlib.decompress(context_blob).decode('utf-8')
+    return scraped_data, context
@@ -1,8 +1,52 @@
+import asyncio
+import aiohttp
 import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import parse_pool
+
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'Cache-Control': 'max-age=0',
+    'DNT': '1',
+    'sec-ch-ua': '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+}
+
+BASIC_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+}
+
+SCRAPE_ERROR = 'Unable to access website. It may have anti-scraping protection. Try a different URL or the company blog/documentation page.'
+
+# Parsing failures that fetching the page again would not fix
+PARSE_ERRORS = {
+    parse_pool.ParseTimeout: 'Website is too large or complex to process. Try a smaller page of the site.',
+    parse_pool.ParsePoolBusy: 'Too many websites are being processed right now. Please try again shortly.'
+}
+
+def normalize_url(url):
+    """Ensure URL has protocol"""
+    url = url.strip()
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return url
 
 def scrape_website(url):
     """
@@ -16,42 +60,30 @@ def scrape_website(url):
     ]
     
     for strategy in strategies:
-        try:
-            result = strategy(url)
-            if result['success']:
-                return result
-        except:
-            continue
+        with metrics.time_stage(strategy.__name__.replace('scrape_with_', 'scrape.')) as stage:
+            try:
+                result = strategy(url)
+                if result['success']:
+                    return result
+                stage.outcome = 'failed'
+            except tuple(PARSE_ERRORS) as e:
+                stage.outcome = 'error'
+                return {'success': False, 'error': PARSE_ERRORS[type(e)], 'url': url}
+            except:
+                stage.outcome = 'error'
+                continue
     
     # If all strategies fail, return error
     return {
         'success': False,
-        'error': 'Unable to access website. It may have anti-scraping protection. Try a different URL or the company blog/documentation page.',
+        'error': SCRAPE_ERROR,
         'url': url
     }
 
 def scrape_with_session(url):
     """Strategy 1: Full browser simulation with session"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1',
-        'Sec-Fetch-Dest': 'document',
-        'Sec-Fetch-Mode': 'navigate',
-        'Sec-Fetch-Site': 'none',
-        'Sec-Fetch-User': '?1',
-        'Cache-Control': 'max-age=0',
-        'DNT': '1',
-        'sec-ch-ua': '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"Windows"',
-    }
-    
     session = requests.Session()
-    session.headers.update(headers)
+    session.headers.update(BROWSER_HEADERS)
     
     # Add small delay to appear more human
     time.sleep(0.5)
@@ -63,12 +95,7 @@ def scrape_with_session(url):
 
 def scrape_with_basic_headers(url):
     """Strategy 2: Simple headers"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-    }
-    
-    response = requests.get(url, headers=headers, timeout=15, allow_redirects=True)
+    response = requests.get(url, headers=BASIC_HEADERS, timeout=15, allow_redirects=True)
     response.raise_for_status()
     
     return process_response(response, url)
@@ -80,9 +107,72 @@ def scrape_with_minimal_request(url):
     
     return process_response(response, url)
 
+# (stage name, headers, timeout seconds, delay seconds) for each async strategy,
+# mirroring scrape_with_session / scrape_with_basic_headers / scrape_with_minimal_request
+ASYNC_STRATEGIES = [
+    ('scrape.session', BROWSER_HEADERS, 20, 0.5),
+    ('scrape.basic_headers', BASIC_HEADERS, 15, 0),
+    ('scrape.minimal_request', None, 10, 0)
+]
+
+async def scrape_website_async(url, session=None):
+    """
+    Async version of scrape_website for the asyncio serving mode.
+    Fetching never blocks the event loop; HTML parsing runs in the parse pool,
+    waited on from the default executor.
+    """
+    own_session = session is None
+    if own_session:
+        session = aiohttp.ClientSession()
+    
+    loop = asyncio.get_running_loop()
+    
+    try:
+        for stage_name, headers, timeout, delay in ASYNC_STRATEGIES:
+            with metrics.time_stage(stage_name) as stage:
+                try:
+                    if delay:
+                        await asyncio.sleep(delay)
+                    
+                    async with session.get(url, headers=headers, allow_redirects=True,
+                                           timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                        response.raise_for_status()
+                        content = await response.read()
+                        encoding = response.charset
+                    
+                    result = await loop.run_in_executor(None, metrics.in_context(process_html, content, url, encoding))
+                    if result['success']:
+                        return result
+                    stage.outcome = 'failed'
+                except tuple(PARSE_ERRORS) as e:
+                    stage.outcome = 'error'
+                    return {'success': False, 'error': PARSE_ERRORS[type(e)], 'url': url}
+                except Exception:
+                    stage.outcome = 'error'
+                    continue
+    finally:
+        if own_session:
+            await session.close()
+    
+    return {
+        'success': False,
+        'error': SCRAPE_ERROR,
+        'url': url
+    }
+
 def process_response(response, url):
     """Process the HTTP response and extract data"""
-    soup = BeautifulSoup(response.content, 'html.parser')
+    return process_html(response.content, url, response.encoding)
+
+@metrics.timed('parse')
+def process_html(content, url, encoding=None):
+    """Extract data from raw HTML in a parser process (see parse_pool)"""
+    return parse_pool.run(extract_html, content, url, encoding)
+
+def extract_html(content, url, encoding=None):
+    """Parse raw HTML and extract data"""
+    html_text = content.decode(encoding or 'utf-8', errors='replace')
+    soup = BeautifulSoup(content, 'html.parser')
     
     # Remove unwanted elements
     for element in soup(["script", "style", "noscript", "iframe", "svg"]):
@@ -95,9 +185,8 @@ def process_response(response, url):
         'headings': extract_all_headings(soup),
         'paragraphs': extract_all_paragraphs(soup),
         'lists': extract_all_lists(soup),
-        'contact_info': extract_contact_info(soup, response.text),
-        'sections': extract_all_sections(soup),
-        'full_text': extract_full_text(soup)
+        'contact_info': extract_contact_info(soup, html_text),
+        'sections': extract_all_sections(soup)
     }
     
     # Validate we got meaningful data
@@ -113,7 +202,8 @@ def process_response(response, url):
     return {
         'success': True,
         'data': scraped_data,
-        'url': url
+        'url': url,
+        'bytes': len(content)
     }
 
 def extract_title(soup):
@@ -203,12 +293,7 @@ def extract_all_sections(soup):
     
     return dict(list(sections.items())[:20])  # Limit to 20 sections
 
-def extract_full_text(soup):
-    """Extract all visible text"""
-    text = soup.get_text(separator=' ', strip=True)
-    text = re.sub(r'\s+', ' ', text)
-    return text[:25000]  # 25000 characters
-
+@metrics.timed('format')
 def format_scraped_data_for_ai(scraped_data):
     """Format scraped data into RICH context for AI"""
     if not scraped_data or 'data' not in scraped_data:
@@ -262,3 +347,17 @@ def format_scraped_data_for_ai(scraped_data):
                 sections.append(f"\n[{key[:50]}]:\n{value[:800]}")
     
     return '\n'.join(sections)
+
+def scrape_many(urls, threads=8):
+    """
+    Scrape and format several websites, fetching up to `threads` at a time.
+    Runs in onboarding worker processes; returns [(url, scraped_result, context, scrape_ms)].
+    """
+    def scrape_one(url):
+        start = time.perf_counter()
+        result = scrape_website(url)
+        context = format_scraped_data_for_ai(result) if result['success'] else None
+        return url, result, context, int((time.perf_counter() - start) * 1000)
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(urls)))) as pool:
+        return list(pool.map(scrape_one, urls))
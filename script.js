@@ -14,6 +14,7 @@ const chatStatusText = document.getElementById('chatStatusText');
 // State
 let isChatbotReady = false;
 let currentCompanyName = '';
+let currentCompanyId = localStorage.getItem('companyId');
 
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
@@ -61,6 +62,8 @@ async function createChatbot() {
         if (data.success) {
             isChatbotReady = true;
             currentCompanyName = companyName;
+            currentCompanyId = data.company_id;
+            localStorage.setItem('companyId', data.company_id);
 
             // Show success message
             showStatusMessage(`✅ Connected to API successfully!`, 'success');
@@ -121,6 +124,7 @@ async function sendMessage() {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
+                company_id: currentCompanyId,
                 question: question
             })
         });
@@ -155,8 +159,12 @@ async function sendMessage() {
 
 // Check Chatbot Status
 async function checkChatbotStatus() {
+    if (!currentCompanyId) {
+        return;
+    }
+
     try {
-        const response = await fetch(`${API_BASE_URL}/chatbot-status`);
+        const response = await fetch(`${API_BASE_URL}/chatbot-status?company_id=${encodeURIComponent(currentCompanyId)}`);
         const data = await response.json();
 
         if (data.ready) {
@@ -51,8 +51,10 @@ try:
             user_id INT DEFAULT 1,
             company_name VARCHAR(255) NOT NULL,
             website_url VARCHAR(500) NOT NULL,
+            daily_token_budget INT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            UNIQUE KEY uniq_company_site (company_name, website_url),
             INDEX idx_company_name (company_name)
         )
     """)
@@ -64,7 +66,7 @@ try:
             id INT AUTO_INCREMENT PRIMARY KEY,
             company_id INT NOT NULL,
             content_type VARCHAR(50),
-            content_text TEXT,
+            content_text MEDIUMTEXT,
             metadata JSON,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
@@ -82,13 +84,156 @@ try:
             user_question TEXT NOT NULL,
             bot_response TEXT NOT NULL,
             response_time_ms INT,
+            cached BOOLEAN NOT NULL DEFAULT FALSE,
+            fallback BOOLEAN NOT NULL DEFAULT FALSE,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
-            INDEX idx_company_id_created (company_id, created_at)
+            INDEX idx_company_created_id (company_id, created_at, id),
+            INDEX idx_created_at (created_at)
         )
     """)
     print("✓ Chat history table created!")
     
+    # Create chat analytics rollup tables (hourly/daily counters + latency sketch bins)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_rollups (
+            company_id INT NOT NULL,
+            granularity ENUM('hour', 'day') NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            chats INT NOT NULL DEFAULT 0,
+            cached_chats INT NOT NULL DEFAULT 0,
+            fallback_chats INT NOT NULL DEFAULT 0,
+            total_response_ms BIGINT NOT NULL DEFAULT 0,
+            last_chat_at DATETIME NULL,
+            PRIMARY KEY (company_id, granularity, bucket_start),
+            FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+            INDEX idx_granularity_bucket (granularity, bucket_start)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_latency_bins (
+            company_id INT NOT NULL,
+            granularity ENUM('hour', 'day') NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            bin SMALLINT NOT NULL,
+            count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (company_id, granularity, bucket_start, bin),
+            FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+            INDEX idx_granularity_bucket (granularity, bucket_start)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_history_archive (
+            id INT PRIMARY KEY,
+            company_id INT NOT NULL,
+            user_question TEXT NOT NULL,
+            bot_response TEXT NOT NULL,
+            response_time_ms INT,
+            cached BOOLEAN NOT NULL DEFAULT FALSE,
+            fallback BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMP NULL,
+            INDEX idx_company_id_created (company_id, created_at)
+        )
+    """)
+    print("✓ Chat analytics tables created!")
+    
+    # Create shared_contexts table (scrape + AI context stored once per site/content)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS shared_contexts (
+            context_hash CHAR(64) PRIMARY KEY,
+            website_url VARCHAR(500) NOT NULL,
+            format_version SMALLINT NOT NULL,
+            scraped_blob LONGBLOB NOT NULL,
+            context_blob LONGBLOB NOT NULL,
+            scraped_at DATETIME NOT NULL,
+            INDEX idx_url_scraped_at (website_url, scraped_at)
+        )
+    """)
+    print("✓ Shared contexts table created!")
+    
+    # Create company_snapshots table (which shared context each bot uses)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS company_snapshots (
+            company_id INT PRIMARY KEY,
+            format_version SMALLINT NOT NULL,
+            scraped_blob LONGBLOB NOT NULL,
+            context_blob LONGBLOB NOT NULL,
+            context_hash CHAR(64) NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+            INDEX idx_updated_at (updated_at),
+            INDEX idx_context_hash (context_hash)
+        )
+    """)
+    print("✓ Company snapshots table created!")
+    
+    # Create context_answers table (Gemini answers kept across restarts, shared per context)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS context_answers (
+            context_hash CHAR(64) NOT NULL,
+            question_hash CHAR(64) NOT NULL,
+            response MEDIUMTEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at DATETIME NOT NULL,
+            PRIMARY KEY (context_hash, question_hash),
+            INDEX idx_expires_at (expires_at)
+        )
+    """)
+    print("✓ Context answers table created!")
+    
+    # Create api_usage table (Gemini requests and tokens per company per day)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS api_usage (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NULL,
+            company_id INT NULL,
+            api_name VARCHAR(50),
+            usage_date DATE NULL,
+            request_count INT DEFAULT 0,
+            error_count INT DEFAULT 0,
+            tokens_used BIGINT DEFAULT 0,
+            prompt_tokens BIGINT DEFAULT 0,
+            output_tokens BIGINT DEFAULT 0,
+            total_latency_ms BIGINT DEFAULT 0,
+            last_request_at TIMESTAMP NULL,
+            quota_reset_at TIMESTAMP NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uniq_company_api_day (company_id, api_name, usage_date),
+            CONSTRAINT fk_api_usage_company FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+            INDEX idx_user_api (user_id, api_name),
+            INDEX idx_usage_date_tokens (usage_date, tokens_used)
+        )
+    """)
+    print("✓ API usage table created!")
+    
+    # Create refresh_schedule table (when each bot is next re-scraped)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS refresh_schedule (
+            company_id INT PRIMARY KEY,
+            next_refresh_at DATETIME NOT NULL,
+            interval_s INT NOT NULL,
+            last_checked_at DATETIME NULL,
+            last_changed_at DATETIME NULL,
+            checks INT NOT NULL DEFAULT 0,
+            changes INT NOT NULL DEFAULT 0,
+            consecutive_failures INT NOT NULL DEFAULT 0,
+            last_error VARCHAR(500) NULL,
+            FOREIGN KEY (company_id) REFERENCES companies(id) ON DELETE CASCADE,
+            INDEX idx_next_refresh_at (next_refresh_at)
+        )
+    """)
+    print("✓ Refresh schedule table created!")
+    
+    # Create refresh_leader table (the one active refresh scheduler)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS refresh_leader (
+            id TINYINT PRIMARY KEY,
+            owner VARCHAR(128) NOT NULL,
+            lease_until DATETIME NOT NULL
+        )
+    """)
+    print("✓ Refresh leader table created!")
+    
     # Create user_sessions table
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS user_sessions (
@@ -119,6 +264,10 @@ try:
     print("  - companies (linked to users)")
     print("  - scraped_data")
     print("  - chat_history (linked to users)")
+    print("  - shared_contexts, company_snapshots")
+    print("  - context_answers")
+    print("  - api_usage")
+    print("  - chat_rollups, chat_latency_bins, chat_history_archive")
     print("  - user_sessions")
     print("\nYou can now run: python app.py")
     
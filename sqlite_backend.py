@@ -0,0 +1,395 @@
+"""
+Embedded SQLite storage for database.py (DB_BACKEND=sqlite).
+
+Each thread keeps one connection to the database file, opened in WAL mode so
+readers never block the single writer. Connections and cursors are wrapped to
+look like mysql.connector's, so the functions in database.py run unchanged:
+%s placeholders are rewritten to ? (once per statement text, after which
+sqlite3's statement cache reuses the prepared statement) and NOW()/GREATEST()
+are registered as SQL functions. Statements whose syntax differs live in SQL.
+"""
+import sqlite3
+import threading
+from datetime import datetime
+
+# Local-time ISO text both ways, matching how MySQL hands back DATETIME/TIMESTAMP
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('DATETIME', lambda raw: datetime.fromisoformat(raw.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda raw: datetime.fromisoformat(raw.decode()))
+
+Error = sqlite3.Error
+
+LOCAL_NOW = "(datetime('now', 'localtime'))"
+
+SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS companies (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        company_name TEXT NOT NULL,
+        website_url TEXT NOT NULL,
+        daily_token_budget INTEGER NULL,
+        created_at TIMESTAMP DEFAULT {LOCAL_NOW},
+        updated_at TIMESTAMP DEFAULT {LOCAL_NOW},
+        UNIQUE (company_name, website_url)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_company_name ON companies (company_name)",
+    f"""
+    CREATE TABLE IF NOT EXISTS scraped_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        company_id INTEGER NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+        content_type TEXT,
+        content_text TEXT,
+        metadata TEXT,
+        created_at TIMESTAMP DEFAULT {LOCAL_NOW}
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_scraped_company_id ON scraped_data (company_id)",
+    f"""
+    CREATE TABLE IF NOT EXISTS chat_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        company_id INTEGER NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+        user_question TEXT NOT NULL,
+        bot_response TEXT NOT NULL,
+        response_time_ms INTEGER,
+        cached BOOLEAN NOT NULL DEFAULT 0,
+        fallback BOOLEAN NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT {LOCAL_NOW}
+    )
+    """,
+    "DROP INDEX IF EXISTS idx_chat_company_id_created",
+    "CREATE INDEX IF NOT EXISTS idx_chat_company_created_id ON chat_history (company_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_created_at ON chat_history (created_at)",
+    """
+    CREATE TABLE IF NOT EXISTS chat_history_archive (
+        id INTEGER PRIMARY KEY,
+        company_id INTEGER NOT NULL,
+        user_question TEXT NOT NULL,
+        bot_response TEXT NOT NULL,
+        response_time_ms INTEGER,
+        cached BOOLEAN NOT NULL DEFAULT 0,
+        fallback BOOLEAN NOT NULL DEFAULT 0,
+        created_at TIMESTAMP NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_archive_company_id_created ON chat_history_archive (company_id, created_at)",
+    """
+    CREATE TABLE IF NOT EXISTS chat_rollups (
+        company_id INTEGER NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+        granularity TEXT NOT NULL CHECK (granularity IN ('hour', 'day')),
+        bucket_start DATETIME NOT NULL,
+        chats INTEGER NOT NULL DEFAULT 0,
+        cached_chats INTEGER NOT NULL DEFAULT 0,
+        fallback_chats INTEGER NOT NULL DEFAULT 0,
+        total_response_ms INTEGER NOT NULL DEFAULT 0,
+        last_chat_at DATETIME NULL,
+        PRIMARY KEY (company_id, granularity, bucket_start)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_rollups_granularity_bucket ON chat_rollups (granularity, bucket_start)",
+    """
+    CREATE TABLE IF NOT EXISTS chat_latency_bins (
+        company_id INTEGER NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+        granularity TEXT NOT NULL CHECK (granularity IN ('hour', 'day')),
+        bucket_start DATETIME NOT NULL,
+        bin INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (company_id, granularity, bucket_start, bin)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_bins_granularity_bucket ON chat_latency_bins (granularity, bucket_start)",
+    f"""
+    CREATE TABLE IF NOT EXISTS shared_contexts (
+        context_hash TEXT PRIMARY KEY,
+        website_url TEXT NOT NULL,
+        format_version INTEGER NOT NULL,
+        scraped_blob BLOB NOT NULL,
+        context_blob BLOB NOT NULL,
+        scraped_at DATETIME NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_shared_url_scraped_at ON shared_contexts (website_url, scraped_at)",
+    f"""
+    CREATE TABLE IF NOT EXISTS company_snapshots (
+        company_id INTEGER PRIMARY KEY REFERENCES companies(id) ON DELETE CASCADE,
+        format_version INTEGER NOT NULL,
+        scraped_blob BLOB NOT NULL,
+        context_blob BLOB NOT NULL,
+        context_hash TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT {LOCAL_NOW}
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_snapshots_updated_at ON company_snapshots (updated_at)",
+    "CREATE INDEX IF NOT EXISTS idx_snapshots_context_hash ON company_snapshots (context_hash)",
+    f"""
+    CREATE TABLE IF NOT EXISTS context_answers (
+        context_hash TEXT NOT NULL,
+        question_hash TEXT NOT NULL,
+        response TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT {LOCAL_NOW},
+        expires_at DATETIME NOT NULL,
+        PRIMARY KEY (context_hash, question_hash)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_context_answers_expires_at ON context_answers (expires_at)",
+    "DROP TABLE IF EXISTS answer_cache",
+    f"""
+    CREATE TABLE IF NOT EXISTS api_usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NULL,
+        company_id INTEGER NULL REFERENCES companies(id) ON DELETE CASCADE,
+        api_name TEXT,
+        usage_date DATE NULL,
+        request_count INTEGER DEFAULT 0,
+        error_count INTEGER DEFAULT 0,
+        tokens_used INTEGER DEFAULT 0,
+        prompt_tokens INTEGER DEFAULT 0,
+        output_tokens INTEGER DEFAULT 0,
+        total_latency_ms INTEGER DEFAULT 0,
+        last_request_at TIMESTAMP NULL,
+        quota_reset_at TIMESTAMP NULL,
+        created_at TIMESTAMP DEFAULT {LOCAL_NOW},
+        UNIQUE (company_id, api_name, usage_date)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_usage_date_tokens ON api_usage (usage_date, tokens_used)",
+    """
+    CREATE TABLE IF NOT EXISTS refresh_schedule (
+        company_id INTEGER PRIMARY KEY REFERENCES companies(id) ON DELETE CASCADE,
+        next_refresh_at DATETIME NOT NULL,
+        interval_s INTEGER NOT NULL,
+        last_checked_at DATETIME NULL,
+        last_changed_at DATETIME NULL,
+        checks INTEGER NOT NULL DEFAULT 0,
+        changes INTEGER NOT NULL DEFAULT 0,
+        consecutive_failures INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_refresh_next ON refresh_schedule (next_refresh_at)",
+    """
+    CREATE TABLE IF NOT EXISTS refresh_leader (
+        id INTEGER PRIMARY KEY,
+        owner TEXT NOT NULL,
+        lease_until DATETIME NOT NULL
+    )
+    """,
+]
+
+# SQLite spellings of the statements in database.MYSQL_SQL
+SQL = {
+    # RETURNING id sets cursor.lastrowid (see SQLiteCursor.execute) for new and existing companies
+    'upsert_company': (
+        "INSERT INTO companies (company_name, website_url) VALUES (%s, %s) "
+        "ON CONFLICT (company_name, website_url) DO UPDATE SET updated_at = NOW() RETURNING id"
+    ),
+    'upsert_chat_rollup': (
+        "INSERT INTO chat_rollups "
+        "(company_id, granularity, bucket_start, chats, cached_chats, fallback_chats, total_response_ms, last_chat_at) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) "
+        "ON CONFLICT (company_id, granularity, bucket_start) DO UPDATE SET chats = chats + excluded.chats, "
+        "cached_chats = cached_chats + excluded.cached_chats, "
+        "fallback_chats = fallback_chats + excluded.fallback_chats, "
+        "total_response_ms = total_response_ms + excluded.total_response_ms, "
+        "last_chat_at = GREATEST(last_chat_at, excluded.last_chat_at)"
+    ),
+    'upsert_chat_latency_bin': (
+        "INSERT INTO chat_latency_bins (company_id, granularity, bucket_start, bin, count) "
+        "VALUES (%s, %s, %s, %s, %s) "
+        "ON CONFLICT (company_id, granularity, bucket_start, bin) DO UPDATE SET count = count + excluded.count"
+    ),
+    'insert_ignore': "INSERT OR IGNORE",
+    'prune_chat_latency_bins': (
+        "DELETE FROM chat_latency_bins WHERE rowid IN ("
+        "SELECT rowid FROM chat_latency_bins WHERE granularity = %s AND bucket_start < %s LIMIT %s)"
+    ),
+    'prune_chat_rollups': (
+        "DELETE FROM chat_rollups WHERE rowid IN ("
+        "SELECT rowid FROM chat_rollups WHERE granularity = %s AND bucket_start < %s LIMIT %s)"
+    ),
+    'upsert_api_usage': (
+        "INSERT INTO api_usage (company_id, api_name, usage_date, request_count, error_count, "
+        "prompt_tokens, output_tokens, total_latency_ms, last_request_at, tokens_used) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+        "ON CONFLICT (company_id, api_name, usage_date) DO UPDATE SET "
+        "request_count = request_count + excluded.request_count, "
+        "error_count = error_count + excluded.error_count, "
+        "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+        "output_tokens = output_tokens + excluded.output_tokens, "
+        "total_latency_ms = total_latency_ms + excluded.total_latency_ms, "
+        "tokens_used = tokens_used + excluded.tokens_used, "
+        "last_request_at = GREATEST(last_request_at, excluded.last_request_at)"
+    ),
+    'upsert_shared_context': (
+        "INSERT INTO shared_contexts (context_hash, website_url, format_version, scraped_blob, context_blob, scraped_at) "
+        "VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (context_hash) DO UPDATE SET scraped_at = excluded.scraped_at"
+    ),
+    'purge_expired_answers': (
+        "DELETE FROM context_answers WHERE rowid IN ("
+        "SELECT rowid FROM context_answers WHERE expires_at <= %s LIMIT %s)"
+    ),
+}
+
+_translated = {}
+
+
+def translate(statement):
+    """mysql.connector paramstyle (%s) to sqlite3's (?)"""
+    translated = _translated.get(statement)
+    if translated is None:
+        translated = _translated[statement] = statement.replace('%s', '?')
+    return translated
+
+
+def _greatest(*values):
+    present = [value for value in values if value is not None]
+    return max(present) if present else None
+
+
+class SQLiteCursor:
+    """mysql.connector-style cursor: %s placeholders, dictionary rows, lastrowid from RETURNING"""
+
+    def __init__(self, raw, dictionary=False):
+        self._cursor = raw.cursor()
+        self._dictionary = dictionary
+        self.lastrowid = None
+
+    def execute(self, statement, params=()):
+        sql = translate(statement)
+        self._cursor.execute(sql, params)
+        self.lastrowid = self._cursor.lastrowid
+        if ' RETURNING ' in sql:
+            row = self._cursor.fetchone()
+            self.lastrowid = row[0] if row else None
+            # Let the statement finish so the write is part of the transaction
+            self._cursor.fetchall()
+
+    def executemany(self, statement, rows):
+        self._cursor.executemany(translate(statement), rows)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._as_dict(row) if self._dictionary and row is not None else row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        return [self._as_dict(row) for row in rows] if self._dictionary else rows
+
+    def _as_dict(self, row):
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """Checked-out handle on the calling thread's connection; close() leaves it open for reuse"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._closed = False
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self._raw, dictionary)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._pool._release(self._raw)
+
+
+class SQLiteConnectionPool:
+    """
+    One SQLite connection per thread (sqlite3 connections must stay on the
+    thread that opened them), opened lazily on first use.
+    """
+
+    def __init__(self, path, busy_timeout=5.0, cached_statements=256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    @property
+    def available(self):
+        return True
+
+    def get_connection(self, timeout=None):
+        raw = getattr(self._local, 'raw', None)
+        if raw is None:
+            raw = self._local.raw = self._open()
+            self._local.depth = 0
+        self._local.depth += 1
+        return SQLiteConnection(self, raw)
+
+    def stats(self):
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'journal_mode': 'wal',
+            'open': self._opened
+        }
+
+    def _open(self):
+        raw = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=self.cached_statements
+        )
+        raw.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: durable across application crashes, fsync only at checkpoints
+        raw.execute("PRAGMA synchronous=NORMAL")
+        raw.execute("PRAGMA foreign_keys=ON")
+        raw.create_function('NOW', 0, lambda: datetime.now().isoformat(' '))
+        raw.create_function('GREATEST', -1, _greatest)
+        with self._lock:
+            self._opened += 1
+        return raw
+
+    def _release(self, raw):
+        self._local.depth -= 1
+        # Never leave a half-finished transaction for the thread's next caller
+        if self._local.depth == 0 and raw.in_transaction:
+            raw.rollback()
+
+
+# Upgrades for database files created by older versions
+SCHEMA_MIGRATIONS = [
+    "ALTER TABLE companies ADD COLUMN daily_token_budget INTEGER NULL",
+]
+
+
+def create_tables(conn):
+    """Create the schema on a SQLite connection"""
+    cursor = conn.cursor()
+    try:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+        for statement in SCHEMA_MIGRATIONS:
+            try:
+                cursor.execute(statement)
+            except Error as err:
+                # The migration already ran
+                if 'duplicate column name' not in str(err):
+                    raise
+        conn.commit()
+    finally:
+        cursor.close()
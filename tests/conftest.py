@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import database against a throwaway SQLite file, so importing it never
+# tries to reach a MySQL server; each test then picks its backend
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='chatbot-tests-'), 'import.db')
+
+import database
+import sqlite_backend
+from db_pool import ConnectionPool
+
+# MySQL runs only against a dedicated database (every test empties its tables)
+MYSQL_CONFIG = {
+    'host': os.getenv("TEST_DB_HOST", "localhost"),
+    'user': os.getenv("TEST_DB_USER", "root"),
+    'password': os.getenv("TEST_DB_PASSWORD", ""),
+    'database': os.getenv("TEST_DB_NAME", "chatbot_test")
+}
+
+# Children before parents, so foreign keys never block a delete
+TABLES = [
+    'refresh_leader', 'refresh_schedule', 'api_usage', 'context_answers', 'company_snapshots', 'shared_contexts',
+    'chat_latency_bins', 'chat_rollups', 'chat_history_archive', 'chat_history', 'scraped_data', 'companies'
+]
+
+
+@pytest.fixture(scope='session')
+def mysql_pool():
+    pool = ConnectionPool(MYSQL_CONFIG, size=2, max_overflow=2, timeout=5, reconnect_interval=3600)
+    if not pool.available:
+        pytest.skip(f"MySQL test database {MYSQL_CONFIG['database']} on {MYSQL_CONFIG['host']} is not reachable")
+    return pool
+
+
+@pytest.fixture(params=['sqlite', 'mysql'])
+def db(request, tmp_path, monkeypatch):
+    """The database module pointed at an empty database of each backend"""
+    if request.param == 'sqlite':
+        pool = sqlite_backend.SQLiteConnectionPool(str(tmp_path / 'test.db'))
+        sql = sqlite_backend.SQL
+    else:
+        pool = request.getfixturevalue('mysql_pool')
+        sql = database.MYSQL_SQL
+    monkeypatch.setattr(database, 'DB_BACKEND', request.param)
+    monkeypatch.setattr(database, 'SQL', sql)
+    monkeypatch.setattr(database, 'connection_pool', pool)
+
+    assert database.create_tables()
+    if request.param == 'mysql':
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        for table in TABLES:
+            cursor.execute(f"DELETE FROM {table}")
+        conn.commit()
+        cursor.close()
+        conn.close()
+    return database
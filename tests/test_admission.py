@@ -0,0 +1,116 @@
+"""admission.AdmissionController: slots, the fair queue and rejections"""
+import time
+import threading
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def controller(max_concurrent=1, max_queue=4, max_queue_per_client=2, queue_timeout=5):
+    return AdmissionController('test', max_concurrent, max_queue, max_queue_per_client, queue_timeout)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def queue_up(admission, client_id, granted):
+    """Start a request from client_id that records when it gets a slot; returns once it is queued"""
+    waiting = admission.stats()['waiting']
+
+    def request():
+        admission.acquire(client_id)
+        granted.append(client_id)
+
+    thread = threading.Thread(target=request, daemon=True)
+    thread.start()
+    wait_for(lambda: admission.stats()['waiting'] == waiting + 1)
+    return thread
+
+
+def test_admits_up_to_the_limit_then_queues():
+    admission = controller(max_concurrent=2)
+    admission.acquire('a')
+    admission.acquire('b')
+    assert admission.stats()['active'] == 2
+
+    granted = []
+    thread = queue_up(admission, 'c', granted)
+    assert granted == []
+    admission.release()
+    thread.join(5)
+    assert granted == ['c']
+    assert admission.stats() == dict(admission.stats(), active=2, waiting=0)
+
+
+def test_freed_slots_go_round_robin_across_clients():
+    admission = controller(max_queue_per_client=3)
+    admission.acquire('noisy')
+    granted = []
+    threads = [queue_up(admission, client_id, granted) for client_id in ('noisy', 'noisy', 'noisy', 'quiet')]
+
+    for count in range(1, 5):
+        admission.release()
+        wait_for(lambda: len(granted) == count)
+    for thread in threads:
+        thread.join(5)
+    # The quiet client's one request doesn't wait behind the noisy client's backlog
+    assert granted == ['noisy', 'quiet', 'noisy', 'noisy']
+
+
+def test_per_client_limit_and_full_queue():
+    admission = controller(max_queue=2, max_queue_per_client=1)
+    admission.acquire('a')
+    granted = []
+    threads = [queue_up(admission, 'a', granted)]
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.acquire('a')
+    assert rejected.value.status == 429
+    # One running and one waiting, at the initial 1s service time, one slot
+    assert rejected.value.retry_after == 2
+
+    threads.append(queue_up(admission, 'b', granted))
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.acquire('c')
+    assert (rejected.value.status, rejected.value.retry_after) == (503, 3)
+
+    for _ in threads:
+        admission.release()
+    for thread in threads:
+        thread.join(5)
+    assert granted == ['a', 'b']
+
+
+def test_queue_timeout():
+    admission = controller(queue_timeout=0.05)
+    admission.acquire('a')
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.acquire('b')
+    assert rejected.value.status == 503 and rejected.value.retry_after >= 1
+    # The timed-out request left the queue without taking a slot
+    assert (admission.stats()['active'], admission.stats()['waiting']) == (1, 0)
+    admission.release()
+    admission.acquire('b')
+
+
+def test_retry_after_follows_service_time():
+    admission = controller(max_concurrent=2, queue_timeout=0.01)
+    for _ in range(20):
+        with admission.admit('a'):
+            pass
+    # Near-instant requests bring the estimate down to the one-second floor
+    assert admission.stats()['avg_service_ms'] < 200
+    admission.acquire('a')
+    admission.acquire('b')
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.acquire('c')
+    assert rejected.value.retry_after == 1
+
+    admission.release(service_time=30)
+    admission.release(service_time=30)
+    assert admission.stats()['avg_service_ms'] > 4000
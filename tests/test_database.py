@@ -0,0 +1,217 @@
+"""database.py against both backends (the db fixture runs each test on SQLite and MySQL)"""
+from datetime import date, datetime, timedelta
+
+import scrape_codec
+from db_pool import ConnectionPool, PoolTimeout
+
+
+def scraped(title, paragraphs=3):
+    return {
+        'title': title,
+        'meta_description': f"{title} builds software",
+        'headings': [f"{title} heading {i}" for i in range(2)],
+        'paragraphs': [f"{title} paragraph {i}" for i in range(paragraphs)],
+        'lists': ['Web Development services', 'Mobile Apps services'],
+        'sections': {'contact': f"Contact {title} today"},
+        'contact_info': {'emails': ['hello@example.com'], 'phones': ['+65 6123 0001']}
+    }
+
+
+def add_company(db, name='Acme', url='https://acme.example', context=None):
+    data = scraped(name)
+    return db.save_scraped_company(name, url, data, context or f"Company: {name}\n{url}")
+
+
+def test_save_scraped_companies_upserts(db):
+    companies = [
+        ('Acme', 'https://acme.example', scraped('Acme'), 'Company: Acme'),
+        ('Beta', 'https://beta.example', scraped('Beta'), 'Company: Beta'),
+    ]
+    ids = db.save_scraped_companies(companies)
+    assert len(set(ids)) == 2 and all(company_id > 0 for company_id in ids)
+
+    # Saving the same companies again updates them in place
+    changed = [('Acme', 'https://acme.example', scraped('Acme', paragraphs=5), 'Company: Acme v2'), companies[1]]
+    assert db.save_scraped_companies(changed) == ids
+
+    data = db.get_company_data(ids[0])
+    paragraphs = [row for row in data['scraped_data'] if row['content_type'] == 'paragraph']
+    assert len(paragraphs) == 5
+    assert db.get_company_snapshot(ids[0])['context'] == 'Company: Acme v2'
+
+
+def test_save_scraped_companies_same_company_twice_in_a_batch(db):
+    ids = db.save_scraped_companies([
+        ('Acme', 'https://acme.example', scraped('Acme'), 'first'),
+        ('Acme', 'https://acme.example', scraped('Acme'), 'second'),
+    ])
+    assert ids[0] == ids[1]
+    assert db.get_company_snapshot(ids[0])['context'] == 'second'
+
+
+def test_get_company_snapshot(db):
+    company_id = add_company(db, context='Company: Acme\nServices: web')
+    snapshot = db.get_company_snapshot(company_id)
+    assert snapshot['company_id'] == company_id
+    assert snapshot['company_name'] == 'Acme'
+    assert snapshot['website_url'] == 'https://acme.example'
+    assert snapshot['context'] == 'Company: Acme\nServices: web'
+    assert snapshot['scraped_data']['title'] == 'Acme'
+    assert snapshot['context_hash'] == scrape_codec.context_hash('https://acme.example', 'Company: Acme\nServices: web')
+    assert db.get_company_snapshot(company_id + 1000) is None
+
+
+def test_snapshots_share_one_context(db):
+    first = add_company(db, 'Acme', 'https://acme.example', 'same content')
+    second = add_company(db, 'Acme Reseller', 'https://www.acme.example/', 'same content')
+    assert db.get_company_snapshot(first)['context_hash'] == db.get_company_snapshot(second)['context_hash']
+    assert db.get_shared_scrape('https://acme.example')['context'] == 'same content'
+
+
+def test_cached_answer(db):
+    now = datetime.now().replace(microsecond=0)
+    assert db.save_cached_answers([
+        ('ctx', 'q1', 'Answer one', now + timedelta(hours=1)),
+        ('ctx', 'q2', 'Expired', now - timedelta(seconds=1)),
+    ])
+    assert db.get_cached_answer('ctx', 'q1') == 'Answer one'
+    assert db.get_cached_answer('ctx', 'q2') is None
+    assert db.get_cached_answer('other', 'q1') is None
+
+    # Storing the same question again replaces the answer
+    assert db.save_cached_answers([('ctx', 'q1', 'Answer two', now + timedelta(hours=1))])
+    assert db.get_cached_answer('ctx', 'q1') == 'Answer two'
+    assert db.purge_expired_answers_batch(100) == 1
+
+
+def test_cached_answer_lookup_gives_up_on_busy_pool(db, monkeypatch):
+    class BusyPool:
+        def get_connection(self, timeout=None):
+            assert timeout == db.ANSWER_LOOKUP_TIMEOUT
+            raise PoolTimeout(f"No database connection free after {timeout}s")
+
+    monkeypatch.setattr(db, 'connection_pool', BusyPool())
+    assert db.get_cached_answer('ctx', 'q1') is None
+
+
+def test_chat_history_keyset_pagination(db):
+    company_id = add_company(db)
+    other_id = add_company(db, 'Beta', 'https://beta.example')
+    start = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    # Pairs of rows share a timestamp, so pages must break ties on id
+    rows = [(company_id, f"q{i}", f"a{i}", 10, False, False, start + timedelta(seconds=i // 2)) for i in range(9)]
+    rows.append((other_id, 'other', 'other', 10, False, False, start))
+    assert db.save_chat_history_batch(rows)
+
+    for newest_first in (True, False):
+        seen = []
+        after = None
+        while True:
+            records, next_position = db.get_chat_history_page(company_id, 4, after, newest_first)
+            seen += records
+            if next_position is None:
+                break
+            # Positions survive the round trip through the opaque cursor
+            after = db.decode_history_cursor(db.encode_history_cursor(*next_position))
+            assert after == next_position
+        questions = [record['question'] for record in seen]
+        assert len(seen) == 9 and len(set(record['id'] for record in seen)) == 9
+        expected = [f"q{i}" for i in range(9)]
+        assert questions == (expected[::-1] if newest_first else expected)
+
+    records, _ = db.get_chat_history_page(company_id, 50, since=start + timedelta(seconds=2),
+                                          until=start + timedelta(seconds=3))
+    assert sorted(record['question'] for record in records) == ['q4', 'q5']
+
+
+def test_usage_budgets(db):
+    company_id = add_company(db)
+    other_id = add_company(db, 'Beta', 'https://beta.example')
+    today = date.today()
+    now = datetime.now().replace(microsecond=0)
+    assert db.save_api_usage([(company_id, 'gemini', today, 2, 0, 100, 50, 300, now)])
+    assert db.save_api_usage([(company_id, 'gemini', today, 1, 1, 10, 5, 100, now)])
+
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE companies SET daily_token_budget = %s WHERE id = %s", (1000, company_id))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    budgets = db.get_token_budgets([company_id, other_id], 'gemini', today)
+    assert budgets == {company_id: (1000, 165), other_id: (None, 0)}
+    assert db.get_token_budgets([company_id], 'gemini', today - timedelta(days=1)) == {company_id: (1000, 0)}
+
+    usage = db.get_api_usage(today)
+    assert len(usage) == 1
+    assert (usage[0]['request_count'], usage[0]['error_count'], usage[0]['tokens_used']) == (3, 1, 165)
+
+
+def test_refresh_claims(db):
+    company_id = add_company(db)
+    assert db.get_unscheduled_companies(10)[0][0] == company_id
+
+    due_at = datetime.now().replace(microsecond=0) - timedelta(minutes=1)
+    assert db.add_refresh_schedule([(company_id, due_at, 3600)])
+    # Scheduling again leaves the existing row alone
+    assert db.add_refresh_schedule([(company_id, due_at + timedelta(days=1), 60)])
+    assert db.get_unscheduled_companies(10) == []
+
+    now = datetime.now()
+    due = db.get_due_refreshes(now, 10)
+    assert [row['company_id'] for row in due] == [company_id]
+    assert due[0]['interval_s'] == 3600 and due[0]['website_url'] == 'https://acme.example'
+
+    # Only the first of two schedulers that read the same row gets it
+    claim = [(company_id, due[0]['next_refresh_at'])]
+    lease_until = (now + timedelta(minutes=15)).replace(microsecond=0)
+    assert db.claim_refreshes(claim, lease_until) == [company_id]
+    assert db.claim_refreshes(claim, lease_until) == []
+    assert db.get_due_refreshes(now, 10) == []
+
+    checked_at = now.replace(microsecond=0)
+    assert db.record_refreshes([(checked_at + timedelta(hours=2), 7200, checked_at, checked_at, 1, 0, None, company_id)])
+    schedule = db.get_refresh_schedule(now, company_id)
+    row = schedule['refreshes'][0]
+    assert (schedule['scheduled'], schedule['due']) == (1, 0)
+    assert (row['interval_s'], row['checks'], row['changes'], row['last_changed_at']) == (7200, 1, 1, checked_at)
+
+
+def test_refresh_lead(db):
+    now = datetime.now().replace(microsecond=0)
+    assert db.acquire_refresh_lead('a', now, now + timedelta(seconds=60))
+    # Held by a until its lease runs out; a renews it
+    assert not db.acquire_refresh_lead('b', now, now + timedelta(seconds=60))
+    assert db.acquire_refresh_lead('a', now + timedelta(seconds=10), now + timedelta(seconds=70))
+    assert not db.acquire_refresh_lead('b', now + timedelta(seconds=69), now + timedelta(seconds=129))
+    assert db.acquire_refresh_lead('b', now + timedelta(seconds=71), now + timedelta(seconds=131))
+    assert not db.acquire_refresh_lead('a', now + timedelta(seconds=72), now + timedelta(seconds=132))
+
+    # Releasing hands the lead over at once; only the holder can release
+    assert db.release_refresh_lead('a')
+    assert not db.acquire_refresh_lead('a', now + timedelta(seconds=73), now + timedelta(seconds=133))
+    assert db.release_refresh_lead('b')
+    assert db.acquire_refresh_lead('a', now + timedelta(seconds=74), now + timedelta(seconds=134))
+
+
+def test_helpers_degrade_when_the_pool_is_exhausted(db, monkeypatch):
+    class FakeConnection:
+        in_transaction = False
+
+        def ping(self, reconnect=False):
+            pass
+
+        def close(self):
+            pass
+
+    pool = ConnectionPool({}, size=1, max_overflow=0, timeout=0.05, connect=lambda **config: FakeConnection())
+    monkeypatch.setattr(db, 'connection_pool', pool)
+    held = pool.get_connection()
+    try:
+        # The only connection is taken: helpers report "no data" instead of raising PoolTimeout
+        assert db.get_shared_scrape('https://acme.example') is None
+        assert db.get_company_snapshot(1) is None
+        assert db.save_chat_history_batch([(1, 'q', 'a', 10, False, False, datetime.now())]) is False
+    finally:
+        held.close()
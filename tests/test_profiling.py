@@ -0,0 +1,58 @@
+"""profiling.py: who may turn profiling on, and dumps written off the request thread"""
+import os
+import threading
+
+import profiling
+
+
+def test_profile_headers_need_the_token(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATE', 0)
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', '')
+    assert profiling.wants_profile({'X-Profile': 'cpu', 'X-Profile-Token': ''}) is None
+
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', 's3cret')
+    assert profiling.wants_profile({'X-Profile': 'cpu'}) is None
+    assert profiling.wants_profile({'X-Profile': 'cpu', 'X-Profile-Token': 'wrong'}) is None
+    assert profiling.wants_profile({'X-Profile': 'cpu', 'X-Profile-Token': 's3cret'}) == 'cpu'
+    assert profiling.wants_profile({'X-Profile': '1', 'X-Profile-Token': 's3cret'}) == 'timings'
+
+
+def test_dumps_are_written_by_the_writer_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    saved_on = []
+    save_profile = profiling.save_profile
+
+    def recording_save(profiler, label):
+        saved_on.append(threading.current_thread().name)
+        save_profile(profiler, label)
+
+    monkeypatch.setattr(profiling, 'save_profile', recording_save)
+    writer = profiling.ProfileWriter(max_queue=4)
+    monkeypatch.setattr(profiling, 'writer', writer)
+
+    started = profiling.start('cpu')
+    sum(range(1000))
+    assert profiling.finish(started, 'test').startswith('total;dur=')
+    writer.close()
+
+    assert saved_on == ['profile-writer']
+    assert [name for name in os.listdir(tmp_path) if name.endswith('-test.prof')]
+
+
+def test_full_queue_drops_dumps(monkeypatch):
+    release = threading.Event()
+    writing = threading.Event()
+
+    def slow_save(profiler, label):
+        writing.set()
+        release.wait(5)
+
+    monkeypatch.setattr(profiling, 'save_profile', slow_save)
+    writer = profiling.ProfileWriter(max_queue=1)
+    assert writer.submit(object(), 'first')
+    assert writing.wait(5)
+    assert writer.submit(object(), 'queued')
+    # The thread is busy and the queue is full
+    assert not writer.submit(object(), 'dropped')
+    release.set()
+    writer.close()
@@ -0,0 +1,115 @@
+"""refresh.RefreshScheduler: claims, host limits and the crawl budget"""
+import time
+from datetime import datetime, timedelta
+
+import scraper
+from refresh import RefreshScheduler, next_interval, failure_delay
+
+
+class RecordingExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+
+
+def schedule(db, companies, due_at):
+    """Save and schedule (company_name, website_url) bots, the first most overdue"""
+    ids = db.save_scraped_companies([
+        (name, url, {'title': name, 'paragraphs': [name]}, f"Company: {name}\n{url}") for name, url in companies
+    ])
+    assert db.add_refresh_schedule([
+        (company_id, due_at + timedelta(seconds=i), 3600) for i, company_id in enumerate(ids)
+    ])
+    return ids
+
+
+def scheduler(concurrency=2, **kwargs):
+    refresh_scheduler = RefreshScheduler(concurrency=concurrency, host_delay=60, poll_interval=1, **kwargs)
+    refresh_scheduler._executor = RecordingExecutor()
+    return refresh_scheduler
+
+
+def test_busy_host_does_not_starve_the_others(db):
+    due_at = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    busy_ids = schedule(db, [(f"Busy {i}", f"https://busy.example/page{i}") for i in range(10)], due_at)
+    other_id = schedule(db, [('Other', 'https://other.example')], due_at + timedelta(minutes=1))[0]
+
+    refresh_scheduler = scheduler()
+    refresh_scheduler._in_flight['busy.example'] = [busy_ids[0]]
+    # One slot is free and each page holds 4 rows: the other host is on the third page
+    assert refresh_scheduler.tick() == 1
+    (host, group), = refresh_scheduler._executor.submitted
+    assert host == 'other.example' and [refresh['company_id'] for refresh in group] == [other_id]
+
+def test_one_group_per_host_and_site(db):
+    due_at = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    schedule(db, [('Acme', 'https://acme.example'), ('Acme Reseller', 'https://www.acme.example/'),
+                  ('Acme Blog', 'https://acme.example/blog'), ('Beta', 'https://beta.example')], due_at)
+
+    refresh_scheduler = scheduler(concurrency=3)
+    assert refresh_scheduler.tick() == 2
+    groups = {host: [refresh['company_name'] for refresh in group]
+              for host, group in refresh_scheduler._executor.submitted}
+    # Both spellings of the site share one scrape; the blog waits for the host's next turn
+    assert groups == {'acme.example': ['Acme', 'Acme Reseller'], 'beta.example': ['Beta']}
+    # The claimed checks are no longer due, for this scheduler or another one
+    assert [refresh['company_name'] for refresh in db.get_due_refreshes(datetime.now(), 10)] == ['Acme Blog']
+
+    # The host is cooling down until host_delay passes
+    assert refresh_scheduler.tick() == 0
+
+
+def test_only_the_leader_checks(db):
+    due_at = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    schedule(db, [('Acme', 'https://acme.example')], due_at)
+
+    leader, standby = scheduler(), scheduler()
+    assert leader.tick() == 1
+    assert standby.tick() == 0 and not standby.stats()['leading']
+    assert standby._executor.submitted == []
+
+
+
+def test_bandwidth_budget(db, monkeypatch):
+    due_at = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    schedule(db, [('Acme', 'https://acme.example'), ('Beta', 'https://beta.example')], due_at)
+    refresh_scheduler = scheduler(concurrency=1, bytes_per_minute=6000)
+
+    # A check that downloads more than the minute's budget uses all of it
+    assert refresh_scheduler.tick() == 1
+    (host, group), = refresh_scheduler._executor.submitted
+    page = {'title': 'Acme', 'paragraphs': ['Acme']}
+    monkeypatch.setattr(scraper, 'scrape_website', lambda url: {'success': True, 'data': page, 'bytes': 9000})
+    refresh_scheduler._check(host, group)
+    assert refresh_scheduler.stats()['bandwidth_available_bytes'] < 0
+    assert refresh_scheduler.stats()['totals']['bytes'] == 9000
+
+    # Nothing starts until the budget refills (100 bytes a second)
+    assert refresh_scheduler.tick() == 0
+    refresh_scheduler._refilled_at = time.time() - 60
+    assert refresh_scheduler.tick() == 1
+    assert refresh_scheduler._executor.submitted[-1][0] == 'beta.example'
+
+
+def test_check_schedules_the_next_refresh(db, monkeypatch):
+    due_at = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    company_id = schedule(db, [('Acme', 'https://acme.example')], due_at)[0]
+    refresh_scheduler = scheduler()
+    group = db.get_due_refreshes(datetime.now(), 10)
+
+    monkeypatch.setattr(scraper, 'scrape_website', lambda url: {'success': False, 'error': 'timed out'})
+    assert refresh_scheduler.check(group) == []
+    refresh = db.get_refresh_schedule(datetime.now(), company_id)['refreshes'][0]
+    assert (refresh['consecutive_failures'], refresh['last_error'], refresh['interval_s']) == (1, 'timed out', 3600)
+    assert refresh['next_refresh_at'] >= datetime.now().replace(microsecond=0) + timedelta(seconds=failure_delay(3600, 1) - 5)
+
+    # Content identical to the stored one: no change, and the interval grows
+    data = {'title': 'Acme', 'paragraphs': ['Acme']}
+    monkeypatch.setattr(scraper, 'scrape_website', lambda url: {'success': True, 'data': data, 'bytes': 10})
+    db.save_scraped_company('Acme', 'https://acme.example', data, scraper.format_scraped_data_for_ai({'data': data}))
+    group = [dict(group[0], context_hash=db.get_company_snapshot(company_id)['context_hash'], consecutive_failures=1)]
+    assert refresh_scheduler.check(group) == []
+    refresh = db.get_refresh_schedule(datetime.now(), company_id)['refreshes'][0]
+    assert (refresh['consecutive_failures'], refresh['interval_s']) == (0, next_interval(3600, False))
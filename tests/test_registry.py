@@ -0,0 +1,146 @@
+"""chatbot_registry.ChatbotRegistry: residency, loading and staleness across workers"""
+import threading
+from datetime import datetime
+
+import scraper
+import scrape_codec
+from chatbot_registry import ChatbotRegistry
+from knowledge import CompanyKnowledge
+from refresh import RefreshScheduler
+
+
+def scraped(title, paragraph):
+    return {
+        'title': title,
+        'meta_description': f"{title} builds software",
+        'headings': [],
+        'paragraphs': [paragraph],
+        'lists': [],
+        'sections': {},
+        'contact_info': {'emails': [], 'phones': []}
+    }
+
+
+def bot(company_id, context):
+    return {
+        'company_id': company_id,
+        'company_name': f"Company {company_id}",
+        'website_url': f"https://{company_id}.example",
+        'knowledge': CompanyKnowledge(context),
+        'context_hash': scrape_codec.context_hash('https://example', context),
+        'ready': True
+    }
+
+
+def registry_for(bots, count, released=None, **kwargs):
+    """A registry whose budget fits count of the given (same-sized) bots"""
+    probe = ChatbotRegistry(loader=bots.get, on_release=None, check_interval=0)
+    probe.get(next(iter(bots)))
+    max_bytes = probe.stats()['resident_bytes'] * count
+    return ChatbotRegistry(max_bytes=max_bytes, loader=bots.get, check_interval=0,
+                           on_release=None if released is None else released.append, **kwargs)
+
+
+def test_least_recently_used_bots_are_evicted():
+    bots = {company_id: bot(company_id, f"Context {company_id}") for company_id in (1, 2, 3)}
+    released = []
+    registry = registry_for(bots, 2, released)
+    registry.get(1)
+    registry.get(2)
+    registry.get(1)
+    registry.get(3)
+
+    # 2 was used least recently; its context is released with it
+    assert registry.stats()['resident_bots'] == 2
+    assert registry.stats()['resident_bytes'] <= registry.max_bytes
+    assert released == [bots[2]['context_hash']]
+    registry.evict(1)
+    assert released == [bots[2]['context_hash'], bots[1]['context_hash']]
+    assert registry.stats()['resident_bots'] == 1
+
+
+def test_shared_context_is_counted_once():
+    bots = {company_id: bot(company_id, "Same content") for company_id in (1, 2)}
+    released = []
+    registry = registry_for(bots, 2, released)
+    registry.get(1)
+    one = registry.stats()['resident_bytes']
+    registry.get(2)
+    stats = registry.stats()
+    assert (stats['resident_bots'], stats['shared_contexts']) == (2, 1)
+    assert stats['resident_bytes'] < 2 * one
+    assert registry.get(1)['knowledge'] is registry.get(2)['knowledge']
+
+    # The context stays while one bot still uses it
+    registry.evict(1)
+    assert released == []
+    registry.evict(2)
+    assert released == [bots[1]['context_hash']]
+
+
+def test_newest_bot_stays_even_over_budget():
+    bots = {1: bot(1, "Context"), 2: bot(2, "A much longer context " * 100)}
+    registry = registry_for(bots, 1)
+    registry.get(1)
+    assert registry.get(2) is not None
+    assert registry.stats()['resident_bots'] == 1 and registry.stats()['resident_bytes'] > registry.max_bytes
+
+
+def test_concurrent_gets_load_a_bot_once():
+    gate = threading.Event()
+    calls = []
+
+    def slow_loader(company_id):
+        calls.append(company_id)
+        gate.wait(5)
+        return bot(company_id, "Context")
+
+    registry = ChatbotRegistry(loader=slow_loader, on_release=None, check_interval=0)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get(7))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == [7]
+    assert len(results) == 8 and all(result is results[0] for result in results)
+
+
+def test_missing_bots_are_not_cached_and_replace_needs_a_resident_bot():
+    bots = {}
+    registry = ChatbotRegistry(loader=bots.get, on_release=None, check_interval=0)
+    assert registry.get(1) is None
+    assert not registry.replace(1, 'Acme', 'https://acme.example', "Context")
+    assert registry.stats()['resident_bots'] == 0
+
+    bots[1] = bot(1, "Old context")
+    assert registry.get(1)['knowledge'].text == "Old context"
+    assert registry.replace(1, 'Acme', 'https://acme.example', "New context")
+    assert registry.get(1)['knowledge'].text == "New context"
+
+
+def test_other_workers_drop_bots_a_refresh_changed(db, monkeypatch):
+    data = scraped('Acme', 'We build websites')
+    context = scraper.format_scraped_data_for_ai({'success': True, 'data': data})
+    company_id = db.save_scraped_company('Acme', 'https://acme.example', data, context)
+
+    # A worker that is not the refresh leader has the bot resident
+    worker = ChatbotRegistry(on_release=None, check_interval=3600)
+    old_hash = worker.get(company_id)['context_hash']
+    assert worker.check_against_database() == 0
+
+    # The leader re-scrapes the site and finds new content
+    changed = scraped('Acme', 'We build websites and mobile apps')
+    monkeypatch.setattr(scraper, 'scrape_website', lambda url: {'success': True, 'data': changed, 'bytes': 100})
+    assert db.add_refresh_schedule([(company_id, datetime(2000, 1, 1), 3600)])
+    group = db.get_due_refreshes(datetime.now(), 10)
+    assert RefreshScheduler(poll_interval=1).check(group) == [company_id]
+
+    # Until its next check the worker still answers from the old content; then it reloads
+    assert worker.get(company_id)['context_hash'] == old_hash
+    worker.checked_at = 0
+    bot = worker.get(company_id)
+    assert bot['context_hash'] != old_hash
+    assert 'mobile apps' in bot['knowledge'].text
+    assert worker.stats()['resident_bots'] == 1
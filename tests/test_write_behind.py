@@ -0,0 +1,99 @@
+"""write_behind.WriteBehindQueue: batching, retries and dropping under back-pressure"""
+import time
+import threading
+
+from write_behind import WriteBehindQueue
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class Sink:
+    """flush_func that records batches; fails the first `failures` attempts"""
+
+    def __init__(self, failures=0, gate=None):
+        self.failures = failures
+        self.gate = gate
+        self.attempts = 0
+        self.batches = []
+        self.started = threading.Event()
+        self.written = threading.Event()
+
+    def __call__(self, batch):
+        self.attempts += 1
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.attempts <= self.failures:
+            if self.attempts % 2:
+                raise RuntimeError("database is down")
+            return False
+        self.batches.append(list(batch))
+        self.written.set()
+        return True
+
+
+def test_rows_are_written_in_batches():
+    sink = Sink()
+    writer = WriteBehindQueue('test', sink, max_batch=3, flush_interval=0.5)
+    for row in range(7):
+        assert writer.submit(row)
+    # Two full batches, then the last row once the interval passes
+    wait_for(lambda: sum(len(batch) for batch in sink.batches) == 7)
+    writer.close()
+    assert [len(batch) for batch in sink.batches] == [3, 3, 1]
+    assert [row for batch in sink.batches for row in batch] == list(range(7))
+    assert writer.pending() == 0
+
+
+def test_partial_batch_is_flushed_after_the_interval():
+    sink = Sink()
+    writer = WriteBehindQueue('test', sink, max_batch=100, flush_interval=0.05)
+    writer.submit('row')
+    # Written without close(), once the interval passes
+    assert sink.written.wait(5)
+    assert sink.batches == [['row']]
+    writer.close()
+
+
+def test_failed_batches_are_retried():
+    sink = Sink(failures=2)
+    writer = WriteBehindQueue('test', sink, max_batch=10, flush_interval=0.01, max_retries=3)
+    writer.submit('row')
+    # One exception and one False return, then the write succeeds
+    assert sink.written.wait(5)
+    assert sink.attempts == 3 and sink.batches == [['row']]
+    writer.close()
+
+
+def test_batch_is_given_up_after_max_retries():
+    sink = Sink(failures=2)
+    writer = WriteBehindQueue('test', sink, max_batch=10, flush_interval=0.01, max_retries=2)
+    writer.submit('lost')
+    wait_for(lambda: sink.attempts == 2)
+
+    # The writer moves on to later rows
+    writer.submit('kept')
+    assert sink.written.wait(5)
+    assert sink.attempts == 3 and sink.batches == [['kept']]
+    writer.close()
+
+
+def test_full_queue_drops_rows():
+    gate = threading.Event()
+    sink = Sink(gate=gate)
+    writer = WriteBehindQueue('test', sink, max_batch=1, flush_interval=0.01, max_queue=2, put_timeout=0.01)
+    assert writer.submit(1)
+    # The writer thread is stuck writing row 1; two more fill the queue
+    assert sink.started.wait(5)
+    assert writer.submit(2) and writer.submit(3, block=False)
+    assert not writer.submit(4)
+    assert not writer.submit(5, block=False)
+
+    gate.set()
+    writer.close()
+    assert sink.batches == [[1], [2], [3]]
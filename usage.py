@@ -0,0 +1,184 @@
+import os
+import threading
+from datetime import date, datetime
+
+import logs
+import metrics
+import database
+import write_behind
+
+API_NAME = 'gemini'
+
+# Seconds between flushes of aggregated usage to api_usage
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))
+# Tokens a tenant may use per day before it is answered by the fallback (0 = unlimited).
+# companies.daily_token_budget overrides it per tenant.
+DEFAULT_DAILY_TOKEN_BUDGET = int(os.getenv("DAILY_TOKEN_BUDGET", "0"))
+
+
+class UsageMeter:
+    """
+    Aggregates LLM calls per tenant per day in memory and flushes them to
+    api_usage every flush_interval seconds (one upsert per tenant-day).
+
+    Budgets are checked against today's total as of the last flush (all
+    workers) plus this worker's calls since, so a tenant can overshoot by at
+    most one flush interval's worth of calls.
+    """
+
+    def __init__(self, api_name=API_NAME, flush_interval=USAGE_FLUSH_INTERVAL,
+                 default_budget=DEFAULT_DAILY_TOKEN_BUDGET):
+        self.api_name = api_name
+        self.flush_interval = flush_interval
+        self.default_budget = default_budget
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._day = date.today()
+        self._known = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        write_behind.register(self)
+
+    def record(self, company_id, prompt_tokens=0, output_tokens=0, latency_ms=0, error=False):
+        """Account one LLM call for a tenant"""
+        if company_id is None or company_id <= 0:
+            return
+        self._ensure_started()
+        tokens = prompt_tokens + output_tokens
+        today = date.today()
+        with self._lock:
+            self._roll_day(today)
+            entry = self._pending.get((company_id, today))
+            if entry is None:
+                entry = self._pending[(company_id, today)] = [0, 0, 0, 0, 0, None]
+            entry[0] += 1
+            entry[1] += 1 if error else 0
+            entry[2] += prompt_tokens
+            entry[3] += output_tokens
+            entry[4] += latency_ms
+            entry[5] = datetime.now()
+            known = self._known.get(company_id)
+            if known is not None:
+                known[1] += tokens
+        metrics.LLM_TOKENS.labels('prompt').inc(prompt_tokens)
+        metrics.LLM_TOKENS.labels('output').inc(output_tokens)
+
+    def over_budget(self, company_id):
+        """True if the tenant has used up today's token budget"""
+        if company_id is None or company_id <= 0:
+            return False
+        with self._lock:
+            self._roll_day(date.today())
+            known = self._known.get(company_id)
+            if known is None:
+                # First sight in this worker: allowed until the next flush loads its budget
+                self._known[company_id] = [None, 0]
+                self._ensure_started()
+                return False
+            budget = known[0] if known[0] is not None else self.default_budget
+            return budget > 0 and known[1] >= budget
+
+    def stats(self, company_id):
+        with self._lock:
+            known = self._known.get(company_id) or [None, 0]
+        budget = known[0] if known[0] is not None else self.default_budget
+        return {'tokens_today': known[1], 'daily_token_budget': budget or None}
+
+    def flush(self):
+        """Write aggregated usage and refresh budgets; returns False if the write failed"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                company_ids = list(self._known)
+            rows = [
+                (company_id, self.api_name, day) + tuple(entry)
+                for (company_id, day), entry in sorted(pending.items())
+            ]
+            if rows and not database.save_api_usage(rows):
+                # Keep the counts for the next attempt
+                with self._lock:
+                    for key, entry in pending.items():
+                        current = self._pending.setdefault(key, [0, 0, 0, 0, 0, None])
+                        for i in range(5):
+                            current[i] += entry[i]
+                        current[5] = max(filter(None, (current[5], entry[5])), default=None)
+                return False
+
+            if company_ids:
+                totals = database.get_token_budgets(company_ids, self.api_name, date.today())
+                if totals is not None:
+                    with self._lock:
+                        for company_id, (budget, tokens_today) in totals.items():
+                            # Add back calls recorded since this flush started
+                            unflushed = sum(
+                                entry[2] + entry[3] for (cid, _), entry in self._pending.items() if cid == company_id
+                            )
+                            self._known[company_id] = [budget, tokens_today + unflushed]
+            return True
+
+    def close(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def _roll_day(self, today):
+        # New day: budgets start over (called with the lock held)
+        if today != self._day:
+            self._day = today
+            for known in self._known.values():
+                known[1] = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="usage-meter", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logs.error('usage_flush_failed', error=str(e))
+
+
+def usage_report(company_id=None, day=None, limit=20):
+    """
+    LLM usage from api_usage: the heaviest tenants for a day, or one tenant's
+    recent days with its budget
+    """
+    day = day or date.today()
+    rows = database.get_api_usage(day, company_id, limit)
+    if rows is None:
+        return {'success': False, 'error': 'Usage is not available without a database'}
+
+    entries = []
+    for row in rows:
+        requests = row['request_count'] or 0
+        entries.append({
+            'company_id': row['company_id'],
+            'company_name': row['company_name'],
+            'date': row['usage_date'].isoformat(),
+            'requests': requests,
+            'errors': row['error_count'],
+            'prompt_tokens': row['prompt_tokens'],
+            'output_tokens': row['output_tokens'],
+            'tokens_used': row['tokens_used'],
+            'avg_prompt_tokens': round(row['prompt_tokens'] / requests, 1) if requests else None,
+            'avg_latency_ms': round(row['total_latency_ms'] / requests, 1) if requests else None,
+            'last_request_at': row['last_request_at'].isoformat() if row['last_request_at'] else None,
+            'daily_token_budget': row['daily_token_budget'] or meter.default_budget or None
+        })
+
+    report = {'success': True, 'date': day.isoformat(), 'usage': entries}
+    if company_id is not None:
+        report['company_id'] = company_id
+        report['today'] = meter.stats(company_id)
+    return report
+
+
+meter = UsageMeter()
@@ -0,0 +1,174 @@
+import os
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+
+import logs
+import metrics
+import database
+
+_writers = []
+
+
+class WriteBehindQueue:
+    """
+    Buffers rows in memory and writes them in batches on a background thread.
+
+    A batch is flushed when max_batch rows are waiting or flush_interval seconds
+    have passed since the first one arrived. The buffer holds at most max_queue
+    rows: submit() waits up to put_timeout for room (back-pressure) and then
+    drops the row rather than stall the request. close() drains what is left.
+    """
+
+    def __init__(self, name, flush_func, max_batch=200, flush_interval=1.0,
+                 max_queue=10000, put_timeout=0.05, max_retries=3):
+        self.name = name
+        self.flush_func = flush_func
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._last_error_at = 0
+        register(self)
+
+    def submit(self, row, block=True):
+        """Queue a row for writing; returns False if it had to be dropped"""
+        self._ensure_started()
+        try:
+            if block:
+                self._queue.put(row, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            metrics.WRITE_BEHIND_ROWS.labels(self.name, 'dropped').inc()
+            return False
+        metrics.WRITE_BEHIND_ROWS.labels(self.name, 'queued').inc()
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def close(self, timeout=10):
+        """Stop the writer thread after flushing everything queued"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # Anything submitted after the thread exited (or if it never started)
+        self._drain()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=f"write-behind-{self.name}", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+        self._drain()
+
+    def _collect(self):
+        """Block for the first row, then gather more until the batch is full or the interval passes"""
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        while True:
+            batch = []
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch):
+        metrics.WRITE_BEHIND_BATCH.labels(self.name).observe(len(batch))
+        for attempt in range(self.max_retries):
+            try:
+                if self.flush_func(batch):
+                    metrics.WRITE_BEHIND_ROWS.labels(self.name, 'written').inc(len(batch))
+                    return
+            except Exception as e:
+                self._report(e)
+            if self._stop.is_set():
+                break
+            time.sleep(min(2 ** attempt * 0.1, 2))
+        metrics.WRITE_BEHIND_ROWS.labels(self.name, 'failed').inc(len(batch))
+
+    def _report(self, error):
+        # At most one line every 30s while the database is down
+        now = time.monotonic()
+        if now - self._last_error_at > 30:
+            self._last_error_at = now
+            logs.error('write_behind_flush_failed', queue=self.name, error=str(error))
+
+
+def register(writer):
+    """Have close_all() drain writer (anything with a close(timeout) method) on shutdown"""
+    _writers.append(writer)
+
+
+def close_all(timeout=10):
+    """Drain every write-behind queue (called on shutdown)"""
+    for writer in list(_writers):
+        writer.close(timeout)
+
+
+atexit.register(close_all)
+
+
+def chat_history_row(company_id, question, ai_result):
+    """Row for history_writer: (company_id, user_question, bot_response, response_time_ms, cached, fallback, created_at)"""
+    return (
+        company_id,
+        question,
+        ai_result['response'],
+        ai_result['response_time_ms'],
+        bool(ai_result.get('cached')),
+        bool(ai_result.get('fallback')),
+        datetime.now()
+    )
+
+
+# Chat history rows (see chat_history_row); each batch also updates the analytics rollups
+history_writer = WriteBehindQueue(
+    'chat_history',
+    lambda rows: database.save_chat_history_batch(rows),
+    max_batch=int(os.getenv("HISTORY_BATCH_SIZE", "200")),
+    flush_interval=float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0")),
+    max_queue=int(os.getenv("HISTORY_MAX_QUEUE", "10000"))
+)
+
+# Gemini answers for the database answer store:
+# (context_hash, question_hash, response, expires_at)
+answer_writer = WriteBehindQueue(
+    'answer_cache',
+    lambda rows: database.save_cached_answers(rows),
+    max_batch=int(os.getenv("ANSWER_BATCH_SIZE", "200")),
+    flush_interval=float(os.getenv("ANSWER_FLUSH_INTERVAL", "1.0")),
+    max_queue=int(os.getenv("ANSWER_MAX_QUEUE", "10000"))
+)